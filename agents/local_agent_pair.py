@@ -77,7 +77,15 @@ def main(
     num_games=10,
     slow: bool = False,
     log_to_db: bool = False,
+    virtual_step_s: float = 0.1,
 ):
+    """Plays games between the simple leader and follower agents.
+
+    Unless slow is set, games run on a virtual clock which advances
+    virtual_step_s seconds per state machine step, so they can run faster
+    than real time while turn timeouts stay deterministic. Pass
+    virtual_step_s=None to use the wall clock.
+    """
     nest_asyncio.apply()
     # Disabling most logs improves performance by about 50ms per game.
     logging.basicConfig(level=logging.INFO)
@@ -86,7 +94,10 @@ def main(
     scores = []
     durations = []
     coordinator = LocalGameCoordinator(
-        config, render_leader=False, render_follower=False
+        config,
+        render_leader=False,
+        render_follower=False,
+        virtual_step_s=None if slow else virtual_step_s,
     )
     # If profile=True, play only 1 game, but import viztracer and save the trace to cb2-local.prof.
     if profile:
@@ -6,10 +6,10 @@ not be very diverse.
 """
 
 import logging
-from collections import deque
 
 from agents.agent import Role
 from py_client.game_endpoint import Action, GameState
+from server.pathfinding import FindPath
 
 logger = logging.getLogger(__name__)
 
@@ -154,32 +154,19 @@ def _get_next_card(cards, follower):
 def _find_path_to_card(card, follower, map, cards):
     start_location = follower.location()
     end_location = card.prop_info.location
-    location_queue = deque()
-    location_queue.append((start_location, [start_location]))
+    # Other cards are obstacles.
     card_locations = set([card.prop_info.location for card in cards])
-    if start_location in card_locations:
-        card_locations.remove(start_location)
-    if end_location in card_locations:
-        card_locations.remove(end_location)
-    visited_locations = set()
-    while len(location_queue) > 0:
-        current_location, current_path = location_queue.popleft()
-        if current_location in visited_locations:
-            continue
-        if current_location in card_locations:
-            continue
-        visited_locations.add(current_location)
-        if current_location == end_location:
-            return current_path
-        tile = map.tile_at(current_location)
-        for neighbor in tile.cell.coord.neighbors():
-            if tile.cell.boundary.get_edge_between(tile.cell.coord, neighbor):
-                continue
-            neighbor_tile = map.tile_at(neighbor)
-            if neighbor_tile.cell.boundary.get_edge_between(neighbor, tile.cell.coord):
-                continue
-            location_queue.append((neighbor, current_path + [neighbor]))
-    return None
+    card_locations.discard(start_location)
+    card_locations.discard(end_location)
+
+    def can_move(location, neighbor):
+        if neighbor in card_locations:
+            return False
+        if map.tile_at(neighbor) is None:
+            return False
+        return not map.get_edge_between(location, neighbor)
+
+    return FindPath(start_location, end_location, can_move)
 
 
 def _get_instruction_for_card(card, follower, map, cards):
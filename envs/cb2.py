@@ -9,12 +9,11 @@ from gymnasium import register, spaces
 
 import server.assets as assets
 import server.card as card
-import server.card_enums as card_enums
 import server.hex as hex
-import server.messages.action as action
 import server.messages.live_feedback as live_feedback
-import server.messages.prop as prop
 import server.state as state
+from envs.observation import ColorEnumFromColor  # noqa: F401
+from envs.observation import ObservationBuilder
 from py_client.endpoint_pair import EndpointPair
 from py_client.local_game_coordinator import LocalGameCoordinator
 from py_client.remote_client import RemoteClient
@@ -46,26 +45,6 @@ class FollowActions(Enum):
     MAX = 6
 
 
-def ColorEnumFromColor(color: action.Color):
-    # Black, blue, green, orange, pink, red yellow.
-    if color == action.Color(0, 0, 0, 1):
-        return card_enums.Color.BLACK
-    elif color == action.Color(0, 0, 1, 1):
-        return card_enums.Color.BLUE
-    elif color == action.Color(0, 1, 0, 1):
-        return card_enums.Color.GREEN
-    elif color == action.Color(1, 0.5, 0, 1):
-        return card_enums.Color.ORANGE
-    elif color == action.Color(1, 0, 1, 1):
-        return card_enums.Color.PINK
-    elif color == action.Color(1, 0, 0, 1):
-        return card_enums.Color.RED
-    elif color == action.Color(1, 1, 0, 1):
-        return card_enums.Color.YELLOW
-    else:
-        raise ValueError("Unknown color")
-
-
 class EnvMode(Enum):
     NONE = 0
     # Local mode, no server or network connection. Must specify game name.
@@ -141,6 +120,7 @@ class CerealBar2Env(gym.Env):
         server_queue_type: RemoteClient.QueueType = RemoteClient.QueueType.DEFAULT,
         render_mode: Optional[str] = None,
         max_instruction_length: int = DEFAULT_MAX_INSTRUCTION_LENGTH,
+        numpy_observations: bool = False,
     ):
         """CB2 Env Constructor.
 
@@ -179,6 +159,9 @@ class CerealBar2Env(gym.Env):
             server_queue_type: Server queue to join (leader/remote/default).
             render_mode: Env display mode. "human" for GUI or None for headless.
             max_instruction_length: Max length of instructions in chars.
+            numpy_observations: Return map, card, actor and turn state
+                observations as numpy arrays instead of nested lists. The
+                arrays are reused between steps (see ObservationBuilder).
         """
         assert render_mode is None or render_mode in self.metadata["render_modes"]
         self.render_mode = render_mode
@@ -186,6 +169,8 @@ class CerealBar2Env(gym.Env):
         self.game_info = AuxiliaryInfo()
         self.game_info.env_mode = game_mode
 
+        self.observation_builder = ObservationBuilder(numpy_observations)
+
         self.game_mode = game_mode
         if self.game_mode == EnvMode.LOCAL:
             self.coordinator = game_coordinator
@@ -358,6 +343,7 @@ class CerealBar2Env(gym.Env):
             self.game = self.client.JoinGame(self.server_queue_type)
         else:
             raise ValueError(f"Invalid game mode: {self.game_mode}")
+        self.observation_builder.reset()
         return self.gym_state_from_client_state(self.game.initial_state())
 
     def step(self, action):
@@ -366,89 +352,9 @@ class CerealBar2Env(gym.Env):
     def gym_state_from_client_state(self, state):
         """Converts to OpenAI gym (observation, reward, done, info) from CB2 pyclient state."""
         map_update, props, turn_state, instructions, actors, feedback = state
-        if len(actors) == 2:
-            (leader, follower) = actors
-        else:
-            leader = None
-            follower = actors[0]
-        leader_state = None
-        if leader != None:
-            leader_state = {
-                "location": leader.location().to_offset_coordinates(),
-                "rotation": leader.heading_degrees(),
-            }
-        actors = {
-            "leader": leader_state,
-            "follower": {
-                "location": follower.location().to_offset_coordinates(),
-                "rotation": follower.heading_degrees(),
-            },
-        }
-        asset_ids = [
-            [assets.AssetId.NONE for _ in range(map_update.cols)]
-            for _ in range(map_update.rows)
-        ]
-        boundaries = [
-            [-1 for _ in range(map_update.cols)] for _ in range(map_update.rows)
-        ]
-        orientations = [
-            [0 for _ in range(map_update.cols)] for _ in range(map_update.rows)
-        ]
-        heights = [[0 for _ in range(map_update.cols)] for _ in range(map_update.rows)]
-        layers = [[0 for _ in range(map_update.cols)] for _ in range(map_update.rows)]
-        for tile in map_update.tiles:
-            row, col = tile.cell.coord.to_offset_coordinates()
-            asset_ids[row][col] = tile.asset_id
-            boundaries[row][col] = tile.cell.boundary.edges
-            orientations[row][col] = tile.rotation_degrees
-            heights[row][col] = tile.cell.height
-            layers[row][col] = tile.cell.layer
-        map = {
-            "asset_ids": asset_ids,
-            "boundaries": boundaries,
-            "orientations": orientations,
-            "heights": heights,
-            "layers": layers,
-        }
-        card_counts = [
-            [0 for _ in range(map_update.cols)] for _ in range(map_update.rows)
-        ]
-        card_colors = [
-            [card.Color.NONE for _ in range(map_update.cols)]
-            for _ in range(map_update.rows)
-        ]
-        border_colors = [
-            [card.Color.NONE for _ in range(map_update.cols)]
-            for _ in range(map_update.rows)
-        ]
-        card_shapes = [
-            [card.Shape.NONE for _ in range(map_update.cols)]
-            for _ in range(map_update.rows)
-        ]
-        card_selected = [
-            [False for _ in range(map_update.cols)] for _ in range(map_update.rows)
-        ]
-        for p in props:
-            if p.prop_type == prop.PropType.CARD:
-                (row, col) = p.prop_info.location.to_offset_coordinates()
-                card_counts[row][col] = p.card_init.count
-                card_colors[row][col] = p.card_init.color
-                border_colors[row][col] = ColorEnumFromColor(p.prop_info.border_color)
-                card_shapes[row][col] = p.card_init.shape
-                card_selected[row][col] = p.card_init.selected
-        cards = {
-            "counts": card_counts,
-            "colors": card_colors,
-            "border_colors": border_colors,
-            "shapes": card_shapes,
-            "selected": card_selected,
-        }
-        openai_turn_state = {
-            "role": turn_state.turn,
-            "moves_remaining": [turn_state.moves_remaining],
-            "turns_remaining": [turn_state.turns_left],
-            "score": [turn_state.score],
-        }
+        observation = self.observation_builder.build(
+            map_update, props, turn_state, instructions, actors, feedback
+        )
         action_mask = self.game.action_mask()
         aux_info = AuxiliaryInfo(
             self.game_info.agent_role,
@@ -462,14 +368,7 @@ class CerealBar2Env(gym.Env):
             "aux_info": aux_info,
         }
         return (
-            {
-                "actors": actors,
-                "map": map,
-                "cards": cards,
-                "instructions": instructions,
-                "turn_state": openai_turn_state,
-                "feedback": feedback,
-            },
+            observation,
             turn_state.score,
             turn_state.game_over,
             turn_state.game_over,
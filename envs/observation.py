@@ -0,0 +1,190 @@
+""" Builds CerealBar2Env observations from py_client game state.
+
+Observations are written into numpy arrays which are allocated once per map
+size and reused between steps. The map layers (asset ids, boundaries,
+heights, layers, orientations) only change when the client receives a new
+map, so they're only recomputed then. Card layers are rewritten every step.
+"""
+
+import numpy as np
+
+import server.card as card
+import server.card_enums as card_enums
+import server.messages.action as action
+import server.messages.prop as prop
+
+_COLORS = list(card.Color)
+_SHAPES = list(card.Shape)
+
+
+# Black, blue, green, orange, pink, red yellow.
+_COLOR_ENUMS = {
+    action.Color(0, 0, 0, 1): card_enums.Color.BLACK,
+    action.Color(0, 0, 1, 1): card_enums.Color.BLUE,
+    action.Color(0, 1, 0, 1): card_enums.Color.GREEN,
+    action.Color(1, 0.5, 0, 1): card_enums.Color.ORANGE,
+    action.Color(1, 0, 1, 1): card_enums.Color.PINK,
+    action.Color(1, 0, 0, 1): card_enums.Color.RED,
+    action.Color(1, 1, 0, 1): card_enums.Color.YELLOW,
+}
+
+
+def ColorEnumFromColor(color: action.Color):
+    color_enum = _COLOR_ENUMS.get(color, None)
+    if color_enum is None:
+        raise ValueError("Unknown color")
+    return color_enum
+
+
+class ObservationBuilder(object):
+    """Converts py_client state into the CerealBar2Env observation dict.
+
+    If numpy_observations is true, map, card, actor and turn state values are
+    returned as numpy arrays with the dtypes of the observation space.
+    Otherwise they're converted to nested python lists (with card colors and
+    shapes as enums), which is what CerealBar2Env has always returned.
+
+    In numpy mode the returned arrays are reused by the next call to build().
+    Copy them if you need to keep an observation around.
+    """
+
+    def __init__(self, numpy_observations: bool = False):
+        self._numpy_observations = numpy_observations
+        self._map_update = None
+        self._shape = None
+        self._map_layers = None
+        self._card_layers = None
+
+    def reset(self):
+        """Forgets the current map. Call this when starting a new game."""
+        self._map_update = None
+
+    def build(self, map_update, props, turn_state, instructions, actors, feedback):
+        if map_update is not self._map_update:
+            self._update_map_layers(map_update)
+        self._update_card_layers(props)
+        if self._numpy_observations:
+            map_layers = self._map_layers
+            card_layers = self._card_layers
+        else:
+            map_layers = {
+                name: layer.tolist() for name, layer in self._map_layers.items()
+            }
+            card_layers = self._card_layers_as_lists()
+        return {
+            "actors": self._actors(actors),
+            "map": map_layers,
+            "cards": card_layers,
+            "instructions": instructions,
+            "turn_state": self._turn_state(turn_state),
+            "feedback": feedback,
+        }
+
+    def _allocate(self, shape):
+        self._shape = shape
+        self._map_layers = {
+            "asset_ids": np.zeros(shape, dtype=np.int16),
+            "boundaries": np.zeros(shape, dtype=np.int8),
+            "orientations": np.zeros(shape, dtype=np.int16),
+            "heights": np.zeros(shape, dtype=np.float32),
+            "layers": np.zeros(shape, dtype=np.int8),
+        }
+        self._card_layers = {
+            "counts": np.zeros(shape, dtype=np.int8),
+            "colors": np.zeros(shape, dtype=np.int8),
+            "border_colors": np.zeros(shape, dtype=np.int8),
+            "shapes": np.zeros(shape, dtype=np.int8),
+            "selected": np.zeros(shape, dtype=np.int8),
+        }
+
+    def _update_map_layers(self, map_update):
+        shape = (map_update.rows, map_update.cols)
+        if shape != self._shape:
+            self._allocate(shape)
+        grid = map_update.grid()
+        self._map_layers["asset_ids"][...] = grid["asset_id"]
+        self._map_layers["boundaries"][...] = grid["boundary"]
+        self._map_layers["orientations"][...] = grid["rotation"]
+        self._map_layers["heights"][...] = grid["height"]
+        self._map_layers["layers"][...] = grid["layer"]
+        self._map_update = map_update
+
+    def _update_card_layers(self, props):
+        counts = self._card_layers["counts"]
+        colors = self._card_layers["colors"]
+        border_colors = self._card_layers["border_colors"]
+        shapes = self._card_layers["shapes"]
+        selected = self._card_layers["selected"]
+        for layer in self._card_layers.values():
+            layer.fill(0)
+        for p in props:
+            if p.prop_type != prop.PropType.CARD:
+                continue
+            (row, col) = p.prop_info.location.to_offset_coordinates()
+            counts[row, col] = p.card_init.count
+            colors[row, col] = p.card_init.color.value
+            border_colors[row, col] = ColorEnumFromColor(p.prop_info.border_color).value
+            shapes[row, col] = p.card_init.shape.value
+            selected[row, col] = p.card_init.selected
+
+    def _card_layers_as_lists(self):
+        return {
+            "counts": self._card_layers["counts"].tolist(),
+            "colors": [
+                [_COLORS[value] for value in row]
+                for row in self._card_layers["colors"].tolist()
+            ],
+            "border_colors": [
+                [_COLORS[value] for value in row]
+                for row in self._card_layers["border_colors"].tolist()
+            ],
+            "shapes": [
+                [_SHAPES[value] for value in row]
+                for row in self._card_layers["shapes"].tolist()
+            ],
+            "selected": [
+                [value != 0 for value in row]
+                for row in self._card_layers["selected"].tolist()
+            ],
+        }
+
+    def _actor(self, actor):
+        if self._numpy_observations:
+            return {
+                "location": np.array(
+                    actor.location().to_offset_coordinates(), dtype=np.int16
+                ),
+                "rotation": np.array([actor.heading_degrees()], dtype=np.int16),
+            }
+        return {
+            "location": actor.location().to_offset_coordinates(),
+            "rotation": actor.heading_degrees(),
+        }
+
+    def _actors(self, actors):
+        if len(actors) == 2:
+            (leader, follower) = actors
+        else:
+            leader = None
+            follower = actors[0]
+        return {
+            "leader": self._actor(leader) if leader is not None else None,
+            "follower": self._actor(follower),
+        }
+
+    def _turn_state(self, turn_state):
+        if self._numpy_observations:
+            return {
+                "role": turn_state.turn,
+                "moves_remaining": np.array(
+                    [turn_state.moves_remaining], dtype=np.int16
+                ),
+                "turns_remaining": np.array([turn_state.turns_left], dtype=np.int16),
+                "score": np.array([turn_state.score], dtype=np.int16),
+            }
+        return {
+            "role": turn_state.turn,
+            "moves_remaining": [turn_state.moves_remaining],
+            "turns_remaining": [turn_state.turns_left],
+            "score": [turn_state.score],
+        }
@@ -0,0 +1,91 @@
+"""Unit tests for the gym observation builder."""
+import unittest
+from datetime import datetime
+
+import numpy as np
+
+from envs.observation import ObservationBuilder
+from server.actor import Actor
+from server.assets import AssetId
+from server.card import Card
+from server.card_enums import Color, Shape
+from server.hex import HecsCoord, HexBoundary, HexCell
+from server.messages.map_update import MapUpdate, Tile
+from server.messages.prop import PropUpdate
+from server.messages.rooms import Role
+from server.messages.turn_state import TurnState
+
+
+def _Map(rows, cols):
+    tiles = []
+    for r in range(rows):
+        for c in range(cols):
+            cell = HexCell(HecsCoord.from_offset(r, c), HexBoundary(r), 0.5, 1)
+            tiles.append(Tile(AssetId.GROUND_TILE, cell, 60 * c))
+    return MapUpdate(rows, cols, tiles)
+
+
+def _State(map_update, cards):
+    turn_state = TurnState(
+        Role.LEADER, 5, 6, datetime.utcnow(), datetime.utcnow(), 0, 2, False, 0
+    )
+    actors = [
+        Actor(1, 0, Role.LEADER, HecsCoord.from_offset(1, 1), False, 60),
+        Actor(2, 0, Role.FOLLOWER, HecsCoord.from_offset(2, 3), False, 120),
+    ]
+    props = [card.prop() for card in cards]
+    return (map_update, props, turn_state, [], actors, None)
+
+
+class ObservationBuilderTest(unittest.TestCase):
+    def setUp(self):
+        self.map = _Map(3, 4)
+        self.card = Card(
+            7, HecsCoord.from_offset(2, 1), 0, Shape.STAR, Color.RED, 2, True
+        )
+
+    def test_numpy_observation(self):
+        builder = ObservationBuilder(numpy_observations=True)
+        observation = builder.build(*_State(self.map, [self.card]))
+        self.assertEqual(observation["map"]["asset_ids"].shape, (3, 4))
+        self.assertEqual(observation["map"]["boundaries"][2, 0], 2)
+        self.assertEqual(observation["map"]["orientations"][0, 3], 180)
+        self.assertEqual(observation["cards"]["counts"].sum(), 2)
+        self.assertEqual(observation["cards"]["colors"][2, 1], Color.RED.value)
+        self.assertEqual(observation["cards"]["border_colors"][2, 1], Color.BLUE.value)
+        self.assertEqual(observation["cards"]["selected"][2, 1], 1)
+        np.testing.assert_array_equal(
+            observation["actors"]["follower"]["location"], [2, 3]
+        )
+        self.assertEqual(observation["turn_state"]["score"][0], 2)
+
+        # The card is gone on the next step.
+        observation = builder.build(*_State(self.map, []))
+        self.assertEqual(observation["cards"]["counts"].sum(), 0)
+
+    def test_list_observation(self):
+        builder = ObservationBuilder()
+        observation = builder.build(*_State(self.map, [self.card]))
+        self.assertEqual(observation["map"]["asset_ids"][0][0], AssetId.GROUND_TILE)
+        self.assertIs(observation["cards"]["shapes"][2][1], Shape.STAR)
+        self.assertIs(observation["cards"]["colors"][0][0], Color.NONE)
+        self.assertIs(observation["cards"]["selected"][2][1], True)
+        self.assertEqual(observation["actors"]["leader"]["location"], (1, 1))
+        self.assertEqual(observation["turn_state"]["moves_remaining"], [5])
+
+    def test_round_trip(self):
+        for numpy_observations in [False, True]:
+            builder = ObservationBuilder(numpy_observations)
+            observation = builder.build(*_State(self.map, [self.card]))
+            map_update = MapUpdate.from_gym_state(observation)
+            self.assertEqual(map_update.grid().tolist(), self.map.grid().tolist())
+            props = PropUpdate.from_gym_state(observation).props
+            self.assertEqual(len(props), 1)
+            self.assertEqual(props[0].prop_info.location, self.card.location)
+            self.assertEqual(props[0].card_init.shape, Shape.STAR)
+            self.assertEqual(props[0].card_init.color, Color.RED)
+            self.assertEqual(props[0].card_init.count, 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
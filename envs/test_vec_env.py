@@ -0,0 +1,81 @@
+"""Unit tests for the vectorized local game environment."""
+import os
+import unittest
+
+os.environ["PYGAME_HIDE_SUPPORT_PROMPT"] = ""  # Hide pygame welcome message
+
+import numpy as np
+
+from envs.vec_env import CerealBar2VecEnv, _Stack
+from py_client.game_endpoint import Action
+from server.config.config import Config, SetGlobalConfig
+from server.messages.rooms import Role
+
+
+def _ActiveInstruction(instructions):
+    for instruction in instructions:
+        if not instruction.completed and not instruction.cancelled:
+            return instruction
+    return None
+
+
+def _ShortGameAction(role, instructions):
+    """Ends each turn as quickly as possible."""
+    active_instruction = _ActiveInstruction(instructions)
+    if role == Role.LEADER:
+        if active_instruction is None:
+            return Action.SendInstruction("TEST")
+        return Action.EndTurn()
+    return Action.InstructionDone(active_instruction.uuid)
+
+
+class CerealBar2VecEnvTest(unittest.TestCase):
+    def setUp(self):
+        self.config = Config(comment="VecEnv Unit Test Config")
+        SetGlobalConfig(self.config)
+
+    def play_until_reset(self, env):
+        observations, infos = env.reset()
+        self.assertEqual(observations["map"]["asset_ids"].shape[0], env.num_envs)
+        self.assertEqual(infos["action_mask"].shape[0], env.num_envs)
+        for _ in range(100):
+            actions = [
+                _ShortGameAction(role, instructions)
+                for role, instructions in zip(
+                    observations["turn_state"]["role"], observations["instructions"]
+                )
+            ]
+            observations, rewards, terminated, truncated, infos = env.step(actions)
+            self.assertFalse(truncated.any())
+            if terminated.all():
+                break
+        self.assertTrue(terminated.all())
+        for final_observation in infos["final_observation"]:
+            self.assertIsNotNone(final_observation)
+        # The finished games were replaced by new ones.
+        self.assertTrue((observations["turn_state"]["turns_remaining"] > 0).all())
+
+    def test_in_process(self):
+        env = CerealBar2VecEnv(2, self.config)
+        try:
+            self.play_until_reset(env)
+        finally:
+            env.close()
+
+    def test_stack_missing_actor(self):
+        leader = {"location": np.array([1, 2]), "rotation": np.array([60])}
+        stacked = _Stack([{"leader": None}, {"leader": leader}])
+        self.assertEqual(stacked["leader"], [None, leader])
+        stacked = _Stack([{"leader": leader}, {"leader": leader}])
+        self.assertEqual(stacked["leader"]["location"].shape, (2, 2))
+
+    def test_workers(self):
+        env = CerealBar2VecEnv(3, self.config, num_workers=2)
+        try:
+            self.play_until_reset(env)
+        finally:
+            env.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,253 @@
+""" Steps many local CB2 games in lockstep.
+
+CerealBar2VecEnv runs N self-play games on LocalGameCoordinators and steps
+them all with one call, returning stacked numpy observations and action
+masks. Games which end are replaced by a new game automatically.
+
+With num_workers > 0, games are sharded across worker processes. Each worker
+steps its games in lockstep, so data collection scales with cores.
+
+Example:
+```
+    env = CerealBar2VecEnv(16, config, num_workers=4)
+    observations, infos = env.reset()
+    while collecting:
+        actions = agent(observations, infos["action_mask"])
+        observations, rewards, terminated, truncated, infos = env.step(actions)
+    env.close()
+```
+
+Unlike CerealBar2Env, which plays one side of a game, each game here is a
+self-play game and the action for each game is taken by whichever role has
+the turn (see EndpointPair). The current role is in
+observations["turn_state"]["role"].
+"""
+
+import logging
+import multiprocessing
+import random
+from typing import List
+
+import numpy as np
+
+from envs.observation import ObservationBuilder
+from py_client.endpoint_pair import EndpointPair
+from py_client.game_endpoint import Action
+from py_client.local_game_coordinator import LocalGameCoordinator
+from server.config.config import SetGlobalConfig
+
+logger = logging.getLogger(__name__)
+
+
+class _LocalGame(object):
+    """A single self-play game, restarted by reset()."""
+
+    def __init__(self, coordinator: LocalGameCoordinator):
+        self._coordinator = coordinator
+        self._observation_builder = ObservationBuilder(numpy_observations=True)
+        self._game = None
+
+    def reset(self):
+        game_name = self._coordinator.CreateGame(log_to_db=False)
+        self._game = EndpointPair(self._coordinator, game_name)
+        self._game.initialize()
+        self._observation_builder.reset()
+        return self._observe(self._game.initial_state())
+
+    def step(self, action):
+        return self._observe(self._game.step(action))
+
+    def _observe(self, state):
+        observation = self._observation_builder.build(*state)
+        return (
+            observation,
+            state.turn_state.score,
+            state.turn_state.game_over,
+            self._game.action_mask(),
+        )
+
+
+class _GameShard(object):
+    """Steps a list of local games in lockstep, in the current process."""
+
+    def __init__(self, num_envs: int, config):
+        self._coordinator = LocalGameCoordinator(config, direct_endpoints=True)
+        self._games = [_LocalGame(self._coordinator) for _ in range(num_envs)]
+
+    def reset(self):
+        self._coordinator.ForceCleanAll()
+        return [game.reset() + (None,) for game in self._games]
+
+    def step(self, actions: List[Action]):
+        """Returns a (observation, reward, done, action_mask, final_observation) tuple per game.
+
+        Finished games are restarted. For those, observation is the first
+        observation of the new game and final_observation is the last
+        observation of the finished one. Otherwise, final_observation is None.
+        """
+        results = []
+        for game, action in zip(self._games, actions):
+            observation, reward, done, action_mask = game.step(action)
+            if not done:
+                results.append((observation, reward, done, action_mask, None))
+                continue
+            self._coordinator.Cleanup()
+            # The observation arrays are reused by the game's next observation.
+            final_observation = _CopyObservation(observation)
+            observation, _, _, action_mask = game.reset()
+            results.append((observation, reward, done, action_mask, final_observation))
+        return results
+
+    def close(self):
+        self._coordinator.ForceCleanAll()
+
+
+def _ShardWorker(connection, num_envs: int, config):
+    # Forked workers inherit the parent's RNG state. Reseed, or every worker
+    # plays the same maps.
+    random.seed()
+    np.random.seed()
+    SetGlobalConfig(config)
+    shard = _GameShard(num_envs, config)
+    try:
+        while True:
+            command, data = connection.recv()
+            if command == "reset":
+                connection.send(shard.reset())
+            elif command == "step":
+                connection.send(shard.step(data))
+            elif command == "close":
+                break
+            else:
+                raise ValueError(f"Unknown command: {command}")
+    except KeyboardInterrupt:
+        pass
+    finally:
+        shard.close()
+        connection.close()
+
+
+def _CopyObservation(observation):
+    if isinstance(observation, dict):
+        return {key: _CopyObservation(value) for key, value in observation.items()}
+    if isinstance(observation, np.ndarray):
+        return observation.copy()
+    return observation
+
+
+def _Stack(observations):
+    """Stacks a list of observations into one observation with a batch dimension.
+
+    numpy arrays are stacked. Other values (instructions, feedback, and actors
+    which are missing in some games) are returned as a list with one value
+    per game.
+    """
+    first = observations[0]
+    # The leader is None in follower observations when it's out of view.
+    if isinstance(first, dict) and all(
+        isinstance(observation, dict) for observation in observations
+    ):
+        return {
+            key: _Stack([observation[key] for observation in observations])
+            for key in first
+        }
+    if isinstance(first, np.ndarray) and all(
+        isinstance(observation, np.ndarray) for observation in observations
+    ):
+        return np.stack(observations)
+    return list(observations)
+
+
+class CerealBar2VecEnv(object):
+    def __init__(self, num_envs: int, config, num_workers: int = 0):
+        """Creates num_envs local self-play games.
+
+        Args:
+            num_envs: Number of games to step in lockstep.
+            config: Server config used for the games.
+            num_workers: If 0, all games run in this process. Otherwise games
+                are split evenly between this many worker processes.
+        """
+        if num_envs < 1:
+            raise ValueError(f"num_envs must be positive: {num_envs}")
+        self.num_envs = num_envs
+        self._shard = None
+        self._workers = []
+        if num_workers == 0:
+            self._shard = _GameShard(num_envs, config)
+            return
+        num_workers = min(num_workers, num_envs)
+        for i in range(num_workers):
+            shard_size = num_envs // num_workers + (i < num_envs % num_workers)
+            parent_connection, child_connection = multiprocessing.Pipe()
+            process = multiprocessing.Process(
+                target=_ShardWorker,
+                args=(child_connection, shard_size, config),
+                daemon=True,
+            )
+            process.start()
+            child_connection.close()
+            self._workers.append((process, parent_connection, shard_size))
+
+    def reset(self):
+        """Starts a new game in every env. Returns (observations, infos)."""
+        results = self._run("reset", None)
+        observations, infos, _, _ = self._collate(results)
+        return observations, infos
+
+    def step(self, actions: List[Action]):
+        """Takes one action in each game.
+
+        Returns (observations, rewards, terminated, truncated, infos).
+        infos["action_mask"] holds the stacked action masks. For games which
+        ended in this step, infos["final_observation"][i] holds the last
+        observation of the game, and observations[i] is the first
+        observation of the game which replaced it.
+        """
+        if len(actions) != self.num_envs:
+            raise ValueError(f"Expected {self.num_envs} actions, got {len(actions)}")
+        results = self._run("step", actions)
+        observations, infos, rewards, dones = self._collate(results)
+        return observations, rewards, dones, np.zeros_like(dones), infos
+
+    def close(self):
+        if self._shard is not None:
+            self._shard.close()
+        for process, connection, _ in self._workers:
+            try:
+                connection.send(("close", None))
+            except (BrokenPipeError, EOFError):
+                pass
+            connection.close()
+            process.join(timeout=5)
+            if process.is_alive():
+                process.terminate()
+        self._workers = []
+
+    def _run(self, command, actions):
+        if self._shard is not None:
+            if command == "reset":
+                return self._shard.reset()
+            return self._shard.step(actions)
+        start = 0
+        for _, connection, shard_size in self._workers:
+            data = actions[start : start + shard_size] if actions else None
+            connection.send((command, data))
+            start += shard_size
+        results = []
+        for _, connection, _ in self._workers:
+            results.extend(connection.recv())
+        return results
+
+    def _collate(self, results):
+        observations, rewards, dones, action_masks, final_observations = zip(*results)
+        infos = {
+            "action_mask": np.stack(action_masks),
+            "final_observation": list(final_observations),
+        }
+        return (
+            _Stack(observations),
+            infos,
+            np.array(rewards, dtype=np.float32),
+            np.array(dones, dtype=bool),
+        )
@@ -1,8 +1,12 @@
 import logging
-from datetime import datetime, timedelta
+import multiprocessing
+import uuid
+from dataclasses import dataclass
+from datetime import timedelta
 from typing import List
 
 import fire
+from playhouse.sqlite_ext import SqliteExtDatabase
 from tqdm import tqdm
 
 import server.schemas.defaults as defaults
@@ -15,9 +19,11 @@ from server.config.config import ReadServerConfigOrDie
 from server.db_tools.db_utils import ListAnalysisGames
 from server.lobbies.open_lobby import OpenLobby
 from server.lobby_consts import LobbyInfo, LobbyType
+from server.messages.objective import ObjectiveMessage
 from server.messages.prop import PropType
 from server.messages.turn_state import TurnState
-from server.scenario_util import GameStateFromScenario, ReconstructScenarioFromEvent
+from server.scenario_cache import ScenarioCache
+from server.scenario_util import GameStateFromScenario
 from server.schemas import base
 from server.schemas.eval import Eval, InstructionEvaluation, RunSource
 from server.schemas.event import Event, EventType
@@ -30,10 +36,8 @@ logger = logging.getLogger(__name__)
 # server/config/config.py. Must match the eval lobby on the remote server.
 REMOTE_LOBBY_NAME = "eval-lobby"
 
-
-def SwitchToDatabase(db):
-    base.SetDatabaseByPath(db)
-    base.ConnectDatabase()
+# Results are saved to the eval database in batches of this many instructions.
+RESULT_WRITE_BATCH_SIZE = 32
 
 
 def follower_eval_start(instruction: Event) -> Event:
@@ -107,117 +111,78 @@ def InitPythonLogging():
     logging.getLogger("peewee").setLevel(logging.INFO)
 
 
-def main(
-    agent_config: str,
-    server_config: str,
-    eval_output: str = "./evalrun.db",
-    remote: bool = False,
-    remote_address: str = None,
-):
-    InitPythonLogging()
-    agent_config = ReadAgentConfigOrDie(agent_config)
-    agent = CreateAgent(agent_config)
-    config = ReadServerConfigOrDie(server_config)
-
-    base.SetDatabase(config)
-    base.ConnectDatabase()
-
-    games = ListAnalysisGames(config)
-    game_ids = [game.id for game in games]
-    instructions = Event.select().where(
-        (Event.type == EventType.INSTRUCTION_SENT) & (Event.game_id << game_ids)
-    )
-
-    if instructions.count() == 0:
-        print("No instructions found.")
-        return
+@dataclass(frozen=True)
+class _EvalTask:
+    """One instruction to evaluate. Plain values, so it can be sent to workers."""
 
-    if remote:
-        print("Remote eval not yet supported.")
-        return
+    instruction_id: uuid.UUID
+    instruction_short_code: str
+    instruction_text: str
+    start_event_id: uuid.UUID
+    final_event_id: uuid.UUID
 
-    # Create an eval run entry in the database.
-    eval_run = Eval(
-        run_source=RunSource.LOCAL,
-        client_hash="",
-        commit_version=GetCommitHash(),
-        agent_config=agent_config,
-        agent_role=agent.role(),
-        server_config=config.to_json(),
-    )
 
-    # This object will help us launch local games.
-    coordinator = LocalGameCoordinator(
-        config,
-        render_leader=True,
-        render_follower=False,
-    )
+class _InstructionEvaluator(object):
+    """Runs eval games for one agent. Each eval worker process has its own."""
 
-    eval_lobby = OpenLobby(
-        LobbyInfo(
-            name="eval virtual lobby",
-            type=LobbyType.OPEN,
-            comment="Ephemeral lobby used for eval runs.",
-            game_capacity=1,
-            sound_clip_volume=0,
+    def __init__(self, agent, config, virtual_step_s, scenario_cache, render):
+        self._agent = agent
+        self._scenario_cache = scenario_cache
+        # This object will help us launch local games.
+        self._coordinator = LocalGameCoordinator(
+            config,
+            render_leader=render,
+            render_follower=False,
+            virtual_step_s=virtual_step_s,
+            scenario_cache=scenario_cache,
         )
-    )
-
-    agent_instructions_passed = []
-    results = []
-    for instruction in tqdm(instructions):
-        logger.info(
-            f"Evaluating agent {agent_config.name} on instruction {instruction.id}"
+        self._eval_lobby = OpenLobby(
+            LobbyInfo(
+                name="eval virtual lobby",
+                type=LobbyType.OPEN,
+                comment="Ephemeral lobby used for eval runs.",
+                game_capacity=1,
+                sound_clip_volume=0,
+            )
         )
-        if agent.role() == Role.LEADER:
-            # Leader eval not yet supported.
-            logger.info(f"Leader eval not yet supported.")
-            return
-        elif agent.role() == Role.FOLLOWER:
-            eval_start_event = follower_eval_start(instruction)
-            final_baseline_state = final_follower_move(instruction)
-            if eval_start_event is None or final_baseline_state is None:
-                logger.info(
-                    "Skipping instruction. Invalid start or end states. This could be due to the instruction being cancelled or the game ending."
-                )
-                continue
 
-        # Create a local game to run the eval.
-        if remote:
-            logger.info(f"Remote eval not yet supported.")
-            return
-        else:
-            game_name = coordinator.CreateGameFromDatabase(
-                eval_start_event.id.hex, log_to_db=False, lobby=eval_lobby
-            )
-            # Due to a known bug (now patched) where TURN_STATE events were not
-            # being logged, we need to force the current turn state to be at the
-            # beginning of the follower's turn, with full moves and time.
-            state_machine = coordinator._state_machine_driver(
-                game_name
-            ).state_machine()  # pylint: disable=protected-access
-            state_machine._send_turn_state(
-                TurnState(  # pylint: disable=protected-access
-                    Role.FOLLOWER,
-                    FOLLOWER_MOVES_PER_TURN,
-                    1,  # As long as next turn isn't game over.
-                    datetime.utcnow() + timedelta(seconds=FOLLOWER_SECONDS_PER_TURN),
-                    datetime.utcnow(),
-                    0,  # Let's start each eval with a score of zero.
-                    0,
-                    False,
-                    0,
-                )
+    def evaluate(self, task: _EvalTask):
+        """Returns the InstructionEvaluation fields for this task, or None if it couldn't run."""
+        agent = self._agent
+        coordinator = self._coordinator
+        game_name = coordinator.CreateGameFromDatabase(
+            task.start_event_id.hex, log_to_db=False, lobby=self._eval_lobby
+        )
+        # Due to a known bug (now patched) where TURN_STATE events were not
+        # being logged, we need to force the current turn state to be at the
+        # beginning of the follower's turn, with full moves and time.
+        state_machine = coordinator._state_machine_driver(
+            game_name
+        ).state_machine()  # pylint: disable=protected-access
+        now = state_machine.clock().utcnow()
+        state_machine._send_turn_state(
+            TurnState(  # pylint: disable=protected-access
+                Role.FOLLOWER,
+                FOLLOWER_MOVES_PER_TURN,
+                1,  # As long as next turn isn't game over.
+                now + timedelta(seconds=FOLLOWER_SECONDS_PER_TURN),
+                now,
+                0,  # Let's start each eval with a score of zero.
+                0,
+                False,
+                0,
             )
-            endpoint_pair = EndpointPair(coordinator, game_name)
-            endpoint_pair.initialize()
+        )
+        endpoint_pair = EndpointPair(coordinator, game_name)
+        endpoint_pair.initialize()
         game_state = endpoint_pair.initial_state()
 
         if game_state.turn_state.turn != agent.role():
             logger.error(
                 f"Agent role {agent.role()} does not match turn eval run state {game_state.turn_state.turn}"
             )
-            continue
+            coordinator.ForceCleanAll()
+            return None
 
         # Keep running until the current turn is over. We check for this inside
         # the loop because the game state may change in the middle of the loop.
@@ -229,11 +194,12 @@ def main(
             action = agent.choose_action(game_state)
             game_state = endpoint_pair.step(action)
             agent_actions.append(str(action))
+        coordinator.ForceCleanAll()
 
         # Now we have the agent's completed game state. We must compare it to
         # the baseline. Fetch the final game state after this instruction was
         # completed in the baseline game in the database.
-        final_scenario, err = ReconstructScenarioFromEvent(final_baseline_state.id)
+        final_scenario, err = self._scenario_cache.get(task.final_event_id)
         final_baseline_state = GameStateFromScenario(final_scenario)
 
         # Compare the final game state to the human game state. See if the card
@@ -258,34 +224,220 @@ def main(
         passed_instruction_eval = card_selections_match and (
             final_agent_score >= final_baseline_score
         )
-        if passed_instruction_eval:
-            agent_instructions_passed.append(instruction.id)
-        results.append(
-            InstructionEvaluation(
-                eval_run=eval_run,
-                instruction_uuid=instruction.short_code,
-                instruction_text=instruction.text,
-                agent_actions=str(agent_actions),
-                event_uuid=eval_start_event.id,
-                agent_outcome=game_state.to_json(),
-                baseline_outcome=final_baseline_state.to_json(),
-                success=passed_instruction_eval,
-            )
+        return dict(
+            instruction_uuid=task.instruction_short_code,
+            instruction_text=task.instruction_text,
+            agent_actions=str(agent_actions),
+            event_uuid=task.start_event_id,
+            agent_outcome=game_state.to_json(),
+            baseline_outcome=final_baseline_state.to_json(),
+            success=passed_instruction_eval,
         )
 
-    # Switch databases and then save the results.
-    SwitchToDatabase(eval_output)
-    base.CreateTablesIfNotExists(defaults.ListEvalTables())
 
-    eval_run.save(force_insert=True)
-    for result in results:
-        result.save(force_insert=True)
+# The evaluator of the current eval worker process. See _InitEvalWorker().
+_worker_evaluator = None
 
-    logger.info(f"Eval run {eval_run.id} complete.")
-    logger.info(
-        f"Instructions passed: {len(agent_instructions_passed)}. ({len(agent_instructions_passed) / len(results)}%)"
+
+def _OpenScenarioCache(scenario_cache_path, tasks):
+    """Opens the scenario cache, reconstructing the tasks' scenarios up front.
+
+    Without a cache file, scenarios are reconstructed on demand instead. An
+    in-memory cache can't hold every scenario, and isn't shared with workers.
+    """
+    scenario_cache = ScenarioCache(scenario_cache_path)
+    if scenario_cache_path is None:
+        return scenario_cache
+    reconstructed = scenario_cache.precompute(
+        [task.start_event_id for task in tasks]
+        + [task.final_event_id for task in tasks]
+    )
+    logger.info(f"Reconstructed {reconstructed} scenarios.")
+    return scenario_cache
+
+
+def _InitEvalWorker(agent_config, config, virtual_step_s, scenario_cache_path):
+    global _worker_evaluator
+    # Workers only read recorded games. Results are written by the parent.
+    base.SetDatabase(config)
+    base.ConnectDatabase()
+    base.GetDatabase().execute_sql("PRAGMA query_only = 1")
+    _worker_evaluator = _InstructionEvaluator(
+        CreateAgent(agent_config),
+        config,
+        virtual_step_s,
+        ScenarioCache(scenario_cache_path),
+        render=False,
     )
-    logger.info(f"Total instructions: {len(results)}")
+
+
+def _EvalWorker(task: _EvalTask):
+    return task, _worker_evaluator.evaluate(task)
+
+
+def _SaveResults(eval_database, eval_run, results):
+    if len(results) == 0:
+        return
+    with eval_database.bind_ctx([Eval, InstructionEvaluation]):
+        with eval_database.atomic():
+            InstructionEvaluation.insert_many(
+                [dict(result, eval_run=eval_run) for result in results]
+            ).execute()
+
+
+def main(
+    agent_config: str,
+    server_config: str,
+    eval_output: str = "./evalrun.db",
+    remote: bool = False,
+    remote_address: str = None,
+    virtual_step_s: float = 0.1,
+    cache_scenarios: bool = True,
+    num_workers: int = 0,
+    resume_eval_id: str = None,
+):
+    """Evaluates an agent on instructions from recorded games.
+
+    Games run on a virtual clock which advances virtual_step_s seconds per
+    state machine step, so eval results don't depend on how fast the agent
+    or the machine is. Pass virtual_step_s=None to use the wall clock.
+
+    If cache_scenarios is true, the start and end state of each instruction
+    is reconstructed once and saved in the server's scenario cache (see
+    server/scenario_cache.py), so later eval runs skip the reconstruction.
+
+    If num_workers > 0, instructions are evaluated in that many worker
+    processes, each with its own agent and read-only database connection.
+
+    Results are saved to eval_output every RESULT_WRITE_BATCH_SIZE
+    instructions. If a run stops early, pass its ID (logged at the start of
+    the run) as resume_eval_id to evaluate only the remaining instructions.
+    """
+    InitPythonLogging()
+    agent_config = ReadAgentConfigOrDie(agent_config)
+    agent = CreateAgent(agent_config)
+    config = ReadServerConfigOrDie(server_config)
+
+    base.SetDatabase(config)
+    base.ConnectDatabase()
+
+    games = ListAnalysisGames(config)
+    game_ids = [game.id for game in games]
+    instructions = Event.select().where(
+        (Event.type == EventType.INSTRUCTION_SENT) & (Event.game_id << game_ids)
+    )
+
+    if instructions.count() == 0:
+        print("No instructions found.")
+        return
+
+    if remote:
+        print("Remote eval not yet supported.")
+        return
+
+    if agent.role() == Role.LEADER:
+        # Leader eval not yet supported.
+        logger.info(f"Leader eval not yet supported.")
+        return
+
+    eval_database = SqliteExtDatabase(eval_output)
+    with eval_database.bind_ctx([Eval, InstructionEvaluation]):
+        eval_database.create_tables(defaults.ListEvalTables())
+        if resume_eval_id is not None:
+            eval_run = Eval.get_by_id(uuid.UUID(resume_eval_id))
+            finished = set(
+                result.event_uuid
+                for result in InstructionEvaluation.select(
+                    InstructionEvaluation.event_uuid
+                ).where(InstructionEvaluation.eval_run == eval_run)
+            )
+        else:
+            # Create an eval run entry in the database.
+            eval_run = Eval.create(
+                run_source=RunSource.LOCAL,
+                client_hash="",
+                commit_version=GetCommitHash(),
+                agent_config=agent_config,
+                agent_role=agent.role(),
+                server_config=config.to_json(),
+            )
+            finished = set()
+    logger.info(f"Eval run {eval_run.id}. Resume with --resume_eval_id={eval_run.id}")
+
+    # Find the start and end of each instruction up front, so their
+    # scenarios can be reconstructed in one pass.
+    tasks = []
+    for instruction in instructions:
+        eval_start_event = follower_eval_start(instruction)
+        final_baseline_state = final_follower_move(instruction)
+        if eval_start_event is None or final_baseline_state is None:
+            logger.info(
+                "Skipping instruction. Invalid start or end states. This could be due to the instruction being cancelled or the game ending."
+            )
+            continue
+        if str(eval_start_event.id) in finished:
+            continue
+        tasks.append(
+            _EvalTask(
+                instruction.id,
+                instruction.short_code,
+                ObjectiveMessage.from_json(instruction.data).text,
+                eval_start_event.id,
+                final_baseline_state.id,
+            )
+        )
+    logger.info(f"{len(finished)} instructions already evaluated.")
+
+    scenario_cache_path = config.scenario_cache_path() if cache_scenarios else None
+    scenario_cache = _OpenScenarioCache(scenario_cache_path, tasks)
+
+    pool = None
+    if num_workers > 0:
+        # Worker processes open their own connections. Don't share ours.
+        scenario_cache.close()
+        base.CloseDatabase()
+        pool = multiprocessing.Pool(
+            num_workers,
+            initializer=_InitEvalWorker,
+            initargs=(agent_config, config, virtual_step_s, scenario_cache_path),
+        )
+        evaluations = pool.imap_unordered(_EvalWorker, tasks)
+    else:
+        evaluator = _InstructionEvaluator(
+            agent, config, virtual_step_s, scenario_cache, render=True
+        )
+        evaluations = ((task, evaluator.evaluate(task)) for task in tasks)
+
+    results = []
+    try:
+        for task, result in tqdm(evaluations, total=len(tasks)):
+            logger.info(
+                f"Evaluated agent {agent_config.name} on instruction {task.instruction_id}"
+            )
+            if result is None:
+                continue
+            results.append(result)
+            if len(results) >= RESULT_WRITE_BATCH_SIZE:
+                _SaveResults(eval_database, eval_run, results)
+                results = []
+    finally:
+        _SaveResults(eval_database, eval_run, results)
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+    scenario_cache.close()
+
+    with eval_database.bind_ctx([Eval, InstructionEvaluation]):
+        evaluated = InstructionEvaluation.select().where(
+            InstructionEvaluation.eval_run == eval_run
+        )
+        total = evaluated.count()
+        passed = evaluated.where(InstructionEvaluation.success == True).count()
+    eval_database.close()
+
+    logger.info(f"Eval run {eval_run.id} complete.")
+    logger.info(f"Instructions passed: {passed}. ({passed / max(total, 1)}%)")
+    logger.info(f"Total instructions: {total}")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,66 @@
+import os
+import tempfile
+import unittest
+
+from eval.run_eval import _EvalTask, _OpenScenarioCache
+from py_client.endpoint_pair import EndpointPair
+from py_client.game_endpoint import Action
+from py_client.local_game_coordinator import LocalGameCoordinator
+from server.config.config import Config, SetGlobalConfig
+from server.schemas.base import (
+    ConnectDatabase,
+    CreateTablesIfNotExists,
+    SetDatabaseForTesting,
+)
+from server.schemas.defaults import ListDefaultTables
+from server.schemas.event import Event, EventType
+
+
+class OpenScenarioCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.config = Config(comment="Run Eval Unit Test Config")
+        SetGlobalConfig(self.config)
+        SetDatabaseForTesting()
+        ConnectDatabase()
+        CreateTablesIfNotExists(ListDefaultTables())
+        # Record a short game to take scenarios from.
+        coordinator = LocalGameCoordinator(self.config)
+        game_name = coordinator.CreateGame(log_to_db=True)
+        endpoint_pair = EndpointPair(coordinator, game_name)
+        endpoint_pair.initialize()
+        endpoint_pair.step(Action.SendInstruction("TEST"))
+        endpoint_pair.step(Action.EndTurn())
+        endpoint_pair.step(Action.Forwards())
+        state_machine = coordinator._state_machine_driver(game_name).state_machine()
+        state_machine._game_recorder.flush()
+        instruction = Event.get(Event.type == EventType.INSTRUCTION_SENT)
+        events = list(
+            Event.select()
+            .where(Event.server_time >= instruction.server_time)
+            .order_by(Event.server_time)
+        )
+        self.tasks = [
+            _EvalTask(instruction.id, "", "TEST", events[0].id, events[-1].id)
+        ]
+
+    def tearDown(self):
+        self.tempdir.cleanup()
+
+    def test_precomputes_persistent_cache(self):
+        path = os.path.join(self.tempdir.name, "scenario_cache.db")
+        scenario_cache = _OpenScenarioCache(path, self.tasks)
+        self.assertEqual(scenario_cache.stats()["size"], 2)
+        scenario_cache.close()
+
+    def test_skips_precompute_without_cache_file(self):
+        scenario_cache = _OpenScenarioCache(None, self.tasks)
+        self.assertEqual(scenario_cache.stats()["size"], 0)
+        # Scenarios are still reconstructed on demand.
+        scenario, err = scenario_cache.get(self.tasks[0].start_event_id)
+        self.assertIsNotNone(scenario, err)
+        self.assertEqual(scenario_cache.stats()["misses"], 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
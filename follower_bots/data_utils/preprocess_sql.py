@@ -2,13 +2,24 @@
 # -------------------------------
 # Extracts the relevant data within the SQL dataset and stores
 # it in a symbolic format for future use.
+#
+# Each game's events are loaded from the database once, and every
+# instruction's trajectory is derived from that in-memory event list.
+# Games are split into shards which are processed in parallel, and each
+# shard is written to its own file as soon as it finishes. Rerunning the
+# script skips shards which were already written.
 
 import argparse
+import bisect
+import glob
+import hashlib
+import json
+import math
+import multiprocessing
 import os
-import pickle
 import random
-import json
-import peewee
+from collections import defaultdict
+
 import torch
 
 import follower_bots.data_utils.data_classes as data_cls
@@ -18,7 +29,7 @@ import server.messages.map_update as map_update_msg
 import server.schemas.defaults
 import server.schemas.game
 from follower_bots.constants import EDGE_WIDTH, ACT_DIM
-from follower_bots.utils import mkdir
+from follower_bots.utils import dump_pickle, load_pickle, mkdir
 
 from server.messages.prop import PropUpdate, PropType
 from server.messages.action import Action
@@ -30,15 +41,40 @@ from server.messages.objective import ObjectiveMessage
 from server.schemas import base
 from server.schemas.event import Event, EventType
 
+CARD_EVENT_TYPES = frozenset(
+    [
+        EventType.CARD_SPAWN,
+        EventType.CARD_SELECT,
+        EventType.CARD_SET,
+        EventType.PROP_UPDATE,
+    ]
+)
+
 
 def get_args():
     parser = argparse.ArgumentParser(
         description="Processes past experiments in a SQL database for future training"
     )
 
-    parser.add_argument("--output_dir", type=str, default="./follower_bots/pretraining_data")
     parser.add_argument(
-        "--config_filepath", type=str, default="./follower_bots/data_configs/pretraining_examples.json"
+        "--output_dir", type=str, default="./follower_bots/pretraining_data"
+    )
+    parser.add_argument(
+        "--config_filepath",
+        type=str,
+        default="./follower_bots/data_configs/pretraining_examples.json",
+    )
+    parser.add_argument(
+        "--num_workers",
+        type=int,
+        default=0,
+        help="Number of processes to preprocess shards in. 0 processes shards in this process.",
+    )
+    parser.add_argument(
+        "--games_per_shard",
+        type=int,
+        default=50,
+        help="Number of games written to each output shard.",
     )
 
     args = parser.parse_args()
@@ -64,131 +100,256 @@ def get_tr_val_games(cfg):
     return train_games, val_games
 
 
-def preprocess_games(args, games, output_dir, split_name):
-    trajectories = []
+class GameEvents:
+    """
+    All events of a single game, loaded with one query and indexed in memory.
+    Replaces the per-instruction peewee queries that preprocessing used to issue.
+    """
 
-    # Go through each game provided
-    num_instructions = 0
-    ParentEvent = Event.alias()
-    for game in games:
-        # Get all events associated with the current game
-        game_events = (
-            Event.select()
-            .join(
-                ParentEvent,
-                peewee.JOIN.LEFT_OUTER,
-                on=(Event.parent_event == ParentEvent.id),
-            )
-            .where(Event.game_id == game.id)
-            .order_by(Event.server_time)
+    def __init__(self, game_id):
+        self.events = list(
+            Event.select().where(Event.game_id == game_id).order_by(Event.server_time)
         )
+        self.server_times = [event.server_time for event in self.events]
+        self.by_type = defaultdict(list)
+        self.by_parent = defaultdict(list)
+        for event in self.events:
+            self.by_type[event.type].append(event)
+            if event.parent_event_id is not None:
+                self.by_parent[event.parent_event_id].append(event)
+
+    def of_type(self, event_type):
+        return self.by_type.get(event_type, [])
+
+    def first(self, event_type):
+        events = self.of_type(event_type)
+        return events[0] if len(events) > 0 else None
+
+    def children(self, event, event_type, role=None):
+        return [
+            child
+            for child in self.by_parent.get(event.id, [])
+            if child.type == event_type and (role is None or child.role == role)
+        ]
+
+    def before(self, server_time, inclusive=False):
+        # Events are sorted by server time, so this is a prefix of the list.
+        if inclusive:
+            end = bisect.bisect_right(self.server_times, server_time)
+        else:
+            end = bisect.bisect_left(self.server_times, server_time)
+        return self.events[:end]
 
-        # Iterate over each active instruction
-        instructions = game_events.where(Event.type == EventType.INSTRUCTION_SENT)
-        instructions = instructions.order_by(Event.server_time)
-        for instruction in instructions:
-            # First extract the instruction text
-            instruction_activation = get_instruction_activation(instruction)
-            if instruction_activation is None:
-                continue
-            text = ObjectiveMessage.from_json(instruction.data).text
-
-            # Next extract the actions the follower took
-            actions, moves = get_actions(instruction)
-
-            # Determine whether to skip the instruction
-            if skip_instruction(instruction, actions, split_name):
-                continue
-
-            static_map, map = get_static_map_info(game_events)
-            dynamic_maps = get_dynamic_map_info(game_events, instruction, actions, moves)
-            final_follower_pos, change_grid, special_cards = get_swsd_information(
-                dynamic_maps, instruction, moves
-            )
-            action_masks = get_action_masks(map, game_events, instruction, moves, actions)
-
-            trajectories.append(
-                (
-                    text,
-                    static_map,
-                    dynamic_maps,
-                    actions,
-                    game.id,
-                    instruction_activation.id,
-                    final_follower_pos,
-                    change_grid,
-                    special_cards,
-                    action_masks
-                )
-            )
+    def last_before(self, server_time, event_type, role=None, inclusive=False):
+        for event in reversed(self.before(server_time, inclusive)):
+            if event.type == event_type and (role is None or event.role == role):
+                return event
+        return None
 
-            num_instructions += 1
-            if num_instructions % 150 == 0:
-                print(f"Instruction {num_instructions} in {split_name}")
 
-    datapath = os.path.join(output_dir, f"pretrain_{split_name}.pkl")
-    with open(datapath, "wb") as f:
-        pickle.dump(trajectories, f)
+def shard_path(output_dir, split_name, shard_index, num_shards, game_ids):
+    # The name includes a hash of the shard's games, so a shard is rewritten
+    # when the games in the database change.
+    digest = hashlib.sha1(",".join(map(str, game_ids)).encode()).hexdigest()[:10]
+    return os.path.join(
+        output_dir,
+        f"pretrain_{split_name}-{shard_index:05d}-of-{num_shards:05d}-{digest}.pkl",
+    )
+
+
+def list_shards(standard_path):
+    """
+    Returns the shard files written in place of standard_path (for example
+    pretrain_train.pkl), in order. See shard_path.
+    """
+    root, ext = os.path.splitext(standard_path)
+    return sorted(glob.glob(f"{root}-[0-9]*-of-[0-9]*{ext}"))
+
+
+def load_trajectories(standard_path):
+    # Datasets preprocessed before sharding was added are a single file.
+    if os.path.exists(standard_path):
+        return load_pickle(standard_path)
+    shards = list_shards(standard_path)
+    if len(shards) == 0:
+        raise FileNotFoundError(f"No preprocessed data found at {standard_path}")
+    trajectories = []
+    for path in shards:
+        trajectories.extend(load_pickle(path)["trajectories"])
+    return trajectories
+
+
+def preprocess_games(args, games, output_dir, split_name):
+    """
+    Splits the games into shards and preprocesses each one which hasn't been
+    written yet. Returns the paths of all shards of this split.
+    """
+    game_ids = [game.id for game in games]
+    num_shards = max(1, math.ceil(len(game_ids) / args.games_per_shard))
+    shard_game_ids = [
+        game_ids[i * args.games_per_shard : (i + 1) * args.games_per_shard]
+        for i in range(num_shards)
+    ]
+    shard_paths = [
+        shard_path(output_dir, split_name, i, num_shards, shard_game_ids[i])
+        for i in range(num_shards)
+    ]
+
+    # Shards written with a different shard size, or from a database with
+    # different games, hold a different set of games.
+    standard_path = os.path.join(output_dir, f"pretrain_{split_name}.pkl")
+    for path in set(list_shards(standard_path)) - set(shard_paths):
+        print(f"Removing stale shard {path}")
+        os.remove(path)
+
+    tasks = []
+    for path, ids in zip(shard_paths, shard_game_ids):
+        if os.path.exists(path):
+            continue
+        tasks.append((path, ids, split_name))
+    print(
+        f"{split_name}: {num_shards - len(tasks)} of {num_shards} shards already written"
+    )
+
+    if args.num_workers > 0 and len(tasks) > 0:
+        # Worker processes open their own connections. Don't share ours.
+        base.CloseDatabase()
+        with multiprocessing.Pool(
+            args.num_workers,
+            initializer=init_preprocess_worker,
+            initargs=(args.config_filepath,),
+        ) as pool:
+            for path, num_instructions in pool.imap_unordered(preprocess_shard, tasks):
+                print(f"Wrote {num_instructions} {split_name} instructions to {path}")
+        base.ConnectDatabase()
+    else:
+        for task in tasks:
+            path, num_instructions = preprocess_shard(task)
+            print(f"Wrote {num_instructions} {split_name} instructions to {path}")
 
     print(f"Finished {split_name} processing!")
+    return shard_paths
+
 
+def init_preprocess_worker(config_filepath):
+    # Workers only read recorded games.
+    cfg = config.ReadConfigOrDie(config_filepath)
+    base.SetDatabase(cfg)
+    base.ConnectDatabase()
+    base.GetDatabase().execute_sql("PRAGMA query_only = 1")
 
-def get_instruction_activation(instruction):
-    activation_query = instruction.children.where(
-        Event.type == EventType.INSTRUCTION_ACTIVATED
+
+def preprocess_shard(task):
+    path, game_ids, split_name = task
+    trajectories = []
+    leader_trajectories = {}
+    for game_id in game_ids:
+        game_events = GameEvents(game_id)
+        trajectories.extend(get_game_trajectories(game_events, game_id, split_name))
+        leader_trajectories.update(get_game_leader_actions(game_events))
+
+    # Write to a temporary file first, so an interrupted write isn't
+    # mistaken for a finished shard.
+    temp_path = path + ".tmp"
+    dump_pickle(
+        temp_path,
+        {
+            "game_ids": game_ids,
+            "trajectories": trajectories,
+            "leader_actions": leader_trajectories,
+        },
     )
-    if not activation_query.exists():
+    os.replace(temp_path, path)
+    return path, len(trajectories)
+
+
+def get_game_trajectories(game_events, game_id, split_name):
+    trajectories = []
+
+    # Iterate over each active instruction
+    for instruction in game_events.of_type(EventType.INSTRUCTION_SENT):
+        # First extract the instruction text
+        instruction_activation = get_instruction_activation(game_events, instruction)
+        if instruction_activation is None:
+            continue
+        text = ObjectiveMessage.from_json(instruction.data).text
+
+        # Next extract the actions the follower took
+        actions, moves = get_actions(game_events, instruction)
+
+        # Determine whether to skip the instruction
+        if skip_instruction(game_events, instruction, actions, split_name):
+            continue
+
+        static_map, map = get_static_map_info(game_events)
+        dynamic_maps = get_dynamic_map_info(game_events, instruction, actions, moves)
+        final_follower_pos, change_grid, special_cards = get_swsd_information(
+            game_events, dynamic_maps, instruction, moves
+        )
+        action_masks = get_action_masks(map, game_events, instruction, moves, actions)
+
+        trajectories.append(
+            (
+                text,
+                static_map,
+                dynamic_maps,
+                actions,
+                game_id,
+                instruction_activation.id,
+                final_follower_pos,
+                change_grid,
+                special_cards,
+                action_masks,
+            )
+        )
+
+    return trajectories
+
+
+def get_instruction_activation(game_events, instruction):
+    activations = game_events.children(instruction, EventType.INSTRUCTION_ACTIVATED)
+    if len(activations) == 0:
         return None
     else:
-        return activation_query.get()
+        return activations[0]
 
 
-def instruction_is_completed(instruction):
-    completion_query = instruction.children.where(
-        Event.type == EventType.INSTRUCTION_DONE
-    )
-    return completion_query.exists()
+def instruction_is_completed(game_events, instruction):
+    return len(game_events.children(instruction, EventType.INSTRUCTION_DONE)) > 0
 
 
-def instruction_is_cancelled(instruction):
-    cancellation_query = instruction.children.where(
-        Event.type == EventType.INSTRUCTION_CANCELLED
-    )
-    return cancellation_query.exists()
+def instruction_is_cancelled(game_events, instruction):
+    return len(game_events.children(instruction, EventType.INSTRUCTION_CANCELLED)) > 0
 
 
-def get_actions(instruction):
-    # First extract the follower moves from the SQL
-    moves = instruction.children.where(
-        Event.type == EventType.ACTION, Event.role == "Role.FOLLOWER"
-    )
-    moves = moves.order_by(Event.server_time)
+def get_actions(game_events, instruction):
+    # First extract the follower moves
+    moves = game_events.children(instruction, EventType.ACTION, role="Role.FOLLOWER")
 
     # Get the action enums
     actions = [data_cls.ActionEnums[move.short_code] for move in moves]
-    if instruction_is_completed(instruction):
+    if instruction_is_completed(game_events, instruction):
         actions.append(data_cls.ActionEnums["DONE"])
 
     return actions, moves
 
 
-def skip_instruction(instruction, actions, split):
+def skip_instruction(game_events, instruction, actions, split):
     # If the instruction has no actions associated with it, skip
     if len(actions) == 0:
         return True
     elif split == "val":
         # For validation, only use completed instructions
-        return not instruction_is_completed(instruction)
+        return not instruction_is_completed(game_events, instruction)
     else:
         # For training, skip cancelled instructions
-        return instruction_is_cancelled(instruction)
+        return instruction_is_cancelled(game_events, instruction)
 
 
 def get_static_map_info(game_events):
     # Extract information about the static props on the game map
-    map_events = game_events.select().where(Event.type == EventType.MAP_UPDATE)
-    map_events = map_events.order_by(Event.server_time).get().data
-    map_update = map_update_msg.MapUpdate.from_json(map_events)
+    map_event = game_events.first(EventType.MAP_UPDATE)
+    map_update = map_update_msg.MapUpdate.from_json(map_event.data)
     return data_cls.StaticMap(map_update), map_update
 
 
@@ -204,6 +365,7 @@ def get_dynamic_map_info(game_events, instruction, actions, moves):
 
     return dynamic_maps
 
+
 def get_regular_dynamic_map(game_events, instruction, move):
     # Extract follower information from the move
     follower_location = move.location
@@ -227,15 +389,25 @@ def get_regular_dynamic_map(game_events, instruction, move):
 
     return dynamic_map
 
+
+def get_instruction_done(game_events, instruction):
+    for event in game_events.of_type(EventType.INSTRUCTION_DONE):
+        if event.short_code == instruction.short_code:
+            return event
+    return None
+
+
 def get_done_dynamic_map(game_events, instruction):
     # First get the instruction done event
-    instruction_done = game_events.select().where(Event.type == EventType.INSTRUCTION_DONE,
-                                                  Event.short_code == instruction.short_code)
-    instruction_done = instruction_done.order_by(Event.server_time).get()
+    instruction_done = get_instruction_done(game_events, instruction)
 
     # Determine the positions
-    follower_location, follower_orientation = get_agent_coords(game_events, instruction_done, 'FOLLOWER')
-    leader_location, leader_orientation = get_agent_coords(game_events, instruction_done, 'LEADER')
+    follower_location, follower_orientation = get_agent_coords(
+        game_events, instruction_done, "FOLLOWER"
+    )
+    leader_location, leader_orientation = get_agent_coords(
+        game_events, instruction_done, "LEADER"
+    )
 
     # Get the cards on the map immediately before the follower moves
     cards = get_cards_before(game_events, instruction, instruction_done, done=True)
@@ -250,29 +422,23 @@ def get_done_dynamic_map(game_events, instruction):
 
     return dynamic_map
 
+
 def get_leader_coords(game_events, instruction, move):
-    # Get all leader moves before the current move
-    leader_moves = game_events.select().where(
-        Event.type == EventType.ACTION,
-        Event.role == "Role.LEADER",
-        Event.server_time < move.server_time,
+    # Get the last leader move before the current move
+    leader_move = game_events.last_before(
+        move.server_time, EventType.ACTION, role="Role.LEADER"
     )
-    leader_moves = leader_moves.order_by(Event.server_time)
 
-    if len(leader_moves) == 0:
+    if leader_move is None:
         # Leader did not take an action before, return spawn positions
-        initial_state = (
-            game_events.select().where(Event.type == EventType.INITIAL_STATE).get()
-        )        
+        initial_state = game_events.first(EventType.INITIAL_STATE)
         initial_state = InitialState.from_json(initial_state.data)
         leader_location = initial_state.leader_position
         leader_orientation = (initial_state.leader_rotation_degrees - 60) % 360
     else:
-        leader_move = leader_moves[-1]
-
         # Reconstruct position and rotation following last action
         leader_action = Action.from_json(leader_move.data)
-        pos_before = leader_move.location        
+        pos_before = leader_move.location
         pos_delta = leader_action.displacement
         leader_location = HecsCoord.add(pos_before, pos_delta)
 
@@ -282,22 +448,21 @@ def get_leader_coords(game_events, instruction, move):
 
     return leader_location, leader_orientation
 
+
 def get_agent_coords(game_events, instruction_done, agent_type):
     # Only called for done actions
 
-    # Get all moves before the current move
-    moves = game_events.select().where(
-        Event.type == EventType.ACTION,
-        Event.role == f"Role.{agent_type}",
-        Event.server_time <= instruction_done.server_time,
+    # Get the last move up to the current move
+    move = game_events.last_before(
+        instruction_done.server_time,
+        EventType.ACTION,
+        role=f"Role.{agent_type}",
+        inclusive=True,
     )
-    moves = moves.order_by(Event.server_time)
 
-    if len(moves) == 0:
+    if move is None:
         # Agent did not take an action before, return spawn positions
-        initial_state = (
-            game_events.select().where(Event.type == EventType.INITIAL_STATE).get()
-        )        
+        initial_state = game_events.first(EventType.INITIAL_STATE)
         initial_state = InitialState.from_json(initial_state.data)
         if agent_type == "FOLLOWER":
             location = initial_state.follower_position
@@ -306,11 +471,9 @@ def get_agent_coords(game_events, instruction_done, agent_type):
             location = initial_state.leader_position
             orientation = (initial_state.leader_rotation_degrees - 60) % 360
     else:
-        move = moves[-1]
-
         # Reconstruct position and rotation following last action
         last_action = Action.from_json(move.data)
-        pos_before = move.location        
+        pos_before = move.location
         pos_delta = last_action.displacement
         location = HecsCoord.add(pos_before, pos_delta)
 
@@ -320,17 +483,14 @@ def get_agent_coords(game_events, instruction_done, agent_type):
 
     return location, orientation
 
+
 def get_cards_before(game_events, instruction, move, done=False):
     # Get all card events
-    card_types = [EventType.CARD_SPAWN, EventType.CARD_SELECT,
-                  EventType.CARD_SET, EventType.PROP_UPDATE]
-    if done:
-        card_events = game_events.where(Event.type << card_types,
-                                        Event.server_time <= move.server_time)        
-    else:
-        card_events = game_events.where(Event.type << card_types,
-                                        Event.server_time < move.server_time)
-    card_events = card_events.order_by(Event.server_time)
+    card_events = [
+        event
+        for event in game_events.before(move.server_time, inclusive=done)
+        if event.type in CARD_EVENT_TYPES
+    ]
 
     # Iterate over each card event
     props = []
@@ -350,13 +510,15 @@ def get_cards_before(game_events, instruction, move, done=False):
                     break
         else:
             prop_update = PropUpdate.from_json(event.data)
-            props = [prop for prop in prop_update.props if prop.prop_type == PropType.CARD]
+            props = [
+                prop for prop in prop_update.props if prop.prop_type == PropType.CARD
+            ]
 
     return props
 
 
-def get_swsd_information(dynamic_maps, instruction, moves):
-    instruction_completed = instruction_is_completed(instruction)
+def get_swsd_information(game_events, dynamic_maps, instruction, moves):
+    instruction_completed = instruction_is_completed(game_events, instruction)
     final_follower_pos = get_final_follower_pos(
         dynamic_maps[-1], instruction_completed, moves
     )
@@ -402,6 +564,7 @@ def get_change_grid(dynamic_maps):
 
     return change_grid, special_cards
 
+
 def get_action_masks(map_update, game_events, instruction, moves, actions):
     all_masks = []
     for i, action in enumerate(actions):
@@ -413,10 +576,10 @@ def get_action_masks(map_update, game_events, instruction, moves, actions):
             follower_rot = moves[i].orientation
         else:
             # First get the instruction done event
-            instruction_done = game_events.select().where(Event.type == EventType.INSTRUCTION_DONE,
-                                                          Event.short_code == instruction.short_code)
-            instruction_done = instruction_done.order_by(Event.server_time).get()
-            follower_loc, follower_rot = get_agent_coords(game_events, instruction_done, "FOLLOWER")
+            instruction_done = get_instruction_done(game_events, instruction)
+            follower_loc, follower_rot = get_agent_coords(
+                game_events, instruction_done, "FOLLOWER"
+            )
             follower_rot = (follower_rot + 60) % 360
 
         follower = Actor(0, 0, 0, follower_loc)
@@ -442,81 +605,62 @@ def get_action_masks(map_update, game_events, instruction, moves, actions):
     return all_masks
 
 
-def save_leader_games(args, games, output_dir):
+def get_game_leader_actions(game_events):
     leader_trajectories = {}
 
-    # Go through each game provided
-    num_instructions = 0
-    ParentEvent = Event.alias()
-    for game in games:
-        # Get all events associated with the current game
-        game_events = (
-            Event.select()
-            .join(
-                ParentEvent,
-                peewee.JOIN.LEFT_OUTER,
-                on=(Event.parent_event == ParentEvent.id),
-            )
-            .where(Event.game_id == game.id)
-            .order_by(Event.server_time)
-        )
+    # Iterate over each active instruction
+    for instruction in game_events.of_type(EventType.INSTRUCTION_SENT):
+        instruction_activation = get_instruction_activation(game_events, instruction)
+        if instruction_activation is None:
+            continue
 
-        # Iterate over each active instruction
-        instructions = game_events.where(Event.type == EventType.INSTRUCTION_SENT)
-        for instruction in instructions:
-            # First extract the instruction text
-            instruction_activation = get_instruction_activation(instruction)
-            if instruction_activation is None:
-                continue
+        leader_actions = get_leader_actions(game_events, instruction)
+        leader_trajectories[instruction_activation.id] = leader_actions
 
-            leader_actions = get_leader_actions(game_events, instruction)
-            leader_trajectories[instruction_activation.id] = leader_actions
+    return leader_trajectories
 
-            num_instructions += 1
-            if num_instructions % 150 == 0:
-                print(f"Leader processing: Instruction {num_instructions}")
+
+def save_leader_games(shard_paths, output_dir):
+    # Each shard holds the leader actions of its games. Merge them into one file.
+    leader_trajectories = {}
+    for path in shard_paths:
+        leader_trajectories.update(load_pickle(path)["leader_actions"])
 
     datapath = os.path.join(output_dir, f"pretrain_leader_actions.pkl")
-    with open(datapath, "wb") as f:
-        pickle.dump(leader_trajectories, f)
+    dump_pickle(datapath, leader_trajectories)
+    print(f"Saved leader actions for {len(leader_trajectories)} instructions")
 
 
 def get_leader_actions(game_events, instruction):
-    # First extract the leader moves from the SQL
+    # First extract the leader moves
     all_actions = []
-    moves = instruction.children.where(
-        Event.type == EventType.ACTION, Event.role == "Role.LEADER"
-    )
-    moves = moves.order_by(Event.server_time)
+    moves = game_events.children(instruction, EventType.ACTION, role="Role.LEADER")
 
     # Next, convert these into a format usable by the game wrapper
     if len(moves) > 0:
-        last_turn = get_move_turn(moves[0])
+        last_turn = get_move_turn(game_events, moves[0])
         for move in moves:
             # If the turn has changed
-            move_turn = get_move_turn(move)
+            move_turn = get_move_turn(game_events, move)
             if last_turn != move_turn:
                 all_actions.append(data_cls.ActionEnums["END_TURN"])
-                last_turn = move.turn_number
+                last_turn = move_turn
 
             # Add the move action id
-            all_actions.append(data_cls.ActionEnums[move.action_code])
+            all_actions.append(data_cls.ActionEnums[move.short_code])
     all_actions.append(data_cls.ActionEnums["END_TURN"])
 
     return all_actions
 
 
 def get_move_turn(game_events, move):
-    # Get the turn start events before the move
-    turn_starts = game_events.select().where(
-        Event.type == EventType.START_OF_TURN, Event.server_time < move.server_time
-    )
-    turn_starts = turn_starts.order_by(Event.server_time)
+    # Get the last turn start event before the move
+    turn_start = game_events.last_before(move.server_time, EventType.START_OF_TURN)
 
-    if len(turn_starts) == 0:
+    if turn_start is None:
         return 0
     else:
-        return turn_starts[-1].turn_number + 1
+        return turn_start.turn_number + 1
 
 
 def main():
@@ -532,9 +676,9 @@ def main():
 
     # Get train and val games
     train_games, val_games = get_tr_val_games(cfg)
-    preprocess_games(args, train_games, args.output_dir, "train")
-    preprocess_games(args, val_games, args.output_dir, "val")
-    save_leader_games(args, train_games + val_games, args.output_dir)
+    train_shards = preprocess_games(args, train_games, args.output_dir, "train")
+    val_shards = preprocess_games(args, val_games, args.output_dir, "val")
+    save_leader_games(train_shards + val_shards, args.output_dir)
 
 
 if __name__ == "__main__":
@@ -4,8 +4,10 @@
 # sent by the pyclient.
 
 import math
+from collections import OrderedDict
 
 import nest_asyncio
+import numpy as np
 import torch
 from torch.nn.utils.rnn import pad_sequence
 from transformers import GPT2Tokenizer
@@ -14,6 +16,7 @@ import server.db_tools.db_utils as db_utils
 from follower_bots.constants import (
     ACT_DIM,
     EDGE_WIDTH,
+    INFERENCE_HORIZON,
     TEXT_SEP_IDX,
     TORCH_DEVICE,
     VISIBLE_DISTANCE,
@@ -31,6 +34,7 @@ from py_client.endpoint_pair import EndpointPair
 from py_client.game_endpoint import Action, Role
 from py_client.local_game_coordinator import LocalGameCoordinator
 from server.config.config import ReadConfigOrDie
+from server.scenario_cache import ScenarioCache
 
 # FOLLOWER UTILITIES #
 
@@ -95,115 +99,189 @@ def process_instruction(instruction):
     return tokens, text_mask
 
 
-def get_processed_states(states, map, cards, actors):
-    # Hex conversion modules
-    axial_converter = OffsetToAxialConverter(EDGE_WIDTH)
-    translator_rotator = AxialTranslatorRotator(EDGE_WIDTH).to(TORCH_DEVICE)
-    tensor_cropper = HexCrop(2 * VISIBLE_DISTANCE + 1).to(TORCH_DEVICE)
+class StateProcessor:
+    """
+    Converts game states into the BxPx15x15 follower-centric hex views that the
+    follower model consumes. The hex conversion modules are built once.
+    """
 
-    # Construct hex input for current state
-    property_tensors = get_property_tensor(states, map, cards, actors)  # 1xPx25x25
-    axial_tensors = axial_converter(property_tensors)
+    def __init__(self):
+        # Hex conversion modules
+        self.axial_converter = OffsetToAxialConverter(EDGE_WIDTH)
+        self.translator_rotator = AxialTranslatorRotator(EDGE_WIDTH).to(TORCH_DEVICE)
+        self.tensor_cropper = HexCrop(2 * VISIBLE_DISTANCE + 1).to(TORCH_DEVICE)
+
+    def __call__(self, maps, all_cards, all_actors):
+        # Construct hex inputs for the current states
+        property_tensors = []
+        for map, cards, actors in zip(maps, all_cards, all_actors):
+            property_tensors.append(
+                get_property_tensor([], map, cards, actors).squeeze(0)
+            )  # Px25x25
+        property_tensors = pad_sequence(
+            property_tensors, padding_value=MapProperty["PAD"].value, batch_first=True
+        )  # BxPx25x25
+        axial_tensors = self.axial_converter(property_tensors)
+
+        poses = get_poses_mp(all_actors)
+        rotated_tensors = self.translator_rotator(axial_tensors, poses)
+
+        bsz = len(maps)
+        new_positions = torch.full(
+            (bsz, 2), EDGE_WIDTH + EDGE_WIDTH // 2, device=TORCH_DEVICE
+        )
+        cropped_tensors = self.tensor_cropper(
+            rotated_tensors[0], new_positions, True
+        )  # BxPx15x15
 
-    poses = get_poses(actors)
-    rotated_tensors = translator_rotator(axial_tensors, poses)
+        return cropped_tensors[0].cpu().type(torch.LongTensor)
 
-    new_positions = torch.full(
-        (1, 2), EDGE_WIDTH + EDGE_WIDTH // 2, device=TORCH_DEVICE
-    )
-    cropped_tensors = tensor_cropper(
-        rotated_tensors[0], new_positions, True
-    )  # 1xPx15x15
 
-    curr_state = cropped_tensors[0].unsqueeze(0).cpu().type(torch.LongTensor)
+class RolloutStates:
+    """
+    The processed state history of a batch of follower rollouts.
 
-    # Pad the states if necessary
-    if states != []:
-        B, T, P, H, W = states.shape
-        if P < curr_state.shape[2]:
-            padding = torch.full(
-                (B, T, curr_state.shape[2] - P, H, W), MapProperty["PAD"].value
-            )
-            states = torch.cat([states, padding], dim=2)
-        return torch.cat([states, curr_state], dim=1)
-    else:
-        return curr_state
+    The hex conversion modules are kept resident, and each new frame is written
+    into a preallocated BxT_maxxPxHxW buffer instead of concatenating the whole
+    history every step. DecisionTransformer.rollout_with_past only embeds the
+    newest frame, so with its KV cache a step costs the same however far into
+    the instruction the rollout is.
+    """
 
+    def __init__(
+        self, batch_size=1, max_steps=INFERENCE_HORIZON + 1, max_properties=16
+    ):
+        self.state_processor = StateProcessor()
 
-def get_processed_states_mp(
-    states,
-    maps,
-    all_cards,
-    all_actors,
-    axial_converter,
-    translator_rotator,
-    tensor_cropper,
-):
-    # Construct hex inputs for the current states
-    property_tensors = []
-    for map, cards, actors in zip(maps, all_cards, all_actors):
-        property_tensors.append(
-            get_property_tensor(states, map, cards, actors).squeeze(0)
-        )  # Px25x25
-    property_tensors = pad_sequence(
-        property_tensors, padding_value=MapProperty["PAD"].value, batch_first=True
-    )  # BxPx25x25
-    axial_tensors = axial_converter(property_tensors)
-
-    poses = get_poses_mp(all_actors)
-    rotated_tensors = translator_rotator(axial_tensors, poses)
-
-    bsz = len(maps)
-    new_positions = torch.full(
-        (bsz, 2), EDGE_WIDTH + EDGE_WIDTH // 2, device=TORCH_DEVICE
-    )
-    cropped_tensors = tensor_cropper(
-        rotated_tensors[0], new_positions, True
-    )  # BxPx15x15
-
-    curr_state = cropped_tensors[0].unsqueeze(1).cpu().type(torch.LongTensor)
-
-    # Pad the states if necessary
-    if states != []:
-        B, T, P, H, W = states.shape
-        if P < curr_state.shape[2]:
-            padding = torch.full(
-                (B, T, curr_state.shape[2] - P, H, W), MapProperty["PAD"].value
-            )
-            states = torch.cat([states, padding], dim=2)
-        return torch.cat([states, curr_state], dim=1)
-    else:
-        return curr_state
+        view_size = 2 * VISIBLE_DISTANCE + 1
+        self.buffer = torch.full(
+            (batch_size, max_steps, max_properties, view_size, view_size),
+            MapProperty["PAD"].value,
+            dtype=torch.long,
+        )
+        self.num_steps = 0
+        self.num_properties = 0
+
+    def reset(self):
+        self.num_steps = 0
+        self.num_properties = 0
+
+    def states(self):
+        # Frames are padded to the largest number of properties seen so far
+        return self.buffer[:, : self.num_steps, : self.num_properties]  # BxTxPxHxW
+
+    def append(self, maps, all_cards, all_actors):
+        """
+        Processes the current state of each game and adds it to the history.
+        Returns the BxTxPxHxW history, which is a view of the buffer.
+        """
+        frames = self.state_processor(maps, all_cards, all_actors)  # BxPxHxW
+        num_properties = frames.shape[1]
+        self.reserve(self.num_steps + 1, num_properties)
+
+        self.buffer[:, self.num_steps].fill_(MapProperty["PAD"].value)
+        self.buffer[:, self.num_steps, :num_properties] = frames
+        self.num_steps += 1
+        self.num_properties = max(self.num_properties, num_properties)
+        return self.states()
+
+    def reserve(self, num_steps, num_properties):
+        # Grow the buffer if needed. This is rare, so double it to amortize copies
+        B, T, P, H, W = self.buffer.shape
+        if num_steps <= T and num_properties <= P:
+            return
+        new_T = T if num_steps <= T else max(2 * T, num_steps)
+        new_P = max(P, num_properties)
+        buffer = torch.full(
+            (B, new_T, new_P, H, W), MapProperty["PAD"].value, dtype=torch.long
+        )
+        buffer[:, :T, :P] = self.buffer
+        self.buffer = buffer
+
+
+class PropertyFeaturizer:
+    """
+    Builds the Px25x25 tensor of property indices describing a game state.
+
+    The static properties of a map never change within a game, so they are
+    computed once per map and cached by map identity. On each step, only the
+    few tiles holding cards or agents are visited, and their properties are
+    scattered on top of the static ones with index arrays.
+    """
+
+    def __init__(self, capacity=64):
+        self.capacity = capacity
+        # Maps from id(map) -> (map, static properties, static property counts)
+        self.static_cache = OrderedDict()
+
+    def static_properties(self, map):
+        """
+        Returns an SxEDGE_WIDTH**2 array of the map's static properties, padded
+        with PAD, and the number of static properties on each tile.
+        """
+        entry = self.static_cache.get(id(map), None)
+        # The cache holds a reference to each map, so ids can't be reused
+        # while their entry exists. Still check in case of a stale entry.
+        if entry is not None and entry[0] is map:
+            self.static_cache.move_to_end(id(map))
+            return entry[1], entry[2]
+
+        counts = np.zeros(EDGE_WIDTH**2, dtype=np.int64)
+        layers, cells, values = self.scatter_indices(
+            StaticMap(map).coord_to_props, counts
+        )
+        np.add.at(counts, cells, 1)
+        static = np.full(
+            (counts.max(initial=0), EDGE_WIDTH**2),
+            MapProperty["PAD"].value,
+            dtype=np.int64,
+        )
+        static[layers, cells] = values
+
+        self.static_cache[id(map)] = (map, static, counts)
+        while len(self.static_cache) > self.capacity:
+            self.static_cache.popitem(last=False)
+        return static, counts
+
+    def scatter_indices(self, coord_to_props, offsets):
+        # Each tile's properties are placed after the offsets[tile] already on it
+        layers, cells, values = [], [], []
+        for (x, y), props in coord_to_props.items():
+            if not (0 <= x < EDGE_WIDTH and 0 <= y < EDGE_WIDTH):
+                continue
+            cell = x * EDGE_WIDTH + y
+            for i, prop in enumerate(props):
+                layers.append(offsets[cell] + i)
+                cells.append(cell)
+                values.append(prop.value)
+        return (
+            np.array(layers, dtype=np.int64),
+            np.array(cells, dtype=np.int64),
+            np.array(values, dtype=np.int64),
+        )
+
+    def __call__(self, map, cards, actors):
+        static, counts = self.static_properties(map)
+
+        f_loc, f_ang, l_loc, l_ang = get_agent_coords(actors)
+        dynamic_map = DynamicMap(cards, f_loc, f_ang, l_loc, l_ang)
+        layers, cells, values = self.scatter_indices(dynamic_map.coord_to_props, counts)
+
+        num_properties = max(static.shape[0], layers.max(initial=-1) + 1)
+        properties = np.full(
+            (num_properties, EDGE_WIDTH**2), MapProperty["PAD"].value, dtype=np.int64
+        )
+        properties[: static.shape[0]] = static
+        properties[layers, cells] = values
+        return properties.reshape(-1, EDGE_WIDTH, EDGE_WIDTH)  # Px25x25
+
+
+property_featurizer = PropertyFeaturizer()
 
 
 def get_property_tensor(states, map, cards, actors):
-    properties = [[] for i in range(EDGE_WIDTH**2)]
-
-    # Process the properties: This is not the most efficient but reuses code
-    static_map = StaticMap(map)
-    f_loc, f_ang, l_loc, l_ang = get_agent_coords(actors)
-    dynamic_map = DynamicMap(cards, f_loc, f_ang, l_loc, l_ang)
-
-    # Add the properties from the processed data structures
-    for x in range(EDGE_WIDTH):
-        for y in range(EDGE_WIDTH):
-            # Add static props
-            if (x, y) in static_map.coord_to_props:
-                properties[x * EDGE_WIDTH + y].extend(
-                    [prop.value for prop in static_map.coord_to_props[(x, y)]]
-                )
-            if (x, y) in dynamic_map.coord_to_props:
-                properties[x * EDGE_WIDTH + y].extend(
-                    [prop.value for prop in dynamic_map.coord_to_props[(x, y)]]
-                )
-
-    # Pad it
-    properties = [torch.Tensor(prop) for prop in properties]
-    properties = (
-        pad_sequence(properties, padding_value=MapProperty["PAD"].value)
-        .view(-1, EDGE_WIDTH, EDGE_WIDTH)
-        .unsqueeze(0)
-    )  # 1xPx25x25
+    properties = torch.from_numpy(property_featurizer(map, cards, actors))
+    properties = properties.float().unsqueeze(0)  # 1xPx25x25
 
     if states != []:
         B, P, H, W = properties.shape
@@ -230,11 +308,6 @@ def get_agent_coords(actors):
     return f_loc, f_ang, l_loc, l_ang
 
 
-def get_poses(actors):
-    positions, rotations = get_pose(actors)
-    return Pose(positions, rotations)
-
-
 def get_pose(actors):
     follower_actor = None
     for actor in actors:
@@ -362,7 +435,9 @@ def initialize_coordinator(args):
     nest_asyncio.apply()
     config = ReadConfigOrDie(args.config_filepath)
     db_utils.ConnectToDatabase(config)
-    return LocalGameCoordinator(config)
+    # Validation replays the same instructions every epoch.
+    scenario_cache = ScenarioCache(config.scenario_cache_path())
+    return LocalGameCoordinator(config, scenario_cache=scenario_cache)
 
 
 def get_local_game(coordinator, i_uuid, i_uuid_to_actions):
@@ -6,13 +6,16 @@
 
 import math
 import os
+import shutil
 
+import numpy as np
 import torch
 from torch.nn.utils.rnn import pad_sequence
 from torch.utils.data import DataLoader, Dataset
 from transformers import GPT2Tokenizer
 
 from follower_bots.constants import (
+    ACT_DIM,
     EDGE_WIDTH,
     MAX_TIME,
     TEXT_PAD_IDX,
@@ -25,11 +28,22 @@ from follower_bots.data_utils.data_classes import (
     DynamicProperty,
     MapProperty,
 )
+from follower_bots.data_utils.preprocess_sql import load_trajectories
 from follower_bots.data_utils.pyclient_utils import leader_idx_to_game_action
 from follower_bots.models.hex_conv import HexCrop
 from follower_bots.models.hex_util import AxialTranslatorRotator, OffsetToAxialConverter
 from follower_bots.models.pose import Pose
-from follower_bots.utils import load_pickle
+from follower_bots.utils import dump_pickle, load_pickle, mkdir
+
+# Columns of the preprocessed dataset which are memory mapped from .npy files
+MEMMAP_COLUMNS = [
+    "instructions",
+    "pos_indices",
+    "states",
+    "actions",
+    "action_masks",
+    "change_grids",
+]
 
 
 class SQLDataset(Dataset):
@@ -38,6 +52,13 @@ class SQLDataset(Dataset):
     The initialization code assumes that the SQLite database holding the games
     to train on has been preprocessed into a .pkl file holding the relevant information
     for behavior cloning.
+
+    On first use, the trajectories are converted into a folder of flat columnar
+    .npy arrays (see write_columns), which are then opened with np.memmap. Each
+    column concatenates the timesteps of every trajectory, and offsets.npy
+    holds where each trajectory starts. DataLoader workers share the mapped
+    pages through the OS page cache instead of each holding a copy of the
+    corpus, and only the accessed trajectories are ever read from disk.
     """
 
     def __init__(
@@ -54,122 +75,167 @@ class SQLDataset(Dataset):
                                   SQLite database for instruction following.
         * split (str):            train or val
         * standard_path (str):    The full path to the pickle file containing the preprocessed
-                                  version of the SQLite database. If None, this path will be
-                                  constructed using dataset_path.
-        * preprocess_path (str):  The path to which the database contents should be saved following
-                                  additional preprocessing. If None, this path will be constructed
-                                  using dataset_path.
+                                  version of the SQLite database. If the file doesn't exist, the
+                                  shards written by preprocess_sql are loaded instead. If None,
+                                  this path will be constructed using dataset_path.
+        * preprocess_path (str):  The folder to which the columnar version of the dataset should
+                                  be saved following additional preprocessing. If None, this path
+                                  will be constructed using dataset_path.
         """
+        self.device = device
 
         # Determine where to save the dataset following preprocessing
         if preprocess_path is None:
-            preprocess_path = os.path.join(
-                dataset_path, f"pretrain_{split}_preprocess.pkl"
-            )
+            preprocess_path = os.path.join(dataset_path, f"pretrain_{split}_columns")
 
         # If we've performed preprocessing once, load from saved data
-        if os.path.exists(preprocess_path):
-            self.load_from_preprocessed(preprocess_path, device)
-        else:
+        if not os.path.exists(os.path.join(preprocess_path, "offsets.npy")):
             if standard_path is None:
                 standard_path = os.path.join(dataset_path, f"pretrain_{split}.pkl")
-            self.load_from_standard(
-                standard_path, preprocess_path, device
-            )
+            self.write_columns(standard_path, preprocess_path)
+        self.load_columns(preprocess_path)
 
-    def load_from_standard(
-        self, dataset_path, preprocess_path, device=TORCH_DEVICE
-    ):
-        trajectories = load_pickle(dataset_path)
+    def write_columns(self, standard_path, preprocess_path):
+        trajectories = load_trajectories(standard_path)
 
-        self.instructions = []
-        self.pos_indices = []
-        self.states = []
-        self.actions = []
-        self.timesteps = []
-        self.ids = []
-        self.swsd_info = []
-        self.action_masks = []
-
-        self.device = device
-
-        # Process the text instructions
-        self.process_text(trajectories)
+        # Tokenize the text instructions
+        tokenizer = GPT2Tokenizer.from_pretrained("gpt2")
+        tokenized = self.tokenize_instructions(trajectories, tokenizer)
+        max_length = max([len(token_ids) for token_ids in tokenized])
         print("Processed all text items")
 
-        # Process the states
-        self.process_states(trajectories)
-        print("Processed all states")
+        # Each trajectory occupies [offsets[i], offsets[i + 1]) in the per-timestep columns
+        lengths = [len(trajectory[3]) for trajectory in trajectories]
+        offsets = np.zeros(len(trajectories) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        num_steps = int(offsets[-1])
+        max_property_size = self.get_max_property_size(trajectories)
+        view_size = 2 * VISIBLE_DISTANCE + 1
+
+        # Write into a temporary folder so an interrupted run isn't loaded later
+        temp_path = preprocess_path + ".tmp"
+        if os.path.exists(temp_path):
+            shutil.rmtree(temp_path)
+        mkdir(temp_path)
+
+        def column(name, dtype, shape):
+            return np.lib.format.open_memmap(
+                os.path.join(temp_path, f"{name}.npy"),
+                mode="w+",
+                dtype=dtype,
+                shape=shape,
+            )
 
-        # Process actions, timesteps and ids
-        self.process_others(trajectories)
-
-        # Load the action masks
-        torch.save(
-            [
-                self.instructions,
-                self.pos_indices,
-                self.states,
-                self.actions,
-                self.timesteps,
-                self.ids,
-                self.swsd_info,
-                self.action_masks,
-            ],
-            preprocess_path,
+        instructions = column("instructions", np.int32, (len(trajectories), max_length))
+        pos_indices = column("pos_indices", np.int16, (len(trajectories), max_length))
+        states = column(
+            "states", np.int8, (num_steps, max_property_size, view_size, view_size)
         )
+        actions = column("actions", np.int8, (num_steps,))
+        action_masks = column("action_masks", np.bool_, (num_steps, ACT_DIM))
+        change_grids = column(
+            "change_grids", np.int8, (len(trajectories), EDGE_WIDTH, EDGE_WIDTH)
+        )
+        np.save(os.path.join(temp_path, "offsets.npy"), offsets)
+
+        hex_modules = self.get_hex_modules()
+        metadata = []
+        for i, trajectory in enumerate(trajectories):
+            (
+                _,
+                static_map,
+                dynamic_map,
+                trajectory_actions,
+                g_id,
+                i_uuid,
+                final_pos,
+                change_grid,
+                special_cards,
+                trajectory_masks,
+            ) = trajectory
+            start, end = offsets[i], offsets[i + 1]
+
+            # Left pad the instruction and its position indices
+            token_ids = tokenized[i]
+            padding = max_length - len(token_ids)
+            instructions[i] = [TEXT_PAD_IDX] * padding + token_ids
+            pos_indices[i] = [0] * padding + list(range(len(token_ids)))
+
+            states[start:end] = self.to_column(
+                self.process_state(
+                    static_map, dynamic_map, max_property_size, hex_modules
+                ),
+                np.int8,
+            )
+            actions[start:end] = [action.value for action in trajectory_actions]
+            action_masks[start:end] = trajectory_masks.numpy()
+            change_grids[i] = self.to_column(change_grid, np.int8)
 
-    def load_from_preprocessed(self, preprocess_path, device=TORCH_DEVICE):
-        contents = torch.load(preprocess_path)
-
-        self.instructions = contents[0]
-        self.pos_indices = contents[1]
-        self.states = contents[2]
-        self.actions = contents[3]
-        self.timesteps = contents[4]
-        self.ids = contents[5]
-        self.swsd_info = contents[6]
-        self.action_masks = contents[7]
-
-        self.device = device
-
-    def process_text(self, trajectories):
-        # Initialize tokenizer
-        tokenizer = GPT2Tokenizer.from_pretrained("gpt2")
-        pad_index = [TEXT_PAD_IDX]
-
-        # Tokenize each instruction and add them to list
-        tokenized = self.tokenize_instructions(trajectories, tokenizer)
-        max_length = max([len(token_ids) for token_ids in tokenized])
-
-        # Add padding to each instruction
-        self.pad_instructions(tokenized, max_length, pad_index)
+            # Small per-trajectory values which don't fit a flat column
+            metadata.append(((g_id, i_uuid.hex), final_pos, special_cards))
+        print("Processed all states")
 
-    def process_states(self, trajectories):
+        for array in [instructions, pos_indices, states, actions, action_masks]:
+            array.flush()
+        change_grids.flush()
+        dump_pickle(os.path.join(temp_path, "metadata.pkl"), metadata)
+        os.rename(temp_path, preprocess_path)
+
+    def to_column(self, tensor, dtype):
+        array = tensor.numpy()
+        if array.size > 0 and (
+            array.min() < np.iinfo(dtype).min or array.max() > np.iinfo(dtype).max
+        ):
+            raise ValueError(f"Values don't fit in a {np.dtype(dtype).name} column")
+        return array.astype(dtype)
+
+    def load_columns(self, preprocess_path):
+        self.preprocess_path = preprocess_path
+        for name in MEMMAP_COLUMNS:
+            setattr(self, name, self.open_column(name))
+        self.offsets = np.load(os.path.join(preprocess_path, "offsets.npy"))
+        self.metadata = load_pickle(os.path.join(preprocess_path, "metadata.pkl"))
+
+    def open_column(self, name):
+        return np.load(os.path.join(self.preprocess_path, f"{name}.npy"), mmap_mode="r")
+
+    def __getstate__(self):
+        # Pickling a memmap copies its contents. DataLoader workers started with
+        # spawn instead reopen the columns from disk.
+        state = self.__dict__.copy()
+        for name in MEMMAP_COLUMNS:
+            del state[name]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.load_columns(self.preprocess_path)
+
+    def get_hex_modules(self):
         # Hex conversion modules
         axial_converter = OffsetToAxialConverter(EDGE_WIDTH)
         translator_rotator = AxialTranslatorRotator(EDGE_WIDTH).to(TORCH_DEVICE)
         tensor_cropper = HexCrop(2 * VISIBLE_DISTANCE + 1).to(TORCH_DEVICE)
+        return axial_converter, translator_rotator, tensor_cropper
 
-        # Process the states of each instruction individually
-        max_property_size = self.get_max_property_size(trajectories)
-        for _, static_map, dynamic_map, _, _, _, _, _, _, _ in trajectories:
-            property_tensors = self.get_property_tensor(
-                static_map, dynamic_map, max_property_size
-            )
-            axial_tensors = axial_converter(property_tensors)
+    def process_state(self, static_map, dynamic_map, max_property_size, hex_modules):
+        axial_converter, translator_rotator, tensor_cropper = hex_modules
+        property_tensors = self.get_property_tensor(
+            static_map, dynamic_map, max_property_size
+        )
+        axial_tensors = axial_converter(property_tensors)
 
-            poses = self.get_poses(dynamic_map)
-            rotated_tensors = translator_rotator(axial_tensors, poses)
+        poses = self.get_poses(dynamic_map)
+        rotated_tensors = translator_rotator(axial_tensors, poses)
 
-            new_positions = torch.full(
-                (len(dynamic_map), 2), EDGE_WIDTH + EDGE_WIDTH // 2, device=TORCH_DEVICE
-            )
-            cropped_tensors = tensor_cropper(rotated_tensors[0], new_positions, True)
+        new_positions = torch.full(
+            (len(dynamic_map), 2), EDGE_WIDTH + EDGE_WIDTH // 2, device=TORCH_DEVICE
+        )
+        cropped_tensors = tensor_cropper(rotated_tensors[0], new_positions, True)
 
-            self.states.append(
-                cropped_tensors[0].cpu().type(torch.LongTensor)
-            )  # Shape: TxPx(2*VISIBLE + 1)x(2*VISIBLE + 1)
+        return (
+            cropped_tensors[0].cpu().type(torch.LongTensor)
+        )  # Shape: TxPx(2*VISIBLE + 1)x(2*VISIBLE + 1)
 
     def get_max_property_size(self, trajectories):
         max_size = 0
@@ -270,57 +336,23 @@ class SQLDataset(Dataset):
 
         return tokenized
 
-    def pad_instructions(self, tokenized, max_length, pad_index):
-        for token_ids in tokenized:
-            # Add the padded position indices
-            curr_pos_indices = [i for i in range(len(token_ids))]
-            curr_pos_indices = [0] * (max_length - len(token_ids)) + curr_pos_indices
-            self.pos_indices.append(torch.LongTensor(curr_pos_indices))
-
-            # Add the padded text
-            token_padding = pad_index * (max_length - len(token_ids))
-            self.instructions.append(torch.LongTensor(token_padding + token_ids))
-
-    def process_others(self, trajectories):
-        for (
-            _,
-            _,
-            _,
-            actions,
-            g_id,
-            i_uuid,
-            final_pos,
-            change_grid,
-            special_cards,
-            action_masks,
-        ) in trajectories:
-
-            proc_action = torch.LongTensor([action.value for action in actions])
-            self.actions.append(proc_action)
-
-            proc_timesteps = torch.LongTensor(list(range(len(actions))))
-            self.timesteps.append(proc_timesteps)
-
-            self.ids.append((g_id, i_uuid.hex))
-
-            self.swsd_info.append((final_pos, change_grid, special_cards))
-
-            self.action_masks.append(action_masks)
-
     def __getitem__(self, idx):
+        start, end = self.offsets[idx], self.offsets[idx + 1]
+        ids, final_pos, special_cards = self.metadata[idx]
+        change_grid = torch.from_numpy(self.change_grids[idx].astype(np.float32))
         return (
-            self.instructions[idx],
-            self.pos_indices[idx],
-            self.states[idx],
-            self.actions[idx],
-            self.timesteps[idx],
-            self.ids[idx],
-            self.swsd_info[idx],
-            self.action_masks[idx],
+            torch.from_numpy(self.instructions[idx].astype(np.int64)),
+            torch.from_numpy(self.pos_indices[idx].astype(np.int64)),
+            torch.from_numpy(self.states[start:end].astype(np.int64)),
+            torch.from_numpy(self.actions[start:end].astype(np.int64)),
+            torch.arange(end - start),
+            ids,
+            (final_pos, change_grid, special_cards),
+            torch.from_numpy(np.array(self.action_masks[start:end])),
         )
 
     def __len__(self):
-        return len(self.instructions)
+        return len(self.offsets) - 1
 
 
 def sql_collate_fn(batch):
@@ -3,15 +3,14 @@
 Based on HexaConv (Hoogeboom et al. 2018, https://arxiv.org/pdf/1803.02108.pdf)
 Authors: Alane Suhr and Noriyuki Kojima
 """
-import math
 from typing import Tuple
 
-import numpy as np
 import torch
 from torch import nn
 from torch.nn import functional
 
-from follower_bots.constants import EDGE_WIDTH, FOG_END, FOV, UNITY_COORDS_SCALE
+from follower_bots.constants import EDGE_WIDTH, FOG_END, FOV
+from server.visibility import GetVisibilityTable
 
 
 def _get_hex_conv_mask(kernel_size: int) -> torch.Tensor:
@@ -28,61 +27,23 @@ def _get_hex_conv_mask(kernel_size: int) -> torch.Tensor:
 
 def _get_crop_mask(kernel_size: int, fov: float):
     # This is a mask that filters out: (1) values not within a distance of
-    # xxx from the center and (2) values not within the
-    # agent's FOV. The crop mask must be square with odd edges.
-
-    mask = torch.ones((kernel_size, kernel_size))
-    special_cases = [
-        ((kernel_size - 1) // 2 + 1, (kernel_size - 1) // 2 - 1),  # -60 degrees
-        ((kernel_size - 1) // 2, (kernel_size - 1) // 2 + 1),
-    ]  # 60 degrees
-    center_coord = ((kernel_size - 1) // 2, (kernel_size - 1) // 2)
-
-    for u in range(kernel_size):
-        for v in range(kernel_size):
-            visible = coordinate_is_visible(u, v, special_cases, center_coord, fov)
-            mask[u, v] = 1.0 if visible else 0.0
-
+    # FOG_END from the center and (2) values not within the agent's FOV. The
+    # crop mask must be square with odd edges.
+    #
+    # The crop is in axial coordinates with the agent facing along the u axis,
+    # which is a HECS heading of 60 degrees.
+    table = GetVisibilityTable(60, FOG_END, fov)
+    center = (kernel_size - 1) // 2
+    mask = torch.zeros((kernel_size, kernel_size))
+    for offset in table.offsets():
+        # Convert the HECS offset to axial coordinates.
+        u = offset.c - offset.r + center
+        v = offset.a + 2 * offset.r + center
+        if 0 <= u < kernel_size and 0 <= v < kernel_size:
+            mask[u, v] = 1.0
     return mask
 
 
-def coordinate_is_visible(u, v, special_cases, center_coord, fov):
-    # Treat the tiles immediately beside the agent as special cases
-    if (u, v) in special_cases or (u, v) == center_coord:
-        return True
-
-    # First filter based on (cartesian) distance
-    view_depth = FOG_END / UNITY_COORDS_SCALE + 0.5
-    if get_distance((u, v), center_coord) > view_depth:
-        return False
-
-    degrees_to = get_degrees(center_coord, (u, v))
-    left = (-fov / 2) % 360
-    right = (fov / 2) % 360
-    if left < right:
-        return left <= degrees_to <= right
-    else:
-        return left <= degrees_to or degrees_to <= right
-
-
-def get_cartesian(coords):
-    basis_matrix = np.array([[1, 0.5], [0, np.sqrt(3) / 2]])
-    return np.matmul(basis_matrix, np.array(coords))
-
-
-def get_distance(target, center):
-    diff = get_cartesian(center) - get_cartesian(target)
-    distance = np.sqrt(np.sum(diff**2))
-    return distance
-
-
-def get_degrees(center, target):
-    center = get_cartesian(center)
-    target = get_cartesian(target)
-    diff = target - center
-    return math.degrees(math.atan2(diff[1], diff[0])) % 360
-
-
 class HexConv(nn.Module):
     def __init__(
         self,
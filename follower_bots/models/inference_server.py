@@ -0,0 +1,275 @@
+# File: inference_server
+# ----------------------
+# Serves follower actions to many concurrent games from a single copy of the
+# follower model. Games submit requests to an in-process queue, and a
+# background thread runs every pending request through the model in one
+# batched forward pass per tick.
+
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from dataclasses import dataclass
+
+import numpy as np
+import torch
+from torch.distributions.categorical import Categorical
+
+from agents.agent import Agent
+from follower_bots.constants import (
+    ACT_DIM,
+    INFERENCE_HORIZON,
+    MAX_TIME,
+    TEXT_PAD_IDX,
+)
+from follower_bots.data_utils.data_classes import ActionEnums, MapProperty
+from follower_bots.data_utils.pyclient_utils import (
+    StateProcessor,
+    follower_idx_to_game_action,
+    generate_action_mask,
+    get_active_instruction,
+    process_instruction,
+)
+from py_client.game_endpoint import Action, GameState, Role
+
+
+@dataclass
+class ActionRequest:
+    session: "FollowerSession"
+    map: object
+    cards: list
+    actors: list
+    action_mask: torch.Tensor  # 1x5, True for actions which can't be taken
+    future: Future
+
+
+class FollowerInferenceServer:
+    """
+    Holds one follower model and serves actions for many concurrent games.
+    Each game plays through its own FollowerSession (see session()).
+
+    A background thread waits for a request, then collects any others that
+    arrive within max_wait_s, up to max_batch_size. The new states of the whole
+    batch are processed together, and the batch runs through the model as one
+    padded forward pass, built the same way sql_collate_fn builds training
+    batches.
+
+    The games in a batch are at different points of different instructions,
+    so their key/value caches can't be stacked. Each forward pass re-runs every
+    game's history instead. This is at most INFERENCE_HORIZON steps.
+    """
+
+    def __init__(
+        self, follower, sampling_strat="argmax", max_batch_size=64, max_wait_s=0.005
+    ):
+        """
+        Arguments:
+        * follower:               A DecisionTransformer or FollowerEnsemble. Only its
+                                  compute_probabilities method is used.
+        * sampling_strat (str):   argmax or softmax
+        * max_batch_size (int):   The most requests to run in one forward pass.
+        * max_wait_s (float):     How long to wait for more requests after the first one
+                                  of a batch arrives.
+        """
+        self.follower = follower
+        self.follower.eval()
+        self.sampling_strat = sampling_strat
+        self.max_batch_size = max_batch_size
+        self.max_wait_s = max_wait_s
+
+        self.state_processor = StateProcessor()
+        self.requests = queue.Queue()
+        self.stats = {"batches": 0, "requests": 0}
+        self.closed = False
+        self.thread = threading.Thread(target=self.serve, daemon=True)
+        self.thread.start()
+
+    def session(self):
+        return FollowerSession(self)
+
+    def submit(self, session, map, cards, actors, action_mask):
+        """
+        Queues a request for the session's next action. Returns a Future which
+        resolves to the index of the action.
+        """
+        if self.closed:
+            raise RuntimeError("The inference server is closed")
+        future = Future()
+        self.requests.put(
+            ActionRequest(session, map, cards, actors, action_mask, future)
+        )
+        return future
+
+    def close(self):
+        self.closed = True
+        self.requests.put(None)
+        self.thread.join()
+
+    def serve(self):
+        while True:
+            batch = self.next_batch()
+            if batch is None:
+                return
+            try:
+                actions = self.run_batch(batch)
+            except Exception as e:
+                for request in batch:
+                    request.future.set_exception(e)
+                continue
+            for request, action in zip(batch, actions):
+                request.future.set_result(action)
+
+    def next_batch(self):
+        request = self.requests.get()
+        if request is None:
+            return None
+
+        batch = [request]
+        deadline = time.monotonic() + self.max_wait_s
+        while len(batch) < self.max_batch_size:
+            try:
+                request = self.requests.get(
+                    timeout=max(0.0, deadline - time.monotonic())
+                )
+            except queue.Empty:
+                break
+            if request is None:
+                # Stop after serving this batch
+                self.requests.put(None)
+                break
+            batch.append(request)
+        return batch
+
+    def run_batch(self, batch):
+        # Process the new states of every game at once
+        frames = self.state_processor(
+            [request.map for request in batch],
+            [request.cards for request in batch],
+            [request.actors for request in batch],
+        )  # BxPxHxW
+
+        # The new states are only added to the sessions once the batch succeeds,
+        # so a failed batch doesn't leave any history a state ahead of its actions
+        sessions = [request.session for request in batch]
+        histories = [
+            session.frames + [frame] for session, frame in zip(sessions, frames)
+        ]
+        action_masks = [request.action_mask for request in batch]
+        with torch.no_grad():
+            probs = self.follower.compute_probabilities(
+                *self.collate(sessions, histories, action_masks)
+            )  # BxTxA
+
+        # Each game's action is predicted from its latest state
+        last_steps = torch.LongTensor([len(history) - 1 for history in histories])
+        final_probs = probs[torch.arange(len(batch)), last_steps, :-1].cpu()
+        if self.sampling_strat == "softmax":
+            actions = Categorical(final_probs).sample()
+        else:
+            actions = torch.argmax(final_probs, dim=1)
+
+        for session, frame in zip(sessions, frames):
+            session.frames.append(frame)
+        self.stats["batches"] += 1
+        self.stats["requests"] += len(batch)
+        return actions.tolist()
+
+    def collate(self, sessions, histories, action_masks):
+        B = len(sessions)
+        T = max(len(history) for history in histories)
+        P = max(frame.shape[0] for history in histories for frame in history)
+        H, W = histories[0][0].shape[1:]
+
+        # States, actions and timesteps are padded at the end
+        states = torch.full((B, T, P, H, W), MapProperty["PAD"].value, dtype=torch.long)
+        actions = torch.full((B, T), ActionEnums["PAD"].value, dtype=torch.long)
+        timesteps = torch.full((B, T), MAX_TIME, dtype=torch.long)
+        attention_mask = torch.zeros((B, T), dtype=torch.long)
+        action_mask = torch.zeros((B, T, ACT_DIM), dtype=torch.bool)
+        action_mask[:, :, -1] = True  # PAD is never predicted
+
+        # Text is padded at the front
+        L = max(len(session.tokens) for session in sessions)
+        text = torch.full((B, L), TEXT_PAD_IDX, dtype=torch.long)
+        text_mask = torch.zeros((B, L), dtype=torch.long)
+        text_pos = torch.zeros((B, L), dtype=torch.long)
+
+        for i, (session, history) in enumerate(zip(sessions, histories)):
+            steps = len(history)
+            for t, frame in enumerate(history):
+                states[i, t, : frame.shape[0]] = frame
+            actions[i, : steps - 1] = torch.LongTensor(session.actions)
+            timesteps[i, :steps] = torch.arange(steps)
+            attention_mask[i, :steps] = 1
+            action_mask[i, steps - 1, :-1] = action_masks[i][0]
+
+            num_tokens = len(session.tokens)
+            text[i, L - num_tokens :] = session.tokens
+            text_mask[i, L - num_tokens :] = 1
+            text_pos[i, L - num_tokens :] = torch.arange(num_tokens)
+
+        # Position indices
+        state_pos = torch.arange(1, 2 * T + 1, dtype=torch.long)  # 2T
+        state_pos = state_pos.unsqueeze(0).repeat(B, 1) + text_pos[:, -1:]  # B x 2T
+        pos_idx = torch.cat([text_pos, state_pos], dim=1)  # B x (T' + 2T)
+
+        return (
+            states,
+            actions,
+            timesteps,
+            text,
+            pos_idx,
+            attention_mask,
+            text_mask,
+            action_mask,
+        )
+
+
+class FollowerSession(Agent):
+    """
+    A follower agent for a single game, backed by a FollowerInferenceServer.
+    It holds the game's history for the current instruction, which is reset
+    when the instruction changes or the follower marks it as done. Each call
+    to choose_action blocks until the server has run the request's batch.
+    """
+
+    def __init__(self, server):
+        self.server = server
+        self.instruction_uuid = None
+        self.tokens = None
+        self.frames = []
+        self.actions = []
+
+    # OVERRIDES role
+    def role(self) -> Role:
+        return Role.FOLLOWER
+
+    # OVERRIDES choose_action
+    def choose_action(self, game_state: GameState, action_mask=None) -> Action:
+        map, cards, _, instructions, actors, _ = game_state
+        instruction = get_active_instruction(instructions)
+        if instruction.uuid != self.instruction_uuid:
+            self.reset(instruction)
+
+        if len(self.actions) >= INFERENCE_HORIZON:
+            action = ActionEnums["DONE"].value
+        else:
+            if action_mask is None:
+                model_action_mask = torch.zeros((1, ACT_DIM - 1), dtype=torch.bool)
+            else:
+                model_action_mask = generate_action_mask(np.asarray(action_mask))
+            future = self.server.submit(self, map, cards, actors, model_action_mask)
+            action = future.result()
+        self.actions.append(action)
+
+        # Start a new history for the next instruction
+        if action == ActionEnums["DONE"].value:
+            self.instruction_uuid = None
+        return follower_idx_to_game_action(action, instruction.uuid)
+
+    def reset(self, instruction):
+        self.instruction_uuid = instruction.uuid
+        tokens, _ = process_instruction(instruction.text)
+        self.tokens = tokens[0]
+        self.frames = []
+        self.actions = []
@@ -0,0 +1,70 @@
+import unittest
+
+try:
+    import torch
+
+    from follower_bots.models.inference_server import FollowerInferenceServer
+except ImportError:
+    torch = None
+
+
+class FakeFollower(object):
+    """Always picks action 2, or raises while fail is set."""
+
+    def __init__(self):
+        self.fail = False
+
+    def eval(self):
+        pass
+
+    def compute_probabilities(self, states, actions, *args):
+        if self.fail:
+            raise RuntimeError("Injected failure")
+        probs = torch.zeros((*actions.shape, 6))
+        probs[:, :, 2] = 1
+        return probs
+
+
+@unittest.skipIf(torch is None, "torch is not installed")
+class FollowerInferenceServerTest(unittest.TestCase):
+    def setUp(self):
+        self.follower = FakeFollower()
+        self.server = FollowerInferenceServer(self.follower, max_wait_s=0.05)
+        # Skip map processing, which needs real game states.
+        self.server.state_processor = lambda maps, cards, actors: torch.zeros(
+            (len(maps), 1, 15, 15), dtype=torch.long
+        )
+
+    def tearDown(self):
+        self.server.close()
+
+    def submit(self, session):
+        action_mask = torch.zeros((1, 5), dtype=torch.bool)
+        return self.server.submit(session, None, [], [], action_mask)
+
+    def test_failed_batch(self):
+        sessions = [self.server.session() for _ in range(2)]
+        for session in sessions:
+            session.tokens = torch.LongTensor([1, 2, 3])
+
+        self.follower.fail = True
+        futures = [self.submit(session) for session in sessions]
+        for future in futures:
+            with self.assertRaises(RuntimeError):
+                future.result()
+        self.follower.fail = False
+        for session in sessions:
+            self.assertEqual(len(session.frames), 0)
+
+        # Later requests from the same sessions still work.
+        for _ in range(3):
+            futures = [self.submit(session) for session in sessions]
+            for session, future in zip(sessions, futures):
+                session.actions.append(future.result())
+        for session in sessions:
+            self.assertEqual(len(session.frames), 3)
+            self.assertEqual(session.actions, [2, 2, 2])
+
+
+if __name__ == "__main__":
+    unittest.main()
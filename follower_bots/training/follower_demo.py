@@ -5,21 +5,14 @@
 # have a data collection or training goal.
 
 import argparse
+import asyncio
+import threading
 from datetime import timedelta
 from random import gauss
 from time import sleep, time
 
 import follower_bots.constants as const
-import torch
-from follower_bots.data_utils.data_classes import ActionEnums
-from follower_bots.data_utils.pyclient_utils import (
-    follower_idx_to_game_action,
-    generate_action_mask,
-    get_active_uuid,
-    get_processed_actions,
-    get_processed_instructions,
-    get_processed_states,
-)
+from follower_bots.models.inference_server import FollowerInferenceServer
 from follower_bots.models.model_utils import load_follower_model_for_corpora_eval
 
 from py_client.game_endpoint import Action, Role
@@ -79,6 +72,12 @@ def get_args():
         default="",
         help="If specified, will load the euid associated with the specified instruction",
     )
+    parser.add_argument(
+        "--num_games",
+        type=int,
+        default=1,
+        help="The number of games to play at once. All games share one copy of the model",
+    )
 
     args = parser.parse_args()
     return args
@@ -87,8 +86,24 @@ def get_args():
 def main():
     args = get_args()
 
-    # Load the model
+    # Load the model once and serve every game from it
     follower = load_follower_model_for_corpora_eval(args)
+    server = FollowerInferenceServer(follower, sampling_strat=args.sampling_strat)
+
+    games = [
+        threading.Thread(target=play_game, args=(args, server.session()))
+        for _ in range(args.num_games)
+    ]
+    for game in games:
+        game.start()
+    for game in games:
+        game.join()
+    server.close()
+
+
+def play_game(args, follower):
+    # RemoteClient runs on the thread's event loop
+    asyncio.set_event_loop(asyncio.new_event_loop())
 
     # Connect to the server
     client = RemoteClient(args.host, args.render, lobby_name="bot-sandbox")
@@ -99,74 +114,23 @@ def main():
         queue_type=RemoteClient.QueueType.FOLLOWER_ONLY,
         e_uuid=args.e_uuid,
     )
-
-    # Setup instruction variables
-    raw_instruction, proc_instruction, text_mask = None, None, None
-    states, actions, timesteps = [], [], []
-    map, cards, turn_state, instructions, actors, feedback = game.initial_state()
+    game_state = game.initial_state()
 
     # Leader start
-    if turn_state.turn != Role.FOLLOWER:
-        game_action = Action.NoopAction()
-        map, cards, turn_state, instructions, actors, feedback = game.step(game_action)
+    if game_state.turn_state.turn != Role.FOLLOWER:
+        game_state = game.step(Action.NoopAction())
 
-    total_timesteps = 0
     while not game.over():
         start_time = time()
-
-        # Initialize the instructions
-        raw_instruction, proc_instruction, text_mask = get_processed_instructions(
-            instructions, raw_instruction, proc_instruction, text_mask
-        )
-        actions = get_processed_actions(actions)
-        states = get_processed_states(states, map, cards, actors)
-        timesteps = torch.LongTensor([[i for i in range(states.shape[1])]])
-        attention_mask = torch.ones(*states.shape[:2], dtype=torch.long)
-        pos_idx = torch.arange(
-            0, proc_instruction.shape[1] + 2 * timesteps.shape[1], dtype=torch.long
-        ).unsqueeze(0)
-
-        # Take the step
-        if total_timesteps < const.INFERENCE_HORIZON:
-            action_mask = generate_action_mask(game.action_mask())
-            with torch.no_grad():
-                action = follower.sample_action(
-                    states,
-                    actions,
-                    timesteps,
-                    proc_instruction,
-                    pos_idx,
-                    attention_mask,
-                    text_mask,
-                    action_mask,
-                )
-        else:
-            action = ActionEnums["DONE"].value
-        actions[:, -1] = action
-        game_action = follower_idx_to_game_action(action, raw_instruction.uuid)
-
+        game_action = follower.choose_action(game_state, game.action_mask())
         inference_time = time() - start_time
-        map, cards, turn_state, instructions, actors, feedback = game.step(game_action)
-        total_timesteps += 1
-
-        # Reset states if instruction terminated or done
-        if not game.over():
-            done_instruction = (
-                game_action.action_code() == Action.ActionCode.INSTRUCTION_DONE
-            )
-            terminated_instruction = raw_instruction.uuid != get_active_uuid(
-                instructions
-            )
-            if done_instruction or terminated_instruction:
-                states, actions, timesteps = [], [], []
-                follower.reset_past_output()
-                total_timesteps = 0
+        game_state = game.step(game_action)
 
         time_beyond_standard = max(0, inference_time - 0.15)
         sleep_time = max(0.1, gauss(0.7 - time_beyond_standard, 0.08))
         sleep(sleep_time)
 
-    print(f"Game over. Score: {turn_state.score}")
+    print(f"Game over. Score: {game_state.turn_state.score}")
 
 
 if __name__ == "__main__":
@@ -15,21 +15,18 @@ from follower_bots.constants import (
     EDGE_WIDTH,
     INFERENCE_HORIZON,
     TORCH_DEVICE,
-    VISIBLE_DISTANCE,
 )
 from follower_bots.data_utils.pyclient_utils import (
+    RolloutStates,
     follower_idx_to_game_action,
     generate_action_mask_mp,
     get_active_instruction_mp,
     get_local_game,
     get_pos_idx_mp,
     get_processed_actions,
-    get_processed_states_mp,
     get_timesteps,
     unpack_steps,
 )
-from follower_bots.models.hex_conv import HexCrop
-from follower_bots.models.hex_util import AxialTranslatorRotator, OffsetToAxialConverter
 
 
 def get_optimizer_and_scheduler(args, tr_loader, model):
@@ -271,7 +268,8 @@ def execute_instruction(
     change_trackers = [ChangeTracker() for _ in i_uuids]
 
     # Setup instruction variables
-    states, actions, timesteps, attention_mask = [], [], [], None
+    rollout_states = RolloutStates(batch_size=insts)
+    actions, timesteps, attention_mask = [], [], None
     initial_states = [games[i].initial_state() for i in range(insts)]
     (
         maps,
@@ -287,11 +285,6 @@ def execute_instruction(
     for i in range(insts):
         change_trackers[i].update_loc(all_actors[i], update_trackers[i])
 
-    # Setup other reoccurring variables
-    axial_converter = OffsetToAxialConverter(EDGE_WIDTH)
-    translator_rotator = AxialTranslatorRotator(EDGE_WIDTH).to(TORCH_DEVICE)
-    tensor_cropper = HexCrop(2 * VISIBLE_DISTANCE + 1).to(TORCH_DEVICE)
-
     # Iterate until all games are either over or have their instruction completed
     while (
         not all([game.over() for game in games]) and total_timesteps < INFERENCE_HORIZON
@@ -300,15 +293,7 @@ def execute_instruction(
 
         # Initialize model inputs
         actions = get_processed_actions(actions, bsz=insts)  # B x T
-        states = get_processed_states_mp(
-            states,
-            maps,
-            all_cards,
-            all_actors,
-            axial_converter,
-            translator_rotator,
-            tensor_cropper,
-        )
+        states = rollout_states.append(maps, all_cards, all_actors)  # B x T x P x H x W
         timesteps = get_timesteps(actions.shape)  # B x T
         attention_mask = torch.ones(
             *timesteps.shape, dtype=torch.long
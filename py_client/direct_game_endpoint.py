@@ -0,0 +1,149 @@
+""" A GameEndpoint for local games which reads the server state directly.
+
+GameEndpoint rebuilds the game from the messages the server sends to each
+player. In local games, the server's State object is in the same process, so
+building, queueing and re-integrating those messages is wasted work.
+DirectGameEndpoint instead reads a snapshot of the State after each update
+(see State.snapshot()), and hands actions straight to the state machine.
+
+Create these with LocalGameCoordinator(config, direct_endpoints=True). The
+API is the same as GameEndpoint's, so EndpointPair and the gym environments
+work unchanged.
+"""
+import logging
+from datetime import datetime, timedelta
+
+import server.actor as actor
+from py_client.game_endpoint import GameEndpoint, GameState
+from server.messages import action as action_module
+from server.messages.prop import PropType, PropUpdate
+from server.messages.rooms import Role
+
+logger = logging.getLogger(__name__)
+
+
+class DirectGameEndpoint(GameEndpoint):
+    """A GameEndpoint backed by a DirectSocket. See local_game_coordinator.py."""
+
+    def _reset(self):
+        super()._reset()
+        # The props list from the last snapshot. Cards are only rebuilt when it changes.
+        self._snapshot_props = None
+
+    def step(self, action, wait_for_turn=True) -> GameState:
+        """Executes one action and waits until the environment is ready for another action.
+
+        See GameEndpoint.step().
+        """
+        self._timeout_observed = False
+        if not action.is_noop():
+            # If the turn ended while the caller was deciding, reject the action.
+            current_turn = self.turn_state.turn
+            self._poll()
+            if self.turn_state.turn != current_turn:
+                self._timeout_observed = True
+                return self._state()
+        self._validate_action(action)
+        message, reason = action.message_to_server(self.player_actor)
+        if message != None:
+            logger.debug(f"Sending action: {message.type}")
+            self.socket.send_message(message)
+        self._follower_moved = False
+        waited, reason = self._wait_for_tick()
+        if not waited:
+            logger.warning(f"Issue waiting for tick: {reason}")
+        if wait_for_turn:
+            while not self._can_act() and not self.over() and self.socket.connected():
+                waited, reason = self._wait_for_tick()
+                if not waited:
+                    logger.warning(f"Issue waiting for tick: {reason}")
+        state = self._state()
+        self.live_feedback = []
+        self._render()
+        self.last_step_call = datetime.now()
+        return state
+
+    def _wait_for_tick(self, timeout=timedelta(seconds=60)):
+        """Steps the state machine until it ticks for this player."""
+        end_time = datetime.utcnow() + timeout
+        while not self.over() and self.socket.connected():
+            if self._poll():
+                return True, ""
+            if datetime.utcnow() > end_time:
+                return False, "Timed out waiting for tick"
+            self.socket.step()
+        # Game over, return True to exit without triggering any errors.
+        return True, ""
+
+    def _initialize(self, timeout=timedelta(seconds=60)):
+        if self._initial_state_ready:
+            logger.warning("Initial state already ready")
+            return
+        self.player_id = self.socket.actor_id
+        self._player_role = self.socket.state_machine().player_role(self.player_id)
+        end_time = datetime.utcnow() + timeout
+        while self.socket.connected():
+            if self._poll():
+                break
+            if datetime.utcnow() > end_time:
+                raise Exception("Timed out waiting for game")
+            self.socket.step()
+        else:
+            return False, "Game initialization timed out."
+        self.player_actor = self.actors[self.player_id]
+        if self.over():
+            return False, "Game over"
+        logger.debug(f"Init DONE for {self._player_role}")
+        self._initial_state_ready = True
+        if self.render:
+            self._render()
+        return True, ""
+
+    def _poll(self) -> bool:
+        """Reads the latest game state. Returns true if the state machine ticked for this player."""
+        state_machine = self.socket.state_machine()
+        tick, live_feedback = state_machine.take_events(self.player_id)
+        if live_feedback is not None:
+            self.live_feedback.append(live_feedback.signal)
+        snapshot = state_machine.snapshot(self.player_id)
+        self.map_update = snapshot.map_update
+        self.turn_state = snapshot.turn_state
+        self.instructions = snapshot.instructions
+        if snapshot.props is not self._snapshot_props:
+            self._snapshot_props = snapshot.props
+            self.prop_update = PropUpdate(list(snapshot.props))
+            self.cards = {
+                prop.id: prop
+                for prop in snapshot.props
+                if prop.prop_type == PropType.CARD
+            }
+        self._sync_actors(snapshot.actors)
+        return tick is not None
+
+    def _sync_actors(self, net_actors):
+        for net_actor in net_actors:
+            local_actor = self.actors.get(net_actor.actor_id, None)
+            if local_actor is None:
+                self.actors[net_actor.actor_id] = actor.Actor(
+                    net_actor.actor_id,
+                    0,
+                    net_actor.actor_role,
+                    net_actor.location,
+                    False,
+                    net_actor.rotation_degrees,
+                )
+                continue
+            if (
+                net_actor.location == local_actor.location()
+                and net_actor.rotation_degrees == local_actor.heading_degrees()
+            ):
+                continue
+            if local_actor.role() == Role.FOLLOWER:
+                self._follower_moved = True
+            local_actor.add_action(
+                action_module.Init(
+                    net_actor.actor_id, net_actor.location, net_actor.rotation_degrees
+                )
+            )
+            while local_actor.has_actions():
+                local_actor.step()
@@ -46,7 +46,7 @@ from server.messages.action import Action, ActionType
 from server.messages.live_feedback import LiveFeedback
 from server.messages.map_update import MapUpdate
 from server.messages.objective import ObjectiveMessage
-from server.messages.prop import Prop, PropType
+from server.messages.prop import Prop, PropType, PropUpdate
 from server.messages.rooms import Role
 from server.messages.turn_state import TurnState
 from server.util import HEARTBEAT_TIMEOUT_S
@@ -464,6 +464,9 @@ class GameEndpoint(object):
         self.pygame_task = None
         self._timeout_observed = False
         self._tutorial_messages = []
+        self._follower_map_source = None
+        self._follower_map_key = None
+        self._censored_follower_map = None
         # Always create the display, even if render == None.
         # This lets the user access the the display object manually if they need.
         # It's a bit of a hack, because pygame can't render unless they're on the main thread.
@@ -542,29 +545,7 @@ class GameEndpoint(object):
         if (not action.is_noop()) and not self._process_pending_messages():
             self._timeout_observed = True
             return self._state()
-        valid_actions = set([])
-        if self._player_role == Role.FOLLOWER:
-            valid_actions = Action.FollowerActions()
-            # noop is always valid
-            valid_actions.add(Action.ActionCode.NONE)
-        elif self._player_role == Role.LEADER:
-            valid_actions = (
-                Action.LeaderActions()
-                if self.turn_state.turn == Role.LEADER
-                else Action.LeaderFeedbackActions()
-            )
-            # noop is always valid
-            valid_actions.add(Action.ActionCode.NONE)
-        elif self._player_role == Role.SPECTATOR:
-            # Spectators can only send a noop or load a scenario.
-            valid_actions = Action.SpectatorActions()
-        valid_actions.add(Action.ActionCode.NONE)
-        for action_code in Action.TutorialActions():
-            valid_actions.add(action_code)
-        if action.action_code() not in valid_actions:
-            raise ValueError(
-                f"Player is role {self._player_role} and turn {self.turn_state.turn} but sent inappropriate action: {action}"
-            )
+        self._validate_action(action)
         message, reason = action.message_to_server(self.player_actor)
         if message != None:
             logger.debug(f"Sending action: {message.type}")
@@ -601,6 +582,32 @@ class GameEndpoint(object):
         self.last_step_call = datetime.now()
         return state
 
+    def _validate_action(self, action):
+        """Raises ValueError if the player can't take this action right now."""
+        valid_actions = set([])
+        if self._player_role == Role.FOLLOWER:
+            valid_actions = Action.FollowerActions()
+            # noop is always valid
+            valid_actions.add(Action.ActionCode.NONE)
+        elif self._player_role == Role.LEADER:
+            valid_actions = (
+                Action.LeaderActions()
+                if self.turn_state.turn == Role.LEADER
+                else Action.LeaderFeedbackActions()
+            )
+            # noop is always valid
+            valid_actions.add(Action.ActionCode.NONE)
+        elif self._player_role == Role.SPECTATOR:
+            # Spectators can only send a noop or load a scenario.
+            valid_actions = Action.SpectatorActions()
+        valid_actions.add(Action.ActionCode.NONE)
+        for action_code in Action.TutorialActions():
+            valid_actions.add(action_code)
+        if action.action_code() not in valid_actions:
+            raise ValueError(
+                f"Player is role {self._player_role} and turn {self.turn_state.turn} but sent inappropriate action: {action}"
+            )
+
     def _feedback_enabled(self):
         if not self.lobby_info:
             return self.config.live_feedback_enabled
@@ -714,7 +721,7 @@ class GameEndpoint(object):
         if follower is not None:
             actors.append(follower)
         if self.player_role() == Role.FOLLOWER:
-            map_update = CensorFollowerMap(map_update, follower, self.config)
+            map_update = self._follower_map(map_update, follower)
             props = CensorFollowerProps(props, follower, self.config)
             actors = CensorActors(actors, follower, self.config)
         return GameState(
@@ -726,6 +733,17 @@ class GameEndpoint(object):
             self.live_feedback,
         )
 
+    def _follower_map(self, map_update, follower):
+        # The follower's view only changes when they move, so reuse it until then.
+        key = (follower.location(), follower.heading_degrees())
+        if map_update is not self._follower_map_source or key != self._follower_map_key:
+            self._follower_map_source = map_update
+            self._follower_map_key = key
+            self._censored_follower_map = CensorFollowerMap(
+                map_update, follower, self.config
+            )
+        return self._censored_follower_map
+
     def Initialize(self, timeout=timedelta(seconds=60)):
         return self._initialize()
 
@@ -788,6 +806,9 @@ class GameEndpoint(object):
             if response.type == message_from_server.MessageType.PROP_UPDATE:
                 logger.debug(f"INIT received prop")
                 self._handle_prop_update(response.prop_update)
+            if response.type == message_from_server.MessageType.PROP_DELTA:
+                logger.debug(f"INIT received prop delta")
+                self._handle_prop_delta(response.prop_delta)
             if response.type == message_from_server.MessageType.GAME_STATE:
                 logger.debug(f"INIT received turn state")
                 self.turn_state = response.turn_state
@@ -815,6 +836,15 @@ class GameEndpoint(object):
                     )
         return False, "Game initialization timed out."
 
+    def _handle_prop_delta(self, prop_delta):
+        # Cards not mentioned in the delta keep any changes made by actions.
+        self.prop_update = prop_delta.apply(self.prop_update or PropUpdate())
+        for prop_id in prop_delta.removed:
+            self.cards.pop(prop_id, None)
+        for prop in prop_delta.changed:
+            if prop.prop_type == PropType.CARD:
+                self.cards[prop.id] = prop
+
     def _handle_prop_update(self, prop_update):
         self.prop_update = prop_update
         self.cards = {}
@@ -914,6 +944,8 @@ class GameEndpoint(object):
             self.live_feedback.append(message.live_feedback.signal)
         elif message.type == message_from_server.MessageType.PROP_UPDATE:
             self._handle_prop_update(message.prop_update)
+        elif message.type == message_from_server.MessageType.PROP_DELTA:
+            self._handle_prop_delta(message.prop_delta)
         elif message.type == message_from_server.MessageType.STATE_MACHINE_TICK:
             return
         elif message.type == message_from_server.MessageType.TUTORIAL_RESPONSE:
@@ -14,6 +14,7 @@ from datetime import datetime, timedelta
 import pygame
 
 import server.schemas.game as game_db
+from py_client.direct_game_endpoint import DirectGameEndpoint
 from py_client.game_endpoint import GameEndpoint
 from py_client.game_socket import GameSocket
 from server.lobbies.open_lobby import OpenLobby
@@ -26,10 +27,11 @@ from server.messages.tutorials import (
     LEADER_TUTORIAL,
     RoleFromTutorialName,
 )
+from server.scenario_cache import ScenarioCache
 from server.state import State
 from server.state_machine_driver import StateMachineDriver
 from server.tutorial_state import TutorialGameState
-from server.util import GetCommitHash
+from server.util import GetCommitHash, VirtualClock
 
 logger = logging.getLogger(__name__)
 
@@ -85,6 +87,38 @@ class LocalSocket(GameSocket):
         return None, "No messages available."
 
 
+class DirectSocket(GameSocket):
+    """Connects a DirectGameEndpoint to a local game.
+
+    Messages to the server are handed straight to the state machine, which is
+    then stepped. Nothing is sent back through the socket. The endpoint reads
+    the game with State.snapshot() instead.
+    """
+
+    def __init__(self, local_coordinator, game_name: str, actor_id: int):
+        self.local_coordinator = local_coordinator
+        self.game_name = game_name
+        self.actor_id = actor_id
+
+    def state_machine(self):
+        return self.local_coordinator._state_machine_driver(
+            self.game_name
+        ).state_machine()
+
+    def step(self):
+        self.local_coordinator.StepGame(self.game_name)
+
+    def send_message(self, message):
+        self.state_machine().drain_messages(self.actor_id, [message])
+        self.local_coordinator.StepGame(self.game_name)
+
+    def connected(self):
+        return self.local_coordinator._game_exists(self.game_name)
+
+    def receive_message(self, timeout=timedelta(seconds=60)):
+        return None, "Direct sockets don't receive messages. Use State.snapshot()."
+
+
 # pylint: enable=protected-access
 
 
@@ -94,15 +128,40 @@ class LocalGameCoordinator:
     Can run multiple simulated games at once, each with two agents.
     Can start games from a specific instruction in a recorded game.
 
+    If direct_endpoints is true, JoinGame() returns DirectGameEndpoints, which
+    read the game state straight from the state machine instead of through
+    messages. This is much faster, and meant for self-play and evaluation.
+    Tutorials and single player games always use message-based endpoints.
+
+    If virtual_step_s is set, games created with CreateGame() and
+    CreateGameFromDatabase() run on a VirtualClock (see server/util.py) which
+    advances virtual_step_s seconds each time the state machine steps. Turn
+    timeouts then depend only on the number of steps taken, not on how fast
+    the agents are. With virtual_step_s=0, turns never time out.
+
+    If scenario_cache is set, CreateGameFromDatabase() loads recorded games
+    through it (see server/scenario_cache.py), instead of reconstructing them
+    from the database every time.
+
     """
 
     def __init__(
-        self, config, render_leader: bool = False, render_follower: bool = False
+        self,
+        config,
+        render_leader: bool = False,
+        render_follower: bool = False,
+        direct_endpoints: bool = False,
+        virtual_step_s: float = None,
+        scenario_cache: ScenarioCache = None,
     ):
         self._game_drivers = {}  # Game name -> StateMachineDriver
         self._game_endpoints = {}  # Game name -> (leader_endpoint, follower_endpoint)
+        self._direct_games = set()  # Names of games joined with direct endpoints.
         self._render_leader = render_leader
         self._render_follower = render_follower
+        self._direct_endpoints = direct_endpoints
+        self._virtual_step_s = virtual_step_s
+        self._scenario_cache = scenario_cache
         self._config = config
 
     def CreateGame(
@@ -149,6 +208,7 @@ class LocalGameCoordinator:
             log_to_db=log_to_db,
             realtime_actions=False,
             lobby=lobby,
+            clock=self._new_clock(),
         )
         self._game_drivers[game_name] = StateMachineDriver(state_machine, room_id)
         return game_name
@@ -175,6 +235,8 @@ class LocalGameCoordinator:
             realtime_actions=False,
             log_to_db=log_to_db,
             lobby=lobby,
+            clock=self._new_clock(),
+            scenario_cache=self._scenario_cache,
         )
         assert (
             state_machine is not None
@@ -184,6 +246,23 @@ class LocalGameCoordinator:
         self._game_drivers[game_name] = StateMachineDriver(state_machine, room_id)
         return game_name
 
+    def ForkGame(self, game_name: str):
+        """Creates a copy of a game which no players have joined yet.
+
+        Use this to branch many rollouts from one position, e.g. a game from
+        CreateGameFromDatabase(), without reconstructing it each time. See
+        State.fork(). Exactly two agents can join the copy with JoinGame().
+        Returns the new game's name.
+        """
+        state_machine = self._state_machine_driver(game_name).state_machine()
+        if len(state_machine.player_ids()) > 0:
+            raise ValueError(f"Game {game_name} has players. Fork it before joining.")
+        fork_name = self._unique_game_name()
+        self._game_drivers[fork_name] = StateMachineDriver(
+            state_machine.fork(fork_name), fork_name
+        )
+        return fork_name
+
     def CreateLeaderTutorial(self, realtime: bool = True):
         """Creates a new game. Exactly two agents can join this game with JoinGame().
 
@@ -309,9 +388,15 @@ class LocalGameCoordinator:
         actor_id = state_machine.create_actor(role)
         assert actor_id is not None, "Actor ID should not be None."
         render = self._render_leader if role == Role.LEADER else self._render_follower
-        game_endpoint = GameEndpoint(
-            LocalSocket(self, game_name, actor_id), self._config, render
-        )
+        if self._direct_endpoints:
+            self._direct_games.add(game_name)
+            game_endpoint = DirectGameEndpoint(
+                DirectSocket(self, game_name, actor_id), self._config, render
+            )
+        else:
+            game_endpoint = GameEndpoint(
+                LocalSocket(self, game_name, actor_id), self._config, render
+            )
         # Register endpoints for this game so we can initialize them in StartGame().
         if number_players == 0:
             self._game_endpoints[game_name] = (game_endpoint, None)
@@ -323,6 +408,11 @@ class LocalGameCoordinator:
     def StepGame(self, game_name):
         """Runs one iteration of the game state machine."""
         game_driver = self._state_machine_driver(game_name)
+        if game_name in self._direct_games:
+            # Direct endpoints read the state machine themselves. Don't queue
+            # messages for them.
+            game_driver.state_machine().update()
+            return
         game_driver.step()
 
     def TickCount(self, game_name):
@@ -340,6 +430,7 @@ class LocalGameCoordinator:
                 game_driver.state_machine().on_game_over()
                 del self._game_drivers[game_name]
                 del self._game_endpoints[game_name]
+                self._direct_games.discard(game_name)
 
     def ForceCleanAll(self):
         """Cleans up any games that are running or have ended."""
@@ -349,6 +440,7 @@ class LocalGameCoordinator:
         for game_name in list(self._game_endpoints.keys()):
             logger.info(f"Forcefully cleaning game {game_name} endpoint.")
             del self._game_endpoints[game_name]
+        self._direct_games.clear()
 
     @staticmethod
     def _unique_game_name():
@@ -364,6 +456,12 @@ class LocalGameCoordinator:
         """
         return str(uuid.uuid4())
 
+    def _new_clock(self):
+        """Returns the clock for a new game. None means the wall clock."""
+        if self._virtual_step_s is None:
+            return None
+        return VirtualClock(self._virtual_step_s)
+
     def _state_machine_driver(self, game_name: str):
         if game_name not in self._game_drivers:
             raise ValueError(f"Game {game_name} doesn't exist.")
@@ -1,6 +1,7 @@
 import asyncio
 import logging
 import sys
+from collections import deque
 from datetime import datetime, timedelta
 from enum import Enum
 
@@ -21,6 +22,7 @@ from py_client.game_socket import GameSocket
 from server.config.config import Config
 from server.main import HEARTBEAT_TIMEOUT_S
 from server.messages import message_from_server, message_to_server
+from server.wire_format import DecodeFrame, WireFormat
 
 logger = logging.getLogger(__name__)
 
@@ -77,13 +79,20 @@ class RemoteClient(object):
         ERROR = 8
         MAX = 9
 
-    def __init__(self, url, render=False, lobby_name="bot-sandbox"):
+    def __init__(
+        self,
+        url,
+        render=False,
+        lobby_name="bot-sandbox",
+        wire_format=WireFormat.BINARY,
+    ):
         """Constructor.
 
         Args:
             url: (str) The URL of the server to connect to. Include http:// or https://!
             render: (bool) Whether to render the game using pygame, for the user to see.
             lobby_name: (str) The name of the lobby to join. Default is bot-sandbox. Please don't join other lobbies unless you have contacted the owners of the server.
+            wire_format: (WireFormat) How the server should frame messages sent to this client. BINARY uses less bandwidth. See server/wire_format.py.
         """
         self.session = None
         self.ws = None
@@ -91,6 +100,7 @@ class RemoteClient(object):
         self.Reset()
         self.url = url
         self.lobby_name = lobby_name
+        self.wire_format = wire_format
         self.event_loop = asyncio.get_event_loop()
         logging.basicConfig(level=logging.INFO)
         # Lets us synchronously block on an event loop that's already running.
@@ -122,7 +132,7 @@ class RemoteClient(object):
                 f"Could not get config from {config_url}: {config_response.status_code}",
             )
         self.config = Config.from_json(config_response.text)
-        url = f"{self.url}/player_endpoint?is_bot=true"
+        url = f"{self.url}/player_endpoint?is_bot=true&batch=true&delta=true&encoding={self.wire_format.value}"
         if self.lobby_name != "":
             url += f"&lobby_name={self.lobby_name}"
         logger.info(f"Connecting to {url}...")
@@ -160,6 +170,8 @@ class RemoteClient(object):
         self.turn_state = None
         self.game = None
         self.config = None
+        # Messages unpacked from a BATCH message, not yet returned by _receive_message.
+        self.pending_messages = deque()
 
     def state(self):
         return self.init_state
@@ -334,6 +346,8 @@ class RemoteClient(object):
         return False, "Disconnected"
 
     def _receive_message(self, timeout=timedelta(minutes=1)):
+        if len(self.pending_messages) > 0:
+            return self.pending_messages.popleft(), ""
         try:
             message = self.event_loop.run_until_complete(
                 self.ws.receive(timeout=timeout.total_seconds())
@@ -350,10 +364,19 @@ class RemoteClient(object):
         if message.type == aiohttp.WSMsgType.CLOSE:
             self.init_state = RemoteClient.State.BEGIN
             return None, "Socket closing."
-        if message.type != aiohttp.WSMsgType.TEXT:
+        if message.type == aiohttp.WSMsgType.TEXT:
+            data = message.data
+        elif message.type == aiohttp.WSMsgType.BINARY:
+            data = DecodeFrame(message.data)
+        else:
             return (
                 None,
                 f"Unexpected message type: {message.type}. data: {message.data}",
             )
-        response = message_from_server.MessageFromServer.from_json(message.data)
+        response = message_from_server.MessageFromServer.from_json(data)
+        if response.type == message_from_server.MessageType.BATCH:
+            if len(response.batch) == 0:
+                return None, "Received empty batch."
+            self.pending_messages.extend(response.batch[1:])
+            return response.batch[0], ""
         return response, ""
@@ -310,6 +310,46 @@ class Config(DataClassJSONMixin):
     exception_log_interval: int = 60
     """The number of seconds between exception log dumps."""
 
+    state_machine_tick_rate_hz: float = 0.0
+    """Max rate at which each game room updates its state machine.
+
+    If 0, rooms update as fast as the event loop allows (legacy behavior). If
+    positive (e.g. 30), rooms sleep between updates until a message arrives
+    or the next timer (turn end, follower turn end delay) is due, and never
+    update faster than this rate.
+    """
+
+    event_write_behind: bool = False
+    """If true, game events are written to the database in batches from a background thread.
+
+    See EventWriter in server/game_recorder.py. Events are flushed when
+    event_write_batch_size are pending, after event_write_interval_ms, at game
+    over, and on server shutdown.
+    """
+    event_write_batch_size: int = 200
+    event_write_interval_ms: int = 500
+
+    map_generation_workers: int = 1
+    """Number of worker processes that generate maps for the map pool.
+
+    Workers keep the pool topped up to map_cache_size, even while games are
+    running. If 0, maps are instead generated on the event loop, and only
+    while no games are running (legacy behavior).
+    """
+
+    map_store_size: int = 0
+    """Number of pre-generated maps to keep on disk, in addition to map_cache_size.
+
+    The on-disk store (see server/map_store.py) persists across restarts and
+    can be shared by several server processes, so a freshly started server
+    doesn't have to generate maps before its first games. 0 disables the
+    store. Requires map_generation_workers > 0.
+    """
+    map_store_path_suffix: str = "map_store.db"
+
+    # Reconstructed scenarios for eval and training. See server/scenario_cache.py.
+    scenario_cache_path_suffix: str = "scenario_cache.db"
+
     # Data path accessors that add the requisite data_prefix.
     def data_directory(self):
         # If data_prefix is None or empty string, use appdirs. Else use the prefix.
@@ -340,6 +380,16 @@ class Config(DataClassJSONMixin):
     def exception_directory(self):
         return pathlib.Path(self.data_directory(), self.exception_prefix).expanduser()
 
+    def map_store_path(self):
+        return pathlib.Path(
+            self.data_directory(), self.map_store_path_suffix
+        ).expanduser()
+
+    def scenario_cache_path(self):
+        return pathlib.Path(
+            self.data_directory(), self.scenario_cache_path_suffix
+        ).expanduser()
+
     def data_config(self) -> DataConfig:
         return DataConfig(
             name=self.name,
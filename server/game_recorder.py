@@ -1,10 +1,14 @@
 import logging
+import queue
 import random
+import threading
+import time
 from datetime import datetime
 from queue import Queue
 from typing import List
 
 import orjson
+import peewee
 
 import server.messages.live_feedback as live_feedback
 import server.schemas as schemas
@@ -13,11 +17,16 @@ from server.hex import HecsCoord
 from server.messages.action import Action
 from server.messages.feedback_questions import FeedbackQuestion, FeedbackResponse
 from server.messages.rooms import Role
+from server.schemas.base import GetDatabase
 from server.schemas.event import Event, EventOrigin, EventType
 from server.schemas.util import InitialState
 
 logger = logging.getLogger(__name__)
 
+# How long record_game_over() waits for pending events to be written. It runs
+# on the event loop, so a busy database mustn't stall every other room.
+GAME_OVER_FLUSH_TIMEOUT_S = 0.5
+
 
 def JsonSerialize(x):
     pretty_dumper = lambda x: orjson.dumps(
@@ -309,6 +318,151 @@ def EventFromFeedbackResponse(
     )
 
 
+class EventWriter(object):
+    """Writes Event records to the database from a dedicated thread.
+
+    Events are buffered and inserted with insert_many() inside a single
+    transaction, once batch_size events are pending or the oldest pending
+    event is flush_interval_s old. This keeps sqlite transactions (and their
+    fsyncs) off of the game loop.
+
+    Event primary keys and timestamps are assigned when the Event object is
+    constructed, so events can reference buffered parent events.
+
+    Note that sqlite in-memory databases are per-connection, so this can't be
+    used with SetDatabaseForTesting().
+    """
+
+    # Stay well under sqlite's limit on variables per statement.
+    _INSERT_CHUNK_SIZE = 50
+    # Transient errors (like "database is locked") are retried this many times,
+    # waiting _RETRY_DELAY_S before the first retry and doubling each time.
+    _MAX_RETRIES = 5
+    _RETRY_DELAY_S = 0.1
+
+    def __init__(self, batch_size: int = 200, flush_interval_s: float = 0.5):
+        self._batch_size = batch_size
+        self._flush_interval_s = flush_interval_s
+        # Queue of Event objects, flush barriers (threading.Event) or None (stop).
+        self._queue = Queue()
+        self._thread = threading.Thread(
+            target=self._run, name="EventWriter", daemon=True
+        )
+        self._thread.start()
+
+    def write(self, event: Event):
+        self._queue.put(event)
+
+    def flush(self, timeout_s: float = None) -> bool:
+        """Blocks until every event written so far is in the database.
+
+        This includes every room's events, not just one game's. Returns False
+        if timeout_s passed first.
+        """
+        if not self._thread.is_alive():
+            return True
+        barrier = threading.Event()
+        self._queue.put(barrier)
+        return barrier.wait(timeout_s)
+
+    def stop(self):
+        """Flushes pending events and stops the writer thread."""
+        if not self._thread.is_alive():
+            return
+        self._queue.put(None)
+        self._thread.join()
+
+    def _run(self):
+        pending = []
+        deadline = None
+        while True:
+            timeout = None
+            if deadline is not None:
+                timeout = max(deadline - time.time(), 0)
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                item = queue.Empty
+            if isinstance(item, Event):
+                pending.append(item)
+                if deadline is None:
+                    deadline = time.time() + self._flush_interval_s
+                if len(pending) < self._batch_size and time.time() < deadline:
+                    continue
+            self._insert(pending)
+            pending = []
+            deadline = None
+            if isinstance(item, threading.Event):
+                item.set()
+            elif item is None:
+                return
+
+    def _insert(self, events: List[Event]):
+        if len(events) == 0:
+            return
+        rows = [event.__data__ for event in events]
+        try:
+            self._retry(self._insert_rows, rows)
+            return
+        except Exception as e:
+            logger.warning(
+                f"Failed to write {len(rows)} events: {e}. Writing them one at a time."
+            )
+        # The batch is rolled back if any row fails. Insert rows one by one, so
+        # that one bad row doesn't drop every other room's events.
+        for row in rows:
+            try:
+                self._retry(self._insert_rows, [row])
+            except Exception as e:
+                logger.exception(f"Failed to write event {row.get('id')}: {e}")
+
+    def _insert_rows(self, rows):
+        with GetDatabase().atomic():
+            for batch in peewee.chunked(rows, self._INSERT_CHUNK_SIZE):
+                Event.insert_many(batch).execute()
+
+    def _retry(self, function, *args):
+        """Calls function, retrying with backoff if the database is busy."""
+        delay = self._RETRY_DELAY_S
+        for retry in range(self._MAX_RETRIES + 1):
+            try:
+                return function(*args)
+            except peewee.OperationalError as e:
+                if retry == self._MAX_RETRIES:
+                    raise
+                logger.warning(f"Database error, retrying in {delay}s: {e}")
+                time.sleep(delay)
+                delay *= 2
+
+
+g_event_writer = None
+
+
+def GlobalEventWriter():
+    """Returns the process-wide EventWriter, or None if events are written synchronously."""
+    global g_event_writer
+    return g_event_writer
+
+
+def InitGlobalEventWriter(config):
+    """Starts the EventWriter if write-behind event recording is enabled in config."""
+    global g_event_writer
+    if not config.event_write_behind:
+        return
+    g_event_writer = EventWriter(
+        config.event_write_batch_size, config.event_write_interval_ms / 1000.0
+    )
+
+
+def StopGlobalEventWriter():
+    """Flushes outstanding events. Call on shutdown."""
+    global g_event_writer
+    if g_event_writer is None:
+        return
+    g_event_writer.stop()
+    g_event_writer = None
+
+
 class GameRecorder(object):
     """Helper class to record everything that happens in a game.
 
@@ -336,6 +490,13 @@ class GameRecorder(object):
 
         self._last_follower_move = None
 
+        # If set, events are handed to a background writer instead of saved inline.
+        self._event_writer = GlobalEventWriter()
+        # Events which later events refer to. Buffered events may not be in
+        # the database yet, so look these up here first.
+        self._instruction_events = {}  # instruction uuid -> Event
+        self._question_events = {}  # question uuid -> Event
+
     def record(self):
         if self._disabled:
             return None
@@ -357,7 +518,7 @@ class GameRecorder(object):
         initial_state_event = EventFromInitialState(
             self._game_record, tick, leader, follower
         )
-        initial_state_event.save(force_insert=True)
+        self._save(initial_state_event)
         self.record_map_update(map_update)
         self.record_turn_state(turn_state)
         self.record_prop_update(prop_update)
@@ -369,14 +530,14 @@ class GameRecorder(object):
         if self._disabled:
             return
         event = EventFromMapUpdate(self._game_record, self._tick, map_update)
-        event.save(force_insert=True)
+        self._save(event)
 
     def record_prop_update(self, prop_update):
         if self._disabled:
             return
         # Record the prop update to the database.
         event = EventFromPropUpdate(self._game_record, self._tick, prop_update)
-        event.save(force_insert=True)
+        self._save(event)
 
     def record_card_spawn(self, card: Card):
         if self._disabled:
@@ -384,7 +545,7 @@ class GameRecorder(object):
         event = EventFromCardSpawn(
             self._game_record, self._turn_number, self._tick, card
         )
-        event.save(force_insert=True)
+        self._save(event)
 
     def record_card_selection(self, actor, card: Card):
         if self._disabled:
@@ -403,7 +564,7 @@ class GameRecorder(object):
             card,
             self._last_move,
         )
-        event.save(force_insert=True)
+        self._save(event)
 
     def record_card_set(self, actor, cards: List[Card], score):
         if self._disabled:
@@ -423,7 +584,7 @@ class GameRecorder(object):
             score,
             self._last_move,
         )
-        event.save(force_insert=True)
+        self._save(event)
 
     def record_instruction_sent(self, objective):
         if self._disabled:
@@ -431,7 +592,8 @@ class GameRecorder(object):
         event = EventFromInstructionSent(
             self._game_record, self._turn_number, self._tick, objective
         )
-        event.save(force_insert=True)
+        self._instruction_events[objective.uuid] = event
+        self._save(event)
 
     def record_instruction_activated(self, objective):
         if self._disabled:
@@ -449,7 +611,7 @@ class GameRecorder(object):
             instruction_event,
             objective.uuid,
         )
-        event.save(force_insert=True)
+        self._save(event)
 
     def record_instruction_complete(self, objective_complete):
         if self._disabled:
@@ -469,7 +631,7 @@ class GameRecorder(object):
             instruction_event,
             objective_complete.uuid,
         )
-        event.save(force_insert=True)
+        self._save(event)
 
     def record_action(self, action, action_code, position, heading):
         if self._disabled:
@@ -485,7 +647,7 @@ class GameRecorder(object):
             heading,
             action_code,
         )
-        event.save(force_insert=True)
+        self._save(event)
 
     def record_move(
         self, actor, action: Action, active_instruction, position_before, heading_before
@@ -517,7 +679,7 @@ class GameRecorder(object):
         if actor.role == Role.FOLLOWER:
             self._last_follower_move = event
         self._last_move = event
-        event.save(force_insert=True)
+        self._save(event)
 
     def record_live_feedback(self, feedback, follower, active_instruction):
         if self._disabled:
@@ -530,7 +692,7 @@ class GameRecorder(object):
             follower,
             self._last_follower_move,
         )
-        event.save(force_insert=True)
+        self._save(event)
 
     def record_instruction_cancelled(self, objective):
         if self._disabled:
@@ -546,7 +708,7 @@ class GameRecorder(object):
             instruction_event,
             objective.uuid,
         )
-        event.save(force_insert=True)
+        self._save(event)
 
     def record_start_of_turn(
         self,
@@ -572,7 +734,7 @@ class GameRecorder(object):
         event = EventFromStartOfTurn(
             self._game_record, self._tick, turn_state, short_code
         )
-        event.save(force_insert=True)
+        self._save(event)
 
     def record_turn_state(self, turn_state, reason=""):
         if self._disabled:
@@ -582,7 +744,7 @@ class GameRecorder(object):
         event = EventFromTurnState(
             self._game_record, self._tick, turn_state, short_code
         )
-        event.save(force_insert=True)
+        self._save(event)
         self._game_record.score = turn_state.score
         self._game_record.number_turns = turn_state.turn_number
         self._game_record.save()
@@ -596,7 +758,8 @@ class GameRecorder(object):
             self._tick,
             feedback_question,
         )
-        event.save(force_insert=True)
+        self._question_events[str(feedback_question.uuid)] = event
+        self._save(event)
 
     def record_feedback_response(self, feedback_response: FeedbackResponse):
         if self._disabled:
@@ -614,15 +777,39 @@ class GameRecorder(object):
             question_event,
             feedback_response,
         )
-        event.save(force_insert=True)
+        self._save(event)
 
     def record_game_over(self):
         if self._disabled:
             return
+        # Post-game processing (leaderboards, experience) reads the events.
+        # Wait a little for them, but don't block the event loop on a busy
+        # database. They're still written, just later.
+        if not self.flush(GAME_OVER_FLUSH_TIMEOUT_S):
+            logger.warning(
+                f"Events for game {self._game_record.id} weren't written within "
+                f"{GAME_OVER_FLUSH_TIMEOUT_S}s of game over."
+            )
         self._game_record.completed = True
         self._game_record.end_time = datetime.utcnow()
         self._game_record.save()
 
+    def flush(self, timeout_s: float = None) -> bool:
+        """Blocks until all of this game's events have been written to the database.
+
+        With write-behind recording, this waits for every room's pending
+        events. Returns False if timeout_s passed first.
+        """
+        if self._disabled or self._event_writer is None:
+            return True
+        return self._event_writer.flush(timeout_s)
+
+    def _save(self, event: Event):
+        if self._event_writer is not None:
+            self._event_writer.write(event)
+            return
+        event.save(force_insert=True)
+
     def kvals(self):
         if self._disabled:
             return None
@@ -671,6 +858,8 @@ class GameRecorder(object):
         return move_code
 
     def _get_event_from_instruction_uuid(self, instruction_uuid):
+        if instruction_uuid in self._instruction_events:
+            return self._instruction_events[instruction_uuid]
         instruction_sent_event_query = Event.select().where(
             Event.type == EventType.INSTRUCTION_SENT,
             Event.short_code == instruction_uuid,
@@ -680,6 +869,8 @@ class GameRecorder(object):
         return instruction_sent_event_query.get()
 
     def _get_event_from_question_uuid(self, question_uuid):
+        if str(question_uuid) in self._question_events:
+            return self._question_events[str(question_uuid)]
         question_event_query = Event.select().where(
             Event.type == EventType.FEEDBACK_QUESTION,
             Event.short_code == question_uuid,
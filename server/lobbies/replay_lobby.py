@@ -1,6 +1,5 @@
 """ A Lobby that's used for replay games. """
 import logging
-from queue import Queue
 from typing import Tuple
 
 from aiohttp import web
@@ -54,7 +53,7 @@ class ReplayLobby(lobby.Lobby):
     ) -> None:
         """Handles a request to join a replay room. In most lobbies, this should be ignored (except lobbies supporting replay)."""
         if ws not in self._pending_replay_messages:
-            self._pending_replay_messages[ws] = Queue()
+            self._pending_replay_messages[ws] = self._socket_queue(ws)
 
         if request.type == ReplayRequestType.START_REPLAY:
             self.create_replay(ws, request.game_id)
@@ -68,6 +68,22 @@ class SocketInfo:
         return (self.room_id, self.player_id, self.role)
 
 
+class WakeupQueue(Queue):
+    """A Queue which sets an asyncio.Event each time an item is put into it.
+
+    Used for per-socket lobby messages, so that the socket's transmit loop can
+    sleep until there's something to send.
+    """
+
+    def __init__(self, wakeup: asyncio.Event):
+        super().__init__()
+        self._wakeup = wakeup
+
+    def put(self, item, block=True, timeout=None):
+        super().put(item, block, timeout)
+        self._wakeup.set()
+
+
 """ This interface abstracts over different types of game lobbies.
 
     Lobbies manage a collection of games. They are responsible for creating new
@@ -117,6 +133,7 @@ class Lobby(ABC):
         self._pending_tutorial_messages = {}  # {ws: tutorial_response}
         self._pending_replay_messages = {}  # {ws: replay_response}
         self._pending_scenario_messages = {}  # {ws: scenario_response}
+        self._socket_wakeups = {}  # {ws: asyncio.Event}
         self._matchmaking_exc = None
         self._latency_monitor = LatencyMonitor()
 
@@ -185,6 +202,30 @@ class Lobby(ABC):
     def latency_monitor(self):
         return self._latency_monitor
 
+    def socket_wakeup(self, ws) -> asyncio.Event:
+        """Returns an event which is set whenever there's something to send to ws.
+
+        This covers lobby messages, room membership changes and (once the
+        socket is in a room) outgoing game messages. The consumer is expected
+        to clear() the event before draining.
+        """
+        if ws not in self._socket_wakeups:
+            self._socket_wakeups[ws] = asyncio.Event()
+        return self._socket_wakeups[ws]
+
+    def wake_socket(self, ws):
+        """Wakes up the transmit loop for ws, if it's waiting."""
+        self.socket_wakeup(ws).set()
+
+    def release_socket_wakeup(self, ws):
+        """Call once a socket has closed to free its wakeup event."""
+        if ws in self._socket_wakeups:
+            del self._socket_wakeups[ws]
+
+    def _socket_queue(self, ws) -> WakeupQueue:
+        """Creates a queue for pending messages to ws which wakes the socket on put()."""
+        return WakeupQueue(self.socket_wakeup(ws))
+
     def register_game_logging_directory(self, dir) -> None:
         """Each lobby has its own log directory. Game logs are written to this directory."""
         self._base_log_directory = dir
@@ -586,6 +627,8 @@ class Lobby(ABC):
             room_id, player_id, _ = self._remotes[ws].as_tuple()
             self._rooms[id].remove_player(player_id, ws, disconnected=False)
             del self._remotes[ws]
+            # Let the socket's transmit loop notice it's no longer in a room.
+            self.wake_socket(ws)
         del self._rooms[id]
 
     def available_room_id(self):
@@ -654,7 +697,7 @@ class Lobby(ABC):
 
     def handle_tutorial_request(self, tutorial_request, ws):
         if ws not in self._pending_tutorial_messages:
-            self._pending_tutorial_messages[ws] = Queue()
+            self._pending_tutorial_messages[ws] = self._socket_queue(ws)
         if tutorial_request.type == TutorialRequestType.START_TUTORIAL:
             self.create_tutorial(ws, tutorial_request.tutorial_name)
             self._pending_tutorial_messages[ws].put(
@@ -677,7 +720,7 @@ class Lobby(ABC):
             return
 
         if ws not in self._pending_scenario_messages:
-            self._pending_scenario_messages[ws] = Queue()
+            self._pending_scenario_messages[ws] = self._socket_queue(ws)
 
         if scenario_request.type == ScenarioRequestType.ATTACH_TO_SCENARIO:
             room_id = None
@@ -913,7 +956,7 @@ class Lobby(ABC):
         self, request: RoomManagementRequest, ws: web.WebSocketResponse
     ):
         if not ws in self._pending_room_management_responses:
-            self._pending_room_management_responses[ws] = Queue()
+            self._pending_room_management_responses[ws] = self._socket_queue(ws)
 
         if request.type == RoomRequestType.JOIN:
             self.handle_join_request(request, ws)
@@ -934,7 +977,7 @@ class Lobby(ABC):
 
     def drain_message(self, ws):
         if ws not in self._pending_room_management_responses:
-            self._pending_room_management_responses[ws] = Queue()
+            self._pending_room_management_responses[ws] = self._socket_queue(ws)
         if not self._pending_room_management_responses[ws].empty():
             try:
                 management_response = self._pending_room_management_responses[ws].get(
@@ -951,7 +994,7 @@ class Lobby(ABC):
                 pass
 
         if ws not in self._pending_tutorial_messages:
-            self._pending_tutorial_messages[ws] = Queue()
+            self._pending_tutorial_messages[ws] = self._socket_queue(ws)
         if not self._pending_tutorial_messages[ws].empty():
             try:
                 tutorial_response = self._pending_tutorial_messages[ws].get(False)
@@ -962,7 +1005,7 @@ class Lobby(ABC):
             except queue.Empty:
                 pass
         if ws not in self._pending_replay_messages:
-            self._pending_replay_messages[ws] = Queue()
+            self._pending_replay_messages[ws] = self._socket_queue(ws)
         if not self._pending_replay_messages[ws].empty():
             try:
                 replay_response = self._pending_replay_messages[ws].get(False)
@@ -973,7 +1016,7 @@ class Lobby(ABC):
             except queue.Empty:
                 pass
         if ws not in self._pending_scenario_messages:
-            self._pending_scenario_messages[ws] = Queue()
+            self._pending_scenario_messages[ws] = self._socket_queue(ws)
         if not self._pending_scenario_messages[ws].empty():
             try:
                 scenario_response = self._pending_scenario_messages[ws].get(False)
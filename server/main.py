@@ -37,10 +37,11 @@ import server.schemas.game as game_db
 import server.schemas.mturk as mturk
 from server.client_exception_logger import ClientExceptionLogger
 from server.config.config import GlobalConfig, InitGlobalConfig
+from server.game_recorder import InitGlobalEventWriter, StopGlobalEventWriter
 from server.google_authenticator import GoogleAuthenticator
 from server.lobby_consts import IsMturkLobby, LobbyType
 from server.lobby_utils import GetLobbies, GetLobby, InitializeLobbies
-from server.map_provider import MapGenerationTask, MapPoolSize
+from server.map_provider import MapGenerationTask, MapPoolSize, MapPoolStats
 from server.messages import message_from_server, message_to_server
 from server.messages.logs import GameInfo, GameLog, LogEntry
 from server.messages.user_info import UserType
@@ -55,6 +56,7 @@ from server.remote_table import (
 from server.schemas import base
 from server.user_info_fetcher import UserInfoFetcher
 from server.util import HEARTBEAT_TIMEOUT_S
+from server.wire_format import EncodeFrame, JoinSegments, WireFormat
 
 routes = web.RouteTableDef()
 
@@ -90,11 +92,19 @@ async def transmit_bytes(ws, message):
     if remote is None:
         return ValueError("Agent ID not found in remote table")
 
+    # message is bytes, or a list of segments (see server/wire_format.py).
+    if remote.wire_format == WireFormat.BINARY:
+        message = EncodeFrame(message)
+    elif not isinstance(message, bytes):
+        message = JoinSegments(message)
     remote.bytes_down += len(message)
     remote.last_message_down = time.time()
 
     try:
-        await ws.send_str(message.decode("utf-8"))
+        if remote.wire_format == WireFormat.BINARY:
+            await ws.send_bytes(message)
+        else:
+            await ws.send_str(message.decode("utf-8"))
     except ConnectionResetError:
         pass
 
@@ -297,6 +307,7 @@ async def Status(request):
     status = {
         "assets": assets_map,
         "map_cache_size": MapPoolSize(),
+        "map_pool": MapPoolStats(),
         "remotes": remote_infos,
         "lobbies": {},
     }
@@ -1081,24 +1092,61 @@ async def stats(request):
     return web.json_response(json_stats)
 
 
+# How often a ping is sent to clients that are in a game.
+PING_INTERVAL_S = 10.0
+
+
+async def wait_for_wakeup(wakeup: asyncio.Event, timeout: float):
+    """Sleeps until wakeup is set or timeout elapses. Clears wakeup before returning."""
+    try:
+        await asyncio.wait_for(wakeup.wait(), timeout)
+    except asyncio.TimeoutError:
+        pass
+    wakeup.clear()
+
+
 async def stream_game_state(request, ws, lobby):
+    """Transmits outgoing messages for a single socket.
+
+    Instead of polling, this sleeps on the lobby's wakeup event for ws. The
+    event is set by the lobby (room management, tutorial, replay, scenario
+    messages and room membership changes), by the room's StateMachineDriver
+    (game messages), and by receive_agent_updates (auth & userinfo replies).
+    The only timed wakeup is the periodic ping.
+    """
     was_in_room = False
     remote = GetRemote(ws)
     remote.last_ping = datetime.now(timezone.utc)
+    wakeup = lobby.socket_wakeup(ws)
+    prop_delta_encoder = None
+    if remote.delta_props:
+        prop_delta_encoder = message_from_server.PropDeltaEncoder()
+    wakeup.set()  # Run the first pass immediately.
     last_loop = time.time()
     menu_options_updated = False  # Whether the menu options have been transmitted.
     while not ws.closed:
-        await asyncio.sleep(0)
-        poll_period = time.time() - last_loop
-        if (poll_period) > 0.2:
+        # Time spent on the previous pass, excluding time spent asleep.
+        pass_duration = time.time() - last_loop
+        if pass_duration > 0.2:
             logging.warning(
-                f"Transmit socket for iphash {remote.hashed_ip} port {remote.client_port}, slow poll period of {poll_period}s"
+                f"Transmit socket for iphash {remote.hashed_ip} port {remote.client_port}, slow transmit pass of {pass_duration}s"
             )
+        timeout = PING_INTERVAL_S
+        if was_in_room:
+            # Pings are only sent in-game. Wake up in time for the next one.
+            time_since_ping = (
+                datetime.now(timezone.utc) - remote.last_ping
+            ).total_seconds()
+            timeout = max(PING_INTERVAL_S - time_since_ping, 0)
+        await wait_for_wakeup(wakeup, timeout)
         last_loop = time.time()
+        if ws.closed:
+            break
         # If not in a room, drain messages from the room manager.
         message = lobby.drain_message(ws)
-        if message is not None:
+        while message is not None:
             await transmit_bytes(ws, orjson.dumps(message, option=orjson.OPT_NAIVE_UTC))
+            message = lobby.drain_message(ws)
 
         # If the menu options have been updated, send them to the client.
         if not menu_options_updated:
@@ -1112,6 +1160,7 @@ async def stream_game_state(request, ws, lobby):
         if len(confirmations) > 0:
             # If a user recently authenticated, the menu options may have changed.
             menu_options_updated = False
+            wakeup.set()
             for confirmation in confirmations:
                 message = message_from_server.GoogleAuthConfirmationFromServer(
                     confirmation
@@ -1163,10 +1212,14 @@ async def stream_game_state(request, ws, lobby):
                     ),
                 )
             # await asyncio.sleep(1.0)
+            # Game messages may already be waiting. Don't sleep before sending them.
+            wakeup.set()
             continue
 
         # Send a ping every 10 seconds.
-        if (datetime.now(timezone.utc) - remote.last_ping).total_seconds() > 10.0:
+        if (
+            datetime.now(timezone.utc) - remote.last_ping
+        ).total_seconds() >= PING_INTERVAL_S:
             remote.last_ping = datetime.now(timezone.utc)
             await transmit_bytes(
                 ws,
@@ -1179,20 +1232,30 @@ async def stream_game_state(request, ws, lobby):
 
         out_messages = []
         if room.fill_messages(player_id, out_messages):
+            if prop_delta_encoder is not None:
+                out_messages = [prop_delta_encoder.encode(m) for m in out_messages]
+            if remote.batch_messages:
+                # Send everything pending in a single frame.
+                out_messages = message_from_server.CoalesceMessages(out_messages)
+                if len(out_messages) > 1:
+                    out_messages = [message_from_server.BatchFromServer(out_messages)]
             for message in out_messages:
                 await transmit_bytes(
-                    ws,
-                    orjson.dumps(
-                        message,
-                        option=orjson.OPT_NAIVE_UTC | orjson.OPT_PASSTHROUGH_DATETIME,
-                        default=datetime.isoformat,
-                    ),
+                    ws, message_from_server.SerializeMessageSegments(message)
                 )
 
 
 async def receive_agent_updates(request, ws, lobby):
     logger.info(f"receive_agent_updates({request}, {ws}, {lobby})")
     GlobalConfig()
+    try:
+        await _receive_agent_updates(request, ws, lobby)
+    finally:
+        # Make sure stream_game_state() wakes up to notice the socket closed.
+        lobby.wake_socket(ws)
+
+
+async def _receive_agent_updates(request, ws, lobby):
     async for msg in ws:
         remote = GetRemote(ws)
         if ws.closed:
@@ -1217,10 +1280,12 @@ async def receive_agent_updates(request, ws, lobby):
 
         if message.type == message_to_server.MessageType.GOOGLE_AUTH:
             await google_authenticator.handle_auth(ws, message.google_auth)
+            lobby.wake_socket(ws)
             continue
 
         if message.type == message_to_server.MessageType.USER_INFO:
             await user_info_fetcher.handle_userinfo_request(ws, remote)
+            lobby.wake_socket(ws)
             continue
 
         if message.type == message_to_server.MessageType.ROOM_MANAGEMENT:
@@ -1270,6 +1335,14 @@ async def PlayerEndpoint(request):
     logger.info(
         f"Player connecting to lobby: {lobby.lobby_name()} | type: {lobby.lobby_type()}"
     )
+    wire_format = WireFormat.JSON
+    if "encoding" in request.query:
+        try:
+            wire_format = WireFormat(request.query["encoding"])
+        except ValueError:
+            return web.Response(status=400, text="Unknown encoding.")
+    batch_messages = request.query.get("batch", "false") == "true"
+    delta_props = request.query.get("delta", "false") == "true"
     assignment = None
     is_mturk = False
     is_bot = False
@@ -1307,7 +1380,13 @@ async def PlayerEndpoint(request):
         port = peername[1]
         hashed_ip = hashlib.md5(ip.encode("utf-8")).hexdigest()
     remote = Remote(hashed_ip, port, 0, 0, time.time(), time.time(), request, ws)
-    remote = dataclasses.replace(remote, user_type=UserType.OPEN)
+    remote = dataclasses.replace(
+        remote,
+        user_type=UserType.OPEN,
+        wire_format=wire_format,
+        batch_messages=batch_messages,
+        delta_props=delta_props,
+    )
 
     if is_bot:
         remote = dataclasses.replace(remote, user_type=UserType.BOT)
@@ -1330,6 +1409,7 @@ async def PlayerEndpoint(request):
         logger.info("player disconnected from : " + request.remote)
         LogConnectionEvent(remote, "Disconnected from Server.")
         lobby.disconnect_socket(ws)
+        lobby.release_socket_wakeup(ws)
         DeleteRemote(ws)
     return ws
 
@@ -1436,6 +1516,10 @@ def InitGameRecording(config):
     base.ConnectDatabase()
     base.CreateTablesIfNotExists(defaults.ListDefaultTables())
 
+    # Optionally move event inserts off of the game loop. Flushed on exit.
+    InitGlobalEventWriter(config)
+    atexit.register(StopGlobalEventWriter)
+
 
 def InitializeDocumentation(config):
     if not config.generate_documentation:
@@ -1,10 +1,14 @@
 """ This utility streams a hardcoded map to clients. """
 import asyncio
+import copy
 import dataclasses
 import itertools
 import logging
 import math
+import pickle
 import random
+import zlib
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from dataclasses import dataclass
 from enum import Enum
 from queue import Queue
@@ -16,9 +20,10 @@ from dataclasses_json import dataclass_json
 import server.card as card
 import server.tutorial_map_data as tutorial_map_data
 from server.assets import AssetId, is_snowy
-from server.config.config import GlobalConfig
+from server.config.config import GlobalConfig, SetGlobalConfig
 from server.config.map_config import MapConfig
 from server.hex import HecsCoord
+from server.map_store import MapStore
 from server.map_utils import *
 from server.messages.action import Color
 from server.messages.map_update import (
@@ -32,6 +37,7 @@ from server.messages.map_update import (
     Outpost,
 )
 from server.messages.prop import PropUpdate
+from server.pathfinding import FindPath, WalkabilityGrid
 from server.util import IdAssigner
 
 logger = logging.getLogger(__name__)
@@ -504,31 +510,13 @@ def path_find(map, start, end, map_config: MapConfig = MapConfig()):
 
     Used for outpost routing.
     """
-    children = Queue()
-    children.put((start, [start]))
-    visited = set()
-    visited.add(start)
-    while not children.empty():
-        (current, path_to_current) = children.get()
-        if current == end:
-            return path_to_current
-        (r, c) = current.to_offset_coordinates()
-        for neighbor in current.neighbors():
-            nr, nc = neighbor.to_offset_coordinates()
-            if nr < 0 or nr >= len(map) or nc < 0 or nc >= len(map[0]):
-                continue
-            neighbor_tile = map[nr][nc]
-            if neighbor_tile.asset_id in [
-                AssetId.EMPTY_TILE,
-                AssetId.GROUND_TILE,
-                AssetId.GROUND_TILE_PATH,
-            ] + NatureAssetIds(map_config=map_config):
-                if neighbor not in visited:
-                    path_to_neighbor = path_to_current + [neighbor]
-                    child_node = (neighbor, path_to_neighbor)
-                    children.put(child_node)
-                    visited.add(neighbor)
-    return None
+    walkable_asset_ids = [
+        AssetId.EMPTY_TILE,
+        AssetId.GROUND_TILE,
+        AssetId.GROUND_TILE_PATH,
+    ] + NatureAssetIds(map_config=map_config)
+    grid = WalkabilityGrid.from_tile_grid(map, walkable_asset_ids)
+    return FindPath(start, end, lambda _, neighbor: grid.walkable(neighbor))
 
 
 def place_outpost(map, outpost, map_config: MapConfig):
@@ -865,6 +853,21 @@ class MapType(Enum):
 
 
 class MapProvider(object):
+    def __deepcopy__(self, memo):
+        """Copies the cards and spawn points. The map itself is shared."""
+        forked = copy.copy(self)
+        memo[id(self)] = forked
+        for name in (
+            "_id_assigner",
+            "_card_generator",
+            "_cards",
+            "_selected_cards",
+            "_cards_by_location",
+            "_spawn_points",
+        ):
+            setattr(forked, name, copy.deepcopy(getattr(self, name), memo))
+        return forked
+
     def _init_from_map_and_cards(self, map_update, cards):
         """ """
         self._tiles = map_update.tiles
@@ -930,6 +933,8 @@ class MapProvider(object):
     ):
         if map_config is None:
             map_config = GlobalConfig().map_config
+        # Built on the first call to map().
+        self._map_update = None
         if map_type == MapType.RANDOM:
             map_update = RandomMap(map_config)
             self._map_metadata = map_update.metadata
@@ -1197,28 +1202,25 @@ class MapProvider(object):
         return self._cards_by_location.get(location, None)
 
     def map(self):
-        if self._map_metadata:
-            return MapUpdate(
-                self._rows,
-                self._cols,
-                self._tiles,
-                self._map_metadata,
-                [],
-                self._fog_start,
-                self._fog_end,
-                self._color_tint,
-            )
-        else:
-            return MapUpdate(
-                self._rows,
-                self._cols,
-                self._tiles,
-                None,
-                [],
-                self._fog_start,
-                self._fog_end,
-                self._color_tint,
-            )
+        """Returns the map.
+
+        The map doesn't change after construction, so the same MapUpdate is
+        returned each time. This lets its serialized form be cached (see
+        SerializedMapUpdate). Don't modify the returned object.
+        """
+        if self._map_update is not None:
+            return self._map_update
+        self._map_update = MapUpdate(
+            self._rows,
+            self._cols,
+            self._tiles,
+            self._map_metadata if self._map_metadata else None,
+            [],
+            self._fog_start,
+            self._fog_end,
+            self._color_tint,
+        )
+        return self._map_update
 
     def prop_update(self):
         return PropUpdate([card.prop() for card in self._cards])
@@ -1241,12 +1243,34 @@ class MapProvider(object):
 
 MAP_POOL_MAXIMUM = 500
 map_pool = []
+# Persistent store of serialized maps, shared with other server processes. See
+# server/map_store.py. None if disabled.
+map_store = None
+# Number of maps in map_store, as of MapGenerationTask's last check.
+stored_map_count = 0
+# Counters reported by MapPoolStats().
+map_pool_stats = {
+    # Maps currently being generated by worker processes.
+    "in_flight": 0,
+    # Maps added to the pool since startup.
+    "generated": 0,
+    # Maps loaded into the pool from map_store since startup.
+    "loaded": 0,
+    # Maps requested while the pool was empty, and generated synchronously.
+    "misses": 0,
+}
 
 
 def CachedMapRetrieval():
     global map_pool
     if len(map_pool) == 0:
+        # This runs on the event loop, so don't wait for other server processes
+        # to release the store.
+        map_provider = _PopStoredMap(wait=False)
+        if map_provider is not None:
+            return map_provider
         logger.debug(f"Map pool ran out of cached maps. Generating...")
+        map_pool_stats["misses"] += 1
         return MapProvider(MapType.RANDOM)
     else:
         return map_pool.pop()
@@ -1257,7 +1281,128 @@ def MapPoolSize():
     return len(map_pool)
 
 
+def MapPoolStats():
+    stats = dict(map_pool_stats, size=len(map_pool))
+    if map_store is not None:
+        stats["stored"] = stored_map_count
+    return stats
+
+
+def _InitMapWorker(config):
+    # Forked workers inherit the parent's RNG state. Reseed, or every worker
+    # generates the same maps.
+    random.seed()
+    np.random.seed()
+    # Fog settings are read from the global config.
+    SetGlobalConfig(config)
+
+
+def _GenerateSerializedMap() -> bytes:
+    """Runs in a worker process. Returns a pickled, compressed MapProvider."""
+    map_provider = MapProvider(MapType.RANDOM)
+    return zlib.compress(pickle.dumps(map_provider, pickle.HIGHEST_PROTOCOL), 1)
+
+
+def _DeserializeMap(serialized: bytes) -> MapProvider:
+    return pickle.loads(zlib.decompress(serialized))
+
+
+def _PopStoredMap(wait=True):
+    """Returns a MapProvider from map_store, or None if there isn't one.
+
+    See MapStore.pop() for wait.
+    """
+    while map_store is not None:
+        serialized = map_store.pop(wait)
+        if serialized is None:
+            return None
+        try:
+            map_provider = _DeserializeMap(serialized)
+        except Exception as e:
+            logger.exception(f"Dropping unreadable stored map: {e}")
+            continue
+        map_pool_stats["loaded"] += 1
+        return map_provider
+    return None
+
+
 async def MapGenerationTask(lobbies, config):
+    """Keeps map_pool filled with up to config.map_cache_size maps.
+
+    Maps are generated by config.map_generation_workers worker processes, so
+    this runs regardless of how many games are active. With 0 workers, falls
+    back to generating maps on the event loop while the server is idle.
+
+    If config.map_store_size is positive, map_pool is first refilled from the
+    persistent map store, which the workers keep filled with up to
+    map_store_size maps once map_pool is full. This way, a restarted server
+    can serve pre-generated maps immediately. Store calls can wait on other
+    server processes for up to BUSY_TIMEOUT_MS (see map_store.py), so they run
+    on a separate thread instead of the event loop.
+    """
+    global map_store, stored_map_count
+    if config.map_generation_workers <= 0:
+        await _IdleMapGenerationTask(lobbies, config)
+        return
+    pool_target = min(MAP_POOL_MAXIMUM, config.map_cache_size)
+    # Keep each worker busy while the main process unpacks results.
+    max_in_flight = 2 * config.map_generation_workers
+    loop = asyncio.get_running_loop()
+    with ThreadPoolExecutor(max_workers=1) as store_executor, ProcessPoolExecutor(
+        max_workers=config.map_generation_workers,
+        initializer=_InitMapWorker,
+        initargs=(config,),
+    ) as executor:
+        if config.map_store_size > 0:
+            map_store = await loop.run_in_executor(
+                store_executor, MapStore, config.map_store_path()
+            )
+        pending = set()
+        while True:
+            # Loading a stored map is much cheaper than generating one.
+            while map_store is not None and (
+                len(map_pool) + len(pending) < pool_target
+            ):
+                map_provider = await loop.run_in_executor(store_executor, _PopStoredMap)
+                if map_provider is None:
+                    break
+                map_pool.append(map_provider)
+            target = pool_target
+            if map_store is not None:
+                stored_map_count = await loop.run_in_executor(
+                    store_executor, map_store.size
+                )
+                target += max(config.map_store_size - stored_map_count, 0)
+            while len(map_pool) + len(pending) < target and (
+                len(pending) < max_in_flight
+            ):
+                pending.add(loop.run_in_executor(executor, _GenerateSerializedMap))
+            map_pool_stats["in_flight"] = len(pending)
+            if len(pending) == 0:
+                # The pool is full. Check again once some maps have been used.
+                await asyncio.sleep(1)
+                continue
+            done, pending = await asyncio.wait(
+                pending, return_when=asyncio.FIRST_COMPLETED
+            )
+            for future in done:
+                try:
+                    serialized = future.result()
+                    map_pool_stats["generated"] += 1
+                    if map_store is not None and len(map_pool) >= pool_target:
+                        await loop.run_in_executor(
+                            store_executor, map_store.put, serialized
+                        )
+                        continue
+                    map_pool.append(_DeserializeMap(serialized))
+                except Exception as e:
+                    logger.exception(f"Map generation failed: {e}")
+                    continue
+                if len(map_pool) % 10 == 0:
+                    print(f"Map pool size: {len(map_pool)}")
+
+
+async def _IdleMapGenerationTask(lobbies, config):
     while True:
         # Only generate maps when there are no active games.
         lobbies_empty = all([len(lobby.room_ids()) == 0 for lobby in lobbies])
@@ -1272,6 +1417,7 @@ async def MapGenerationTask(lobbies, config):
 
         # Add a map to the map cache.
         map_pool.append(MapProvider(MapType.RANDOM))
+        map_pool_stats["generated"] += 1
         if len(map_pool) % 10 == 0:
             print(f"Map pool size: {len(map_pool)}")
         await asyncio.sleep(0.001)
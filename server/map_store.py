@@ -0,0 +1,95 @@
+""" A persistent pool of pre-generated maps, shared by server processes.
+
+Maps are stored as opaque blobs (see _GenerateSerializedMap in
+map_provider.py) in their own sqlite file, separate from the game database.
+Since pops happen inside an IMMEDIATE transaction, several server processes
+can share one store without handing out the same map twice.
+"""
+
+import logging
+
+from peewee import (
+    AutoField,
+    BlobField,
+    IntegerField,
+    Model,
+    OperationalError,
+    SqliteDatabase,
+)
+
+logger = logging.getLogger(__name__)
+
+# Bump this whenever the serialized map format changes (e.g. MapProvider gains
+# or renames an attribute). Maps stored with a different version are deleted
+# when the store is opened.
+MAP_STORE_FORMAT_VERSION = 1
+
+# How long to wait for other server processes to release the write lock.
+BUSY_TIMEOUT_MS = 5000
+
+map_store_database = SqliteDatabase(None)
+
+
+class StoredMap(Model):
+    id = AutoField()
+    format_version = IntegerField()
+    data = BlobField()
+
+    class Meta:
+        database = map_store_database
+
+
+class MapStore(object):
+    def __init__(self, path):
+        map_store_database.init(
+            path,
+            pragmas=[
+                ("journal_mode", "wal"),
+                # Other server processes may be holding the write lock.
+                ("busy_timeout", BUSY_TIMEOUT_MS),
+            ],
+        )
+        map_store_database.connect(reuse_if_open=True)
+        map_store_database.create_tables([StoredMap], safe=True)
+        stale = (
+            StoredMap.delete()
+            .where(StoredMap.format_version != MAP_STORE_FORMAT_VERSION)
+            .execute()
+        )
+        if stale > 0:
+            logger.info(f"Deleted {stale} maps with an outdated format.")
+
+    def size(self) -> int:
+        return StoredMap.select().count()
+
+    def put(self, data: bytes):
+        StoredMap.create(format_version=MAP_STORE_FORMAT_VERSION, data=data)
+
+    def pop(self, wait: bool = True):
+        """Removes a map from the store and returns it. Returns None if empty.
+
+        If wait is False and another process holds the write lock, returns
+        None right away instead of waiting up to BUSY_TIMEOUT_MS for it.
+        """
+        if not wait:
+            map_store_database.execute_sql("PRAGMA busy_timeout = 0")
+        try:
+            with map_store_database.atomic("IMMEDIATE"):
+                stored_map = StoredMap.select().order_by(StoredMap.id).first()
+                if stored_map is None:
+                    return None
+                StoredMap.delete_by_id(stored_map.id)
+        except OperationalError as e:
+            if wait:
+                raise
+            logger.debug(f"Map store is busy: {e}")
+            return None
+        finally:
+            if not wait:
+                map_store_database.execute_sql(
+                    f"PRAGMA busy_timeout = {BUSY_TIMEOUT_MS}"
+                )
+        return bytes(stored_map.data)
+
+    def close(self):
+        map_store_database.close()
@@ -1,4 +1,3 @@
-import copy
 import dataclasses
 import logging
 import random
@@ -620,9 +619,13 @@ def FloodFillPartitionTiles(tiles):
 
 
 def CensorMapForFollower(map_update, follower):
-    """Censors information from a map that the follower isn't supposed to have."""
-    map_update_clone = copy.deepcopy(map_update)
-    return map_update_clone
+    """Censors information from a map that the follower isn't supposed to have.
+
+    Nothing in the map is currently hidden from the follower, so this returns
+    map_update itself instead of a copy. That way, the leader and follower
+    share one cached serialization of the map (see SerializedMapUpdate).
+    """
+    return map_update
 
 
 def CensorCards(prop_update, follower=None):
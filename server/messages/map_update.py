@@ -1,13 +1,19 @@
 import logging
+import weakref
 from dataclasses import dataclass, field
+from datetime import datetime
 from enum import Enum
 from typing import List, Optional
 
+import numpy as np
+import orjson
 from mashumaro.mixins.json import DataClassJSONMixin
 
+from server.assets import AssetId
 from server.hex import HecsCoord, HexBoundary, HexCell
 from server.messages.action import Color
 from server.messages.prop import Prop, PropUpdate
+from server.wire_format import SharedSegment
 
 logger = logging.getLogger(__name__)
 
@@ -79,6 +85,22 @@ class MapMetadata(DataClassJSONMixin):
     partition_sizes: List[int] = field(default_factory=list)
 
 
+# The dtype of MapUpdate.grid(). Field types match the "map" observation space
+# in envs/cb2.py.
+TILE_GRID_DTYPE = np.dtype(
+    [
+        ("asset_id", np.int16),
+        ("boundary", np.int8),
+        ("height", np.float32),
+        ("layer", np.int8),
+        ("rotation", np.int16),
+    ]
+)
+
+# Value of grid cells which have no tile.
+EMPTY_GRID_CELL = (AssetId.NONE, -1, 0, 0, 0)
+
+
 @dataclass
 class MapUpdate(DataClassJSONMixin):
     rows: int
@@ -94,24 +116,23 @@ class MapUpdate(DataClassJSONMixin):
     def from_gym_state(observation):
         """Converts a gym space to a MapUpdate."""
         map_space = observation["map"]
-        rows, cols = len(map_space["asset_ids"]), len(map_space["asset_ids"][0])
+        rows, cols = np.shape(map_space["asset_ids"])
+        grid = np.empty((rows, cols), dtype=TILE_GRID_DTYPE)
+        grid["asset_id"] = map_space["asset_ids"]
+        grid["boundary"] = map_space["boundaries"]
+        grid["height"] = map_space["heights"]
+        grid["layer"] = map_space["layers"]
+        grid["rotation"] = map_space["orientations"]
         tiles = []
-        for r in range(rows):
-            for c in range(cols):
+        for r, row in enumerate(grid.tolist()):
+            for c, (asset_id, boundary, height, layer, rotation) in enumerate(row):
                 coord = HecsCoord.from_offset(r, c)
-                boundary = HexBoundary(map_space["boundaries"][r][c])
-                height = map_space["heights"][r][c]
-                layer = map_space["layers"][r][c]
-                cell = HexCell(coord, boundary, height, layer)
-                tiles.append(
-                    Tile(
-                        map_space["asset_ids"][r][c],
-                        cell,
-                        map_space["orientations"][r][c],
-                    )
-                )
+                cell = HexCell(coord, HexBoundary(boundary), height, layer)
+                tiles.append(Tile(asset_id, cell, rotation))
         prop_update = PropUpdate.from_gym_state(observation)
-        return MapUpdate(rows, cols, tiles, None, prop_update.props)
+        map_update = MapUpdate(rows, cols, tiles, None, prop_update.props)
+        map_update._grid = grid
+        return map_update
 
     def get_edge_between(self, hecs_a: HecsCoord, hecs_b: HecsCoord):
         """Returns the edge between the two given HECS coordinates.
@@ -126,28 +147,100 @@ class MapUpdate(DataClassJSONMixin):
         if tile_a is None or tile_b is None:
             logger.info(f"NONE: {tile_a} {tile_b}")
             return True
-        bound_a = tile_a.cell.boundary
-        bound_b = tile_b.cell.boundary
-        return bound_a.get_edge_between(hecs_a, hecs_b) or bound_b.get_edge_between(
-            hecs_b, hecs_a
-        )
-
-    def tile_at(self, r, c):
-        """Returns the tile at the given row and column."""
-        location = HecsCoord.from_offset(r, c)
-        self.tile_at(location)
+        edge = HexBoundary.DIR_TO_EDGE.get(HecsCoord.sub(hecs_b, hecs_a), None)
+        if edge is None:
+            raise ValueError(f"HecsCoords {hecs_a}, {hecs_b} are not adjacent.")
+        opposite_edge = (edge + 3) % 6
+        return (tile_a.cell.boundary.edges & (1 << edge)) != 0 or (
+            tile_b.cell.boundary.edges & (1 << opposite_edge)
+        ) != 0
+
+    def tile_at_offset(self, r, c):
+        """Returns the tile at the given row and column, or None."""
+        if r < 0 or r >= self.rows or c < 0 or c >= self.cols:
+            return None
+        return self._tile_index()[r * self.cols + c]
 
     def tile_at(self, hecs: HecsCoord):
-        self._refresh_tile_cache(hecs)
-        if hecs not in self._tile_cache:
-            return None
-        return self._tile_cache[hecs]
-
-    def _refresh_tile_cache(self, hecs: HecsCoord):
-        if hasattr(self, "_tile_cache"):
-            if hecs in self._tile_cache:
-                return  # Cache up to date.
-            return
-        self._tile_cache = {}
+        """Returns the tile at the given HECS coordinate, or None."""
+        r, c = hecs.to_offset_coordinates()
+        return self.tile_at_offset(r, c)
+
+    def grid(self):
+        """Returns the map as a dense (rows, cols) numpy array of TILE_GRID_DTYPE.
+
+        Cells without a tile are set to EMPTY_GRID_CELL. The array is built on
+        first use and shared between callers, so don't modify it.
+        """
+        if getattr(self, "_grid", None) is not None:
+            return self._grid
+        grid = np.empty((self.rows, self.cols), dtype=TILE_GRID_DTYPE)
+        grid[...] = EMPTY_GRID_CELL
+        for tile in self.tiles:
+            r, c = tile.cell.coord.to_offset_coordinates()
+            if r < 0 or r >= self.rows or c < 0 or c >= self.cols:
+                continue
+            grid[r, c] = (
+                tile.asset_id,
+                tile.cell.boundary.edges,
+                tile.cell.height,
+                tile.cell.layer,
+                tile.rotation_degrees,
+            )
+        self._grid = grid
+        return self._grid
+
+    def _tile_index(self):
+        # A flat list of tiles indexed by r * cols + c. For single-tile lookups
+        # indexing a list is several times faster than indexing the numpy grid.
+        if getattr(self, "_tiles_by_offset", None) is not None:
+            return self._tiles_by_offset
+        tiles_by_offset = [None] * (self.rows * self.cols)
         for tile in self.tiles:
-            self._tile_cache[tile.cell.coord] = tile
+            r, c = tile.cell.coord.to_offset_coordinates()
+            if 0 <= r < self.rows and 0 <= c < self.cols:
+                tiles_by_offset[r * self.cols + c] = tile
+        self._tiles_by_offset = tiles_by_offset
+        return self._tiles_by_offset
+
+    def __getstate__(self):
+        # Don't pickle the lookup tables. They're rebuilt on first use.
+        state = self.__dict__.copy()
+        state.pop("_grid", None)
+        state.pop("_tiles_by_offset", None)
+        return state
+
+
+# Maps id(map_update) -> (weakref to map_update, SharedSegment of serialized
+# bytes). Entries are removed when the MapUpdate is garbage collected.
+_serialized_map_updates = {}
+
+
+def SerializedMapUpdate(map_update: MapUpdate) -> bytes:
+    """Returns map_update serialized with orjson, caching the result.
+
+    Maps are large, and the same MapUpdate object is sent to each player
+    (and written to the game logs) many times. The cache is keyed on object
+    identity, so a MapUpdate must not be modified after it's been serialized.
+    """
+    return SerializedMapUpdateSegment(map_update).data
+
+
+def SerializedMapUpdateSegment(map_update: MapUpdate) -> SharedSegment:
+    """Like SerializedMapUpdate(), but returns the cached SharedSegment, which
+    also caches the map's compressed bytes for binary frames."""
+    key = id(map_update)
+    entry = _serialized_map_updates.get(key, None)
+    if entry is not None and entry[0]() is map_update:
+        return entry[1]
+    serialized = orjson.dumps(
+        map_update,
+        option=orjson.OPT_NAIVE_UTC | orjson.OPT_PASSTHROUGH_DATETIME,
+        default=datetime.isoformat,
+    )
+    reference = weakref.ref(
+        map_update, lambda _: _serialized_map_updates.pop(key, None)
+    )
+    segment = SharedSegment(serialized)
+    _serialized_map_updates[key] = (reference, segment)
+    return segment
@@ -1,11 +1,13 @@
 """ Defines message structure received from server.  """
 
+import dataclasses
 from dataclasses import dataclass, field
 from datetime import datetime
 from enum import Enum
 from typing import List, Optional
 
 import dateutil.parser
+import orjson
 from dataclasses_json import config
 from marshmallow import fields
 from mashumaro.mixins.json import DataClassJSONMixin
@@ -14,10 +16,10 @@ from server.messages.action import Action
 from server.messages.feedback_questions import FeedbackQuestion
 from server.messages.google_auth import GoogleAuthConfirmation
 from server.messages.live_feedback import LiveFeedback
-from server.messages.map_update import MapUpdate
+from server.messages.map_update import MapUpdate, SerializedMapUpdateSegment
 from server.messages.menu_options import MenuOptions
 from server.messages.objective import ObjectiveMessage
-from server.messages.prop import Prop, PropUpdate
+from server.messages.prop import Prop, PropUpdate, PropUpdateDelta
 from server.messages.replay_messages import ReplayResponse
 from server.messages.rooms import RoomManagementResponse
 from server.messages.scenario import ScenarioResponse
@@ -26,6 +28,7 @@ from server.messages.state_sync import StateMachineTick, StateSync
 from server.messages.turn_state import TurnState
 from server.messages.tutorials import TutorialResponse
 from server.messages.user_info import UserInfo
+from server.wire_format import JoinSegments
 
 
 class MessageType(Enum):
@@ -56,6 +59,12 @@ class MessageType(Enum):
     # Prompt the follower with feedback questions.
     SOUND_TRIGGER = 18
     FEEDBACK_QUESTION = 19
+    # Several messages sent in a single frame. Only sent to clients which
+    # request batching when connecting.
+    BATCH = 20
+    # Props which changed since the last PROP_UPDATE or PROP_DELTA. Only sent
+    # to clients which request deltas when connecting.
+    PROP_DELTA = 21
 
 
 def ActionsFromServer(actions):
@@ -408,6 +417,117 @@ def FeedbackQuestionFromServer(feedback_question):
     )
 
 
+def BatchFromServer(messages):
+    return MessageFromServer(datetime.utcnow(), MessageType.BATCH, batch=messages)
+
+
+# Stands in for a MapUpdate while the rest of a message is serialized. See
+# SerializeMessage().
+_MAP_PLACEHOLDER = "__serialized_map_update_{}__"
+
+
+def SerializeMessage(message, envelope=None) -> bytes:
+    """Serializes a MessageFromServer to JSON.
+
+    Equivalent to orjson.dumps(envelope(message)), except that MapUpdates
+    (including those in batches) are copied from SerializedMapUpdate()'s
+    cache instead of being serialized again. envelope optionally wraps the
+    message in another object, e.g. a LogEntry.
+    """
+    return JoinSegments(SerializeMessageSegments(message, envelope))
+
+
+def SerializeMessageSegments(message, envelope=None) -> List:
+    """Like SerializeMessage(), but returns the JSON as a list of segments.
+
+    Each MapUpdate is its cached SharedSegment, so that EncodeFrame() can
+    reuse its compressed bytes too. See server/wire_format.py.
+    """
+    map_updates = []
+
+    def remove_maps(message):
+        if message.type == MessageType.MAP_UPDATE and message.map_update is not None:
+            map_updates.append(message.map_update)
+            placeholder = _MAP_PLACEHOLDER.format(len(map_updates) - 1)
+            return dataclasses.replace(message, map_update=placeholder)
+        if message.type == MessageType.BATCH:
+            return dataclasses.replace(
+                message, batch=[remove_maps(m) for m in message.batch]
+            )
+        return message
+
+    message = remove_maps(message)
+    serialized = orjson.dumps(
+        message if envelope is None else envelope(message),
+        option=orjson.OPT_NAIVE_UTC | orjson.OPT_PASSTHROUGH_DATETIME,
+        default=datetime.isoformat,
+    )
+    segments = []
+    for i, map_update in enumerate(map_updates):
+        placeholder = b'"' + _MAP_PLACEHOLDER.format(i).encode("utf-8") + b'"'
+        before, serialized = serialized.split(placeholder, 1)
+        segments += [before, SerializedMapUpdateSegment(map_update)]
+    segments.append(serialized)
+    return segments
+
+
+def CoalesceMessages(messages):
+    """Drops all but the last StateMachineTick from a list of messages.
+
+    Ticks delimit state machine iterations. When messages from several
+    iterations are delivered together, only the final tick is meaningful.
+    """
+    last_tick = None
+    for i, message in enumerate(messages):
+        if message.type == MessageType.STATE_MACHINE_TICK:
+            last_tick = i
+    return [
+        message
+        for i, message in enumerate(messages)
+        if message.type != MessageType.STATE_MACHINE_TICK or i == last_tick
+    ]
+
+
+def PropDeltaFromServer(prop_delta: PropUpdateDelta):
+    return MessageFromServer(
+        datetime.utcnow(), MessageType.PROP_DELTA, prop_delta=prop_delta
+    )
+
+
+class PropDeltaEncoder(object):
+    """Replaces PropUpdate messages to a single client with PropUpdateDelta messages.
+
+    The first PropUpdate is sent in full. After that, each PropUpdate is
+    diffed against the last one sent to the client. Messages which modify
+    the client's props outside of PropUpdates (state syncs, prop spawns and
+    despawns) reset the encoder, so the next PropUpdate is sent in full.
+    """
+
+    def __init__(self):
+        self._last_prop_update = None
+
+    def reset(self):
+        self._last_prop_update = None
+
+    def encode(self, message):
+        if message.type in [
+            MessageType.STATE_SYNC,
+            MessageType.PROP_SPAWN,
+            MessageType.PROP_DESPAWN,
+        ]:
+            self.reset()
+            return message
+        if message.type != MessageType.PROP_UPDATE:
+            return message
+        last_prop_update = self._last_prop_update
+        self._last_prop_update = message.prop_update
+        if last_prop_update is None:
+            return message
+        return PropDeltaFromServer(
+            PropUpdateDelta.between(last_prop_update, message.prop_update)
+        )
+
+
 def ExcludeIfNone(value):
     return value is None
 
@@ -479,3 +599,9 @@ class MessageFromServer(DataClassJSONMixin):
     feedback_question: Optional[FeedbackQuestion] = field(
         default=None, metadata=config(exclude=ExcludeIfNone)
     )
+    batch: Optional[List["MessageFromServer"]] = field(
+        default=None, metadata=config(exclude=ExcludeIfNone)
+    )
+    prop_delta: Optional[PropUpdateDelta] = field(
+        default=None, metadata=config(exclude=ExcludeIfNone)
+    )
@@ -1,7 +1,9 @@
-from dataclasses import dataclass, field
+import copy
+from dataclasses import dataclass, field, fields
 from enum import Enum
 from typing import List, Optional
 
+import numpy as np
 from mashumaro.mixins.json import DataClassJSONMixin
 
 import server.card_enums as card_enums
@@ -42,6 +44,10 @@ class SimpleConfig(DataClassJSONMixin):
     __slots__ = "asset_id"
     asset_id: int
 
+    def __deepcopy__(self, memo):
+        # The default deepcopy can't set fields of frozen slotted dataclasses.
+        return SimpleConfig(self.asset_id)
+
 
 @dataclass(frozen=True)
 class Prop(DataClassJSONMixin):
@@ -54,6 +60,10 @@ class Prop(DataClassJSONMixin):
     card_init: Optional[CardConfig]  # Only used for Card props.
     simple_init: Optional[SimpleConfig]  # Only used for Simple props.
 
+    def __deepcopy__(self, memo):
+        # The default deepcopy can't set fields of frozen slotted dataclasses.
+        return Prop(*(copy.deepcopy(getattr(self, f.name), memo) for f in fields(self)))
+
 
 @dataclass(frozen=True)
 class PropUpdate(DataClassJSONMixin):
@@ -64,38 +74,69 @@ class PropUpdate(DataClassJSONMixin):
         """Returns a PropUpdate from a given gym prop state."""
         props = []
         cards = observation["cards"]
-        rows, cols = len(cards["counts"]), len(cards["counts"][0])
+        # Card layers may be nested lists of enums, or numpy arrays of ints.
+        counts = np.asarray(cards["counts"])
         # Only requirement for the card ID is that each ID is unique.
         card_id = 0
-        for i in range(rows):
-            for j in range(cols):
-                count = cards["counts"][i][j]
-                if count == 0:
-                    continue
-                location = HecsCoord.from_offset(i, j)
-                rotation = 0
-                border_color = card_enums.Color.BLUE
-                color = cards["colors"][i][j]
-                border_color = cards["border_colors"][i][j]
-                shape = cards["shapes"][i][j]
-                selected = cards["selected"][i][j]
-                prop_info = GenericPropInfo(
-                    location=location,
-                    rotation_degrees=rotation,
-                    collide=False,
-                    border_radius=0,
-                    border_color=border_color,
-                )
-                card_init = CardConfig(
-                    color=color, shape=shape, count=count, selected=selected
-                )
-                prop = Prop(
-                    id=card_id,
-                    prop_type=PropType.CARD,
-                    prop_info=prop_info,
-                    card_init=card_init,
-                    simple_init=None,
-                )
-                props.append(prop)
-                card_id += 1
+        for i, j in zip(*np.nonzero(counts)):
+            i, j = int(i), int(j)
+            count = int(counts[i, j])
+            location = HecsCoord.from_offset(i, j)
+            rotation = 0
+            color = card_enums.Color(cards["colors"][i][j])
+            border_color = card_enums.Color(cards["border_colors"][i][j])
+            shape = card_enums.Shape(cards["shapes"][i][j])
+            selected = bool(cards["selected"][i][j])
+            prop_info = GenericPropInfo(
+                location=location,
+                rotation_degrees=rotation,
+                collide=False,
+                border_radius=0,
+                border_color=border_color,
+            )
+            card_init = CardConfig(
+                color=color, shape=shape, count=count, selected=selected
+            )
+            prop = Prop(
+                id=card_id,
+                prop_type=PropType.CARD,
+                prop_info=prop_info,
+                card_init=card_init,
+                simple_init=None,
+            )
+            props.append(prop)
+            card_id += 1
         return PropUpdate(props=props)
+
+
+@dataclass(frozen=True)
+class PropUpdateDelta(DataClassJSONMixin):
+    """The difference between two PropUpdates.
+
+    changed contains props which were added or modified. removed contains the
+    IDs of props which are no longer present.
+    """
+
+    changed: List[Prop] = field(default_factory=list)
+    removed: List[int] = field(default_factory=list)
+
+    @staticmethod
+    def between(old: PropUpdate, new: PropUpdate):
+        old_props = {prop.id: prop for prop in old.props}
+        new_ids = set()
+        changed = []
+        for prop in new.props:
+            new_ids.add(prop.id)
+            if old_props.get(prop.id, None) != prop:
+                changed.append(prop)
+        removed = [prop_id for prop_id in old_props if prop_id not in new_ids]
+        return PropUpdateDelta(changed, removed)
+
+    def apply(self, prop_update: PropUpdate) -> PropUpdate:
+        """Returns prop_update with this delta applied."""
+        props = {prop.id: prop for prop in prop_update.props}
+        for prop_id in self.removed:
+            props.pop(prop_id, None)
+        for prop in self.changed:
+            props[prop.id] = prop
+        return PropUpdate(list(props.values()))
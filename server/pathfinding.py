@@ -0,0 +1,96 @@
+""" Shortest-path search on the hex grid.
+
+Used by map generation (outpost routing), the simple leader agent, and
+anything else that needs to route an actor between two tiles.
+"""
+
+import heapq
+import itertools
+from typing import Callable, Iterable, List, Optional
+
+from server.hex import HecsCoord
+
+
+def HexDistance(a: HecsCoord, b: HecsCoord) -> int:
+    """Returns the number of steps between two tiles, ignoring obstacles."""
+    # Convert offset (odd rows shifted right) to axial coordinates.
+    a_row, a_col = a.to_offset_coordinates()
+    b_row, b_col = b.to_offset_coordinates()
+    dq = (b_col - (b_row - (b_row & 1)) // 2) - (a_col - (a_row - (a_row & 1)) // 2)
+    dr = b_row - a_row
+    return (abs(dq) + abs(dr) + abs(dq + dr)) // 2
+
+
+class WalkabilityGrid(object):
+    """A bitmap of which tiles in a rows x cols map can be walked on."""
+
+    def __init__(self, rows: int, cols: int):
+        self._rows = rows
+        self._cols = cols
+        self._walkable = bytearray(rows * cols)
+
+    @staticmethod
+    def from_tile_grid(tile_grid, walkable_asset_ids: Iterable[int]):
+        """Builds a grid from a 2D list of Tiles, indexed [row][col]."""
+        walkable_asset_ids = set(walkable_asset_ids)
+        grid = WalkabilityGrid(len(tile_grid), len(tile_grid[0]))
+        for r, row in enumerate(tile_grid):
+            for c, tile in enumerate(row):
+                if tile.asset_id in walkable_asset_ids:
+                    grid._walkable[r * grid._cols + c] = 1
+        return grid
+
+    def walkable(self, coord: HecsCoord) -> bool:
+        """Returns false for unwalkable and off-map tiles."""
+        r, c = coord.to_offset_coordinates()
+        if r < 0 or r >= self._rows or c < 0 or c >= self._cols:
+            return False
+        return self._walkable[r * self._cols + c] == 1
+
+
+def FindPath(
+    start: HecsCoord,
+    end: HecsCoord,
+    can_move: Callable[[HecsCoord, HecsCoord], bool],
+) -> Optional[List[HecsCoord]]:
+    """A* search for the shortest path from start to end.
+
+    can_move(a, b) returns whether an actor can step from a to its neighbor b.
+
+    Returns the list of tiles on the path, including start and end, or None
+    if end can't be reached.
+    """
+    # Each entry is (estimated total cost, tiebreaker, cost so far, coord).
+    tiebreaker = itertools.count()
+    frontier = [(HexDistance(start, end), next(tiebreaker), 0, start)]
+    parents = {start: None}
+    costs = {start: 0}
+    while len(frontier) > 0:
+        _, _, cost, current = heapq.heappop(frontier)
+        if current == end:
+            path = []
+            while current is not None:
+                path.append(current)
+                current = parents[current]
+            path.reverse()
+            return path
+        if cost > costs[current]:
+            continue  # Stale entry. A shorter route to current was found.
+        for neighbor in current.neighbors():
+            neighbor_cost = cost + 1
+            if neighbor_cost >= costs.get(neighbor, neighbor_cost + 1):
+                continue
+            if not can_move(current, neighbor):
+                continue
+            costs[neighbor] = neighbor_cost
+            parents[neighbor] = current
+            heapq.heappush(
+                frontier,
+                (
+                    neighbor_cost + HexDistance(neighbor, end),
+                    next(tiebreaker),
+                    neighbor_cost,
+                    neighbor,
+                ),
+            )
+    return None
@@ -9,6 +9,7 @@ from marshmallow import fields
 
 import server.schemas.clients as clients_db
 from server.messages.user_info import UserType
+from server.wire_format import WireFormat
 
 # A table of active websocket connections. Maps from aiohttp.WebSocketResponse
 # to Remote (defined below).
@@ -85,6 +86,12 @@ class Remote:
     time_offset: float = 0.0
     latency: float = 0.0
     uuid: str = ""
+    # How messages are framed when sent to this client. See server/wire_format.py.
+    wire_format: WireFormat = WireFormat.JSON
+    # If true, game messages are coalesced and sent in BATCH messages.
+    batch_messages: bool = False
+    # If true, PropUpdates after the first are sent as PropUpdateDeltas.
+    delta_props: bool = False
 
     def __str__(self):
         return f"m5sum hashed ip: {self.hashed_ip}, bytes (up/down): {self.bytes_up}/{self.bytes_down}, last message (up/down): {self.last_message_up}/{self.last_message_down}, time_offset: {self.time_offset}, latency: {self.latency}"
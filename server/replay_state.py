@@ -1,7 +1,9 @@
+import copy
 import dataclasses
 import json
 import logging
 from collections import deque
+from dataclasses import dataclass, field
 from datetime import datetime, timedelta
 from typing import List
 
@@ -39,9 +41,22 @@ FOLLOWER_SECONDS_PER_TURN = 15
 
 FOLLOWER_TURN_END_DELAY_SECONDS = 1
 
+# ReplayState saves the integrated replay state every this many events, so
+# seeking doesn't have to replay the game from the start.
+REPLAY_KEYFRAME_INTERVAL = 50
+
 logger = logging.getLogger(__name__)
 
 
+@dataclass
+class _IntegratedReplay:
+    """Actor, instruction and prop state, integrated from a game's events."""
+
+    instructions: List = field(default_factory=list)
+    actors: List = field(default_factory=list)
+    props: List = field(default_factory=list)
+
+
 # The Cerealbar2 Replay State Machine. This is the state machine that is used to
 # drive the replay mechanism. Game events are loaded from the database and
 # played back to the client.
@@ -72,6 +87,9 @@ class ReplayState(object):
         self._initialized = False
         self._events = []
         self._event_index = 0
+        # Integrated replay state by event index. See _integrated_replay().
+        self._keyframes = {}
+        self._keyframe_interval = REPLAY_KEYFRAME_INTERVAL
         self._starting_index = 0
         self._paused = True
         self._event_timer = CountDownTimer()
@@ -82,6 +100,9 @@ class ReplayState(object):
 
         self._props = []
         self._instructions = []
+        # Parsed MapUpdates by event ID. Reusing the same MapUpdate object
+        # lets its serialization be cached (see SerializedMapUpdate).
+        self._map_updates = {}
 
         self._message_queue = {}
         self._command_queue = deque()
@@ -117,8 +138,9 @@ class ReplayState(object):
         action objects to have their duration set to 0.
         """
         if event.type == EventType.MAP_UPDATE:
-            map_update = MapUpdate.from_json(event.data)
-            return message_from_server.MapUpdateFromServer(map_update)
+            if event.id not in self._map_updates:
+                self._map_updates[event.id] = MapUpdate.from_json(event.data)
+            return message_from_server.MapUpdateFromServer(self._map_updates[event.id])
         elif event.type == EventType.INITIAL_STATE:
             initial_state = InitialState.from_json(event.data)
             leader_state = state_sync.Actor(
@@ -305,72 +327,30 @@ class ReplayState(object):
         return time_difference / float(self._speed)
 
     def rewind_event(self):
-        """Replays all events up to the previous event, integrating state on the server and then sends state to the client."""
+        """Steps back to the previous event, and sends the state at that point to the client."""
         if (self._event_index <= self._starting_index) or (self._event_index <= 0):
             return
+        self.seek_event(self._event_index - 1)
+
+    def seek_event(self, event_index: int):
+        """Jumps to the given event, and sends the state at that point to the client.
+
+        Map update is preserved across seeks. Actor, instruction and prop
+        state are restored from the nearest keyframe before event_index, and
+        then the remaining events are integrated. Pauses the replay.
+        """
+        event_index = max(self._starting_index, min(event_index, len(self._events)))
         start_time = datetime.utcnow()
-        self._event_index -= 1
-        self._instructions = []
-        # Map update is preserved across rewind. Actor, instruction and prop state are not. Iterate through all messages, integrating actor and prop positions across actions.
-        # Then, send a prop update and state sync update.
-        # Quickly resend all events leading up to the previous event.
-        instructions = []
-        actors = []
-        props = []
-        for i in range(0, self._event_index):
-            self._update_instructions(instructions, self._events[i])
-            if self._events[i].type == EventType.PROP_UPDATE:
-                props = PropUpdate.from_json(self._events[i].data).props
-            elif self._events[i].type == EventType.INITIAL_STATE:
-                initial_state_obj = InitialState.from_json(self._events[i].data)
-                leader = actor.Actor(
-                    initial_state_obj.leader_id,
-                    AssetId.PLAYER,
-                    Role.LEADER,
-                    initial_state_obj.leader_position,
-                    False,
-                    initial_state_obj.leader_rotation_degrees,
-                )
-                follower = actor.Actor(
-                    initial_state_obj.follower_id,
-                    AssetId.FOLLOWER_BOT,
-                    Role.FOLLOWER,
-                    initial_state_obj.follower_position,
-                    False,
-                    initial_state_obj.follower_rotation_degrees,
-                )
-                actors = [leader, follower]
-            elif self._events[i].type == EventType.ACTION:
-                action = Action.from_json(self._events[i].data)
-                for agent in actors:
-                    if agent.actor_id() == action.id:
-                        agent.add_action(action)
-                        agent.step()
-                        break
-            elif self._events[i].type == EventType.TURN_STATE:
-                TurnState.from_json(self._events[i].data)
-            elif self._events[i].type == EventType.CARD_SELECT:
-                card = Card.from_json(self._events[i].data)
-                for prop in props:
-                    if prop.id == card.id:
-                        prop.card_init.selected = card.selected
-                        prop.prop_info.border_color = card.border_color
-                        break
-            elif self._events[i].type == EventType.CARD_SPAWN:
-                card = Card.from_json(self._events[i].data)
-                props.append(card.prop())
-            elif self._events[i].type == EventType.CARD_SET:
-                data = json.loads(self._events[i].data)
-                cards_ids = set([int(card_dict["id"]) for card_dict in data["cards"]])
-                props = [prop for prop in props if prop.id not in cards_ids]
-        self._instructions = instructions
+        self._event_index = event_index
+        replay = self._integrated_replay(event_index)
+        self._instructions = replay.instructions
         # Now send messages updating the accumulated state to the client.
         # We send a state sync, an objectives message, and a prop update.
         for actor_id in self._message_queue:
             # Actor state.
             role = Role.LEADER if actor_id == self._leader_id else Role.FOLLOWER
             actor_state = state_sync.StateSync(
-                2, [actor.state() for actor in actors], actor_id, role
+                2, [actor.state() for actor in replay.actors], actor_id, role
             )
             self._message_queue[actor_id].append(
                 message_from_server.StateSyncFromServer(actor_state)
@@ -383,17 +363,83 @@ class ReplayState(object):
 
             # Prop state.
             self._message_queue[actor_id].append(
-                message_from_server.PropUpdateFromServer(PropUpdate(props))
+                message_from_server.PropUpdateFromServer(PropUpdate(replay.props))
             )
 
         # Log how long this took.
         end_time = datetime.utcnow()
-        logging.info("Rewind took {}".format(end_time - start_time))
+        logging.info("Seek took {}".format(end_time - start_time))
 
-        # Pause the game on rewind.
+        # Pause the game on seek.
         self._paused = True
         self._event_timer.pause()
 
+    def _integrate_event(self, replay: _IntegratedReplay, event: Event):
+        """Applies one event to the integrated replay state."""
+        self._update_instructions(replay.instructions, event)
+        if event.type == EventType.PROP_UPDATE:
+            replay.props = PropUpdate.from_json(event.data).props
+        elif event.type == EventType.INITIAL_STATE:
+            initial_state_obj = InitialState.from_json(event.data)
+            leader = actor.Actor(
+                initial_state_obj.leader_id,
+                AssetId.PLAYER,
+                Role.LEADER,
+                initial_state_obj.leader_position,
+                False,
+                initial_state_obj.leader_rotation_degrees,
+            )
+            follower = actor.Actor(
+                initial_state_obj.follower_id,
+                AssetId.FOLLOWER_BOT,
+                Role.FOLLOWER,
+                initial_state_obj.follower_position,
+                False,
+                initial_state_obj.follower_rotation_degrees,
+            )
+            replay.actors = [leader, follower]
+        elif event.type == EventType.ACTION:
+            action = Action.from_json(event.data)
+            for agent in replay.actors:
+                if agent.actor_id() == action.id:
+                    agent.add_action(action)
+                    agent.step()
+                    break
+        elif event.type == EventType.CARD_SELECT:
+            card = Card.from_json(event.data)
+            for prop in replay.props:
+                if prop.id == card.id:
+                    prop.card_init.selected = card.selected
+                    prop.prop_info.border_color = card.border_color
+                    break
+        elif event.type == EventType.CARD_SPAWN:
+            card = Card.from_json(event.data)
+            replay.props.append(card.prop())
+        elif event.type == EventType.CARD_SET:
+            data = json.loads(event.data)
+            cards_ids = set([int(card_dict["id"]) for card_dict in data["cards"]])
+            replay.props = [prop for prop in replay.props if prop.id not in cards_ids]
+
+    def _integrated_replay(self, event_index: int) -> _IntegratedReplay:
+        """Returns the actor, instruction and prop state after the first event_index events.
+
+        Starts from the nearest keyframe at or before event_index. Keyframes
+        are saved every self._keyframe_interval events as they're passed, so
+        seeking anywhere costs at most one interval of events.
+        """
+        keyframe_index = event_index - event_index % self._keyframe_interval
+        while keyframe_index > 0 and keyframe_index not in self._keyframes:
+            keyframe_index -= self._keyframe_interval
+        keyframe = self._keyframes.get(keyframe_index, None)
+        replay = (
+            copy.deepcopy(keyframe) if keyframe is not None else _IntegratedReplay()
+        )
+        for i in range(keyframe_index, event_index):
+            self._integrate_event(replay, self._events[i])
+            if (i + 1) % self._keyframe_interval == 0:
+                self._keyframes[i + 1] = copy.deepcopy(replay)
+        return replay
+
     def prime_replay(self):
         """The first few events contain the map and initial state. Until these load, the display will be blank. Call this method after a reset() to skip to these so that they are displayed immediately."""
         map_event_index = -1
@@ -446,6 +492,7 @@ class ReplayState(object):
                 .where(Event.game_id == self._game_record.id)
                 .order_by(Event.server_time)
             )
+            self._keyframes = {}
             self.reset()
             logger.info(f"Found {len(self._events)} events.")
             turn_states = [
@@ -558,6 +605,10 @@ class ReplayState(object):
             for actor_id in self._message_queue:
                 self._message_queue[actor_id].append(message)
 
+    def seconds_until_deadline(self):
+        """Used by StateMachineDriver's tick scheduler. Always 0, as this state machine is polled every tick."""
+        return 0
+
     def on_game_over(self):
         logger.info(f"Game {self._room_id} is over.")
 
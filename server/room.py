@@ -13,6 +13,7 @@ import server.schemas.clients as clients_db
 import server.schemas.mturk as mturk_db
 from server.config.config import GlobalConfig
 from server.lobby_consts import IsGoogleLobby, IsMturkLobby
+from server.messages import message_from_server
 from server.messages.logs import (
     LogEntryFromIncomingMessage,
     LogEntryFromOutgoingMessage,
@@ -106,8 +107,12 @@ class Room(object):
             game_state = None
             logger.error(f"Room started with invalid type {self._room_type}.")
             return
+        server_config = GlobalConfig()
+        tick_rate_hz = (
+            server_config.state_machine_tick_rate_hz if server_config is not None else 0
+        )
         self._state_machine_driver = StateMachineDriver(
-            game_state, self._id, self._lobby
+            game_state, self._id, self._lobby, tick_rate_hz
         )
         if self._room_type not in [RoomType.PRESET_GAME, RoomType.REPLAY]:
             self._game_record.save()
@@ -215,6 +220,9 @@ class Room(object):
             logger.warn(f"Starting room without remote IP/Port/Google information.")
         self._players.append(id)
         self._player_endpoints.append(ws)
+        # Wake the socket's transmit loop whenever the game has output for it.
+        self._state_machine_driver.register_wakeup(id, self._lobby.socket_wakeup(ws))
+        self._state_machine_driver.wake()
         return id
 
     def remove_player(self, id, ws, disconnected=False):
@@ -227,9 +235,11 @@ class Room(object):
         self._players.remove(id)
         if ws in self._player_endpoints:
             self._player_endpoints.remove(ws)
+        self._state_machine_driver.unregister_wakeup(id)
         self._state_machine_driver.state_machine().free_actor(id)
         if disconnected:
             self._state_machine_driver.state_machine().mark_player_disconnected(id)
+        self._state_machine_driver.wake()
 
     def player_endpoints(self):
         return self._player_endpoints
@@ -283,6 +293,7 @@ class Room(object):
 
     def set_scenario(self, scenario: Scenario):
         self._state_machine_driver.state_machine().set_scenario(scenario)
+        self._state_machine_driver.wake()
 
     def done(self):
         if not self._initialized:
@@ -297,9 +308,11 @@ class Room(object):
 
     def desync(self, id):
         self._state_machine_driver.state_machine().desync(id)
+        self._state_machine_driver.wake()
 
     def desync_all(self):
         self._state_machine_driver.state_machine().desync_all()
+        self._state_machine_driver.wake()
 
     def is_full(self):
         """Returns True if the room is full."""
@@ -343,10 +356,8 @@ class Room(object):
 
         for message in messages:
             try:
-                log_bytes = orjson.dumps(
-                    LogEntryFromOutgoingMessage(player_id, message),
-                    option=orjson.OPT_NAIVE_UTC | orjson.OPT_PASSTHROUGH_DATETIME,
-                    default=datetime.isoformat,
+                log_bytes = message_from_server.SerializeMessage(
+                    message, lambda m: LogEntryFromOutgoingMessage(player_id, m)
                 ).decode("utf-8")
                 self._messages_from_server_log.write(log_bytes + "\n")
             except TypeError:
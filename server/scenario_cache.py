@@ -0,0 +1,211 @@
+""" A cache of scenarios reconstructed from recorded games.
+
+scenario_util.ReconstructScenarioFromEvent() queries every earlier event in a
+game and replays it, which is slow when eval or training launches the same
+instructions over and over. ScenarioCache keeps reconstructed scenarios in an
+in-memory LRU, backed by an optional sqlite file (separate from the game
+database, like server/map_store.py) so they survive restarts.
+
+Entries are keyed by event UUID and database version. Recorded events never
+change, so the default version is just the game database's path. Pass a
+different db_version after replacing or migrating the database.
+
+Example:
+```
+    cache = ScenarioCache(config.scenario_cache_path())
+    cache.precompute(event_uuids)
+    coordinator = LocalGameCoordinator(config, scenario_cache=cache)
+```
+"""
+
+import logging
+import uuid
+import zlib
+from collections import OrderedDict
+from typing import Iterable, Optional, Tuple
+
+from peewee import (
+    BlobField,
+    CharField,
+    CompositeKey,
+    IntegerField,
+    Model,
+    SqliteDatabase,
+)
+
+import server.scenario_util as scenario_util
+from server.messages.scenario import Scenario
+from server.schemas import base
+
+logger = logging.getLogger(__name__)
+
+# Bump this whenever the serialized scenario format or the reconstruction
+# logic changes. Scenarios stored with a different version are deleted when
+# the cache is opened.
+SCENARIO_CACHE_FORMAT_VERSION = 1
+
+scenario_cache_database = SqliteDatabase(None)
+
+
+class StoredScenario(Model):
+    event_uuid = CharField()
+    db_version = CharField()
+    format_version = IntegerField()
+    data = BlobField()
+
+    class Meta:
+        database = scenario_cache_database
+        primary_key = CompositeKey("event_uuid", "db_version")
+
+
+def DatabaseVersion() -> str:
+    """Returns the default db_version: the path of the current game database."""
+    return str(base.GetDatabase().database)
+
+
+def _Key(event_uuid) -> str:
+    # Callers pass UUIDs with and without dashes, or UUID objects.
+    try:
+        return uuid.UUID(str(event_uuid)).hex
+    except ValueError:
+        return str(event_uuid)
+
+
+class ScenarioCache(object):
+    # precompute() writes scenarios to disk in transactions of this size.
+    _STORE_CHUNK_SIZE = 256
+
+    def __init__(self, path: str = None, capacity: int = 1024, db_version: str = None):
+        """Creates a scenario cache.
+
+        Args:
+            path: sqlite file to persist scenarios in. If None, scenarios are
+                only cached in memory.
+            capacity: Number of scenarios to keep in memory.
+            db_version: Identifies the game database. Defaults to DatabaseVersion().
+        """
+        self._capacity = capacity
+        self._db_version = db_version if db_version is not None else DatabaseVersion()
+        # Maps from event UUID -> serialized scenario, oldest first.
+        self._scenarios = OrderedDict()
+        self._stats = {"hits": 0, "disk_hits": 0, "misses": 0}
+        self._persistent = path is not None
+        if not self._persistent:
+            return
+        scenario_cache_database.init(
+            path,
+            pragmas=[
+                ("journal_mode", "wal"),
+                # Other processes may be holding the write lock.
+                ("busy_timeout", 5000),
+            ],
+        )
+        scenario_cache_database.connect(reuse_if_open=True)
+        scenario_cache_database.create_tables([StoredScenario], safe=True)
+        stale = (
+            StoredScenario.delete()
+            .where(StoredScenario.format_version != SCENARIO_CACHE_FORMAT_VERSION)
+            .execute()
+        )
+        if stale > 0:
+            logger.info(f"Deleted {stale} scenarios with an outdated format.")
+
+    def get(self, event_uuid) -> Tuple[Optional[Scenario], Optional[str]]:
+        """Returns the scenario at the given event.
+
+        Same return value as scenario_util.ReconstructScenarioFromEvent().
+        Each call returns a new Scenario object, so callers may modify it.
+        """
+        key = _Key(event_uuid)
+        data = self._scenarios.get(key, None)
+        if data is not None:
+            self._scenarios.move_to_end(key)
+            self._stats["hits"] += 1
+            return Scenario.from_json(data), None
+        data = self._load(key)
+        if data is not None:
+            self._stats["disk_hits"] += 1
+            self._remember(key, data)
+            return Scenario.from_json(data), None
+        self._stats["misses"] += 1
+        scenario, err = scenario_util.ReconstructScenarioFromEvent(key)
+        if scenario is None:
+            return None, err
+        data = scenario.to_json().encode("utf-8")
+        self._remember(key, data)
+        self._store([(key, data)])
+        return scenario, None
+
+    def precompute(self, event_uuids: Iterable) -> int:
+        """Reconstructs and stores any of the given scenarios which aren't cached.
+
+        Scenarios are written to disk in transactions of _STORE_CHUNK_SIZE, so
+        an interrupted run keeps most of its work. Scenarios which can't be
+        reconstructed are logged and skipped. Returns the number of scenarios
+        reconstructed.
+        """
+        keys = set(_Key(event_uuid) for event_uuid in event_uuids)
+        keys -= self._stored_keys()
+        new_scenarios = []
+        stored = 0
+        for key in keys:
+            if key in self._scenarios:
+                new_scenarios.append((key, self._scenarios[key]))
+            else:
+                scenario, err = scenario_util.ReconstructScenarioFromEvent(key)
+                if scenario is None:
+                    logger.warning(f"Skipping scenario {key}: {err}")
+                    continue
+                data = scenario.to_json().encode("utf-8")
+                self._remember(key, data)
+                new_scenarios.append((key, data))
+            if len(new_scenarios) >= self._STORE_CHUNK_SIZE:
+                self._store(new_scenarios)
+                stored += len(new_scenarios)
+                new_scenarios = []
+        self._store(new_scenarios)
+        return stored + len(new_scenarios)
+
+    def stats(self):
+        return dict(self._stats, size=len(self._scenarios))
+
+    def close(self):
+        if self._persistent:
+            scenario_cache_database.close()
+
+    def _remember(self, key, data):
+        self._scenarios[key] = data
+        self._scenarios.move_to_end(key)
+        while len(self._scenarios) > self._capacity:
+            self._scenarios.popitem(last=False)
+
+    def _load(self, key):
+        if not self._persistent:
+            return None
+        stored_scenario = StoredScenario.get_or_none(
+            (StoredScenario.event_uuid == key)
+            & (StoredScenario.db_version == self._db_version)
+        )
+        if stored_scenario is None:
+            return None
+        return zlib.decompress(stored_scenario.data)
+
+    def _stored_keys(self):
+        if not self._persistent:
+            return set(self._scenarios.keys())
+        query = StoredScenario.select(StoredScenario.event_uuid).where(
+            StoredScenario.db_version == self._db_version
+        )
+        return set(stored_scenario.event_uuid for stored_scenario in query)
+
+    def _store(self, scenarios):
+        if not self._persistent or len(scenarios) == 0:
+            return
+        with scenario_cache_database.atomic():
+            for key, data in scenarios:
+                StoredScenario.replace(
+                    event_uuid=key,
+                    db_version=self._db_version,
+                    format_version=SCENARIO_CACHE_FORMAT_VERSION,
+                    data=zlib.compress(data),
+                ).execute()
@@ -117,6 +117,9 @@ class ScenarioState(object):
     def update(self):
         self._state.update()
 
+    def seconds_until_deadline(self):
+        return self._state.seconds_until_deadline()
+
     def _find_player_of_role(self, role: Role):
         for player_id in self._state.player_ids():
             if self._state.player_role(player_id) == role:
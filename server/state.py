@@ -1,14 +1,16 @@
+import copy
 import dataclasses
 import logging
 import math
-import queue
+import random
 import uuid
 from collections import deque
-from datetime import datetime, timedelta
-from queue import Queue
-from typing import List
+from dataclasses import dataclass
+from datetime import timedelta
+from typing import List, Optional, Tuple
 
 import humanhash
+import numpy as np
 
 import server.config.config as config
 import server.google_experience as google_experience
@@ -30,12 +32,14 @@ from server.messages import (
 )
 from server.messages.action import ActionType, Color
 from server.messages.feedback_questions import FeedbackResponse
-from server.messages.prop import PropUpdate
+from server.messages.map_update import MapUpdate
+from server.messages.objective import ObjectiveMessage
+from server.messages.prop import Prop, PropUpdate
 from server.messages.rooms import Role
 from server.messages.scenario import Scenario, ScenarioResponse, ScenarioResponseType
 from server.messages.sound_trigger import SoundClipType, SoundTrigger
 from server.messages.state_sync import StateMachineTick
-from server.messages.turn_state import GameOverMessage, TurnUpdate
+from server.messages.turn_state import GameOverMessage, TurnState, TurnUpdate
 from server.state_utils import (
     FOLLOWER_FEEDBACK_QUESTIONS,
     FOLLOWER_MOVES_PER_TURN,
@@ -46,11 +50,46 @@ from server.state_utils import (
     turn_reward,
 )
 from server.username_word_list import USERNAME_WORDLIST
-from server.util import CountDownTimer, JsonSerialize
+from server.util import CountDownTimer, JsonSerialize, WallClock
 
 logger = logging.getLogger(__name__)
 
 
+@dataclass(frozen=True)
+class StateSnapshot:
+    """The game as one player currently sees it. See State.snapshot().
+
+    Contains the same information a client would have after handling all of
+    its pending messages. The map, props and instructions are shared with the
+    state machine, so don't modify them.
+    """
+
+    map_update: MapUpdate
+    props: List[Prop]
+    turn_state: TurnState
+    instructions: List[ObjectiveMessage]
+    actors: List[state_sync.Actor]
+
+
+@dataclass(frozen=True)
+class StateCheckpoint:
+    """A copy of a game and of the global RNGs. See State.checkpoint().
+
+    Call restore() once per branch. Each call returns a new, independent
+    State, and resets the RNGs so that every branch sees the same random
+    card draws and spawn points.
+    """
+
+    state: "State"
+    random_state: tuple
+    numpy_random_state: tuple
+
+    def restore(self, room_id: str = None) -> "State":
+        random.setstate(self.random_state)
+        np.random.set_state(self.numpy_random_state)
+        return self.state.fork(room_id)
+
+
 # The Cerealbar2 State Machine. This is the state machine that is used to drive the game.
 # This class contains methods to consume and produce messages from/for the state machine. It also contains a state machine update loop.
 # Produce messages and send them to the state machine with drain_messages().
@@ -68,6 +107,8 @@ class State(object):
         realtime_actions: bool = False,
         lobby: "server.Lobby" = None,
         log_to_db: bool = False,
+        clock: WallClock = None,
+        scenario_cache: "server.scenario_cache.ScenarioCache" = None,
     ):
         """Initialize the game from a given event.
 
@@ -78,8 +119,14 @@ class State(object):
         Returns: (state_machine: State, failure_reason: str = "")
 
         If return value state_machine is none, the reason for failure is in failure_reason.
+
+        If scenario_cache is given, the scenario is looked up there instead of
+        being reconstructed from the database each time.
         """
-        scenario, err = scenario_util.ReconstructScenarioFromEvent(event_uuid)
+        if scenario_cache is not None:
+            scenario, err = scenario_cache.get(event_uuid)
+        else:
+            scenario, err = scenario_util.ReconstructScenarioFromEvent(event_uuid)
         assert scenario is not None, f"Failed to reconstruct scenario: {err}"
         s = State(
             room_id,
@@ -89,6 +136,7 @@ class State(object):
             realtime_actions=realtime_actions,
             log_to_db=log_to_db,
             lobby=lobby,
+            clock=clock,
         )
         return s, ""
 
@@ -101,6 +149,7 @@ class State(object):
         log_to_db: bool = True,
         realtime_actions: bool = False,
         lobby: "server.Lobby" = None,
+        clock: WallClock = None,
     ):
         """Initialize the game state.
 
@@ -114,8 +163,11 @@ class State(object):
             scenario (Scenario): Preset data. See server/messages/scenario.py.
             log_to_db (bool): If true, log game events to the database.
             realtime_actions (bool): Enables realtime actions. See server/actor.py.
+            clock (WallClock): Source of game time. Defaults to the wall clock.
+                Pass a VirtualClock to simulate games faster than real time.
         """
-        self._start_time = datetime.utcnow()
+        self._clock = clock if clock is not None else WallClock()
+        self._start_time = self._clock.utcnow()
         self._room_id = room_id
         self._lobby = lobby
 
@@ -165,6 +217,9 @@ class State(object):
 
         self._ticks = {}  # Maps from player_id -> tick message.
 
+        # Props as returned by snapshot(). Rebuilt when the cards change.
+        self._snapshot_props = None
+
         self._synced = {}
         self._action_history = {}
         self._turn_history = {}
@@ -183,7 +238,7 @@ class State(object):
         # We need to add a delay to the end of the follower's turn. So instead of ending the
         # turn immediately, we start the follower turn delay timer. When the timer reachers
         self._follower_turn_end_timer = CountDownTimer(
-            duration_s=FOLLOWER_TURN_END_DELAY_SECONDS
+            duration_s=FOLLOWER_TURN_END_DELAY_SECONDS, clock=self._clock
         )
         self._follower_turn_end_reason = ""
 
@@ -205,8 +260,8 @@ class State(object):
                 Role.LEADER,
                 LEADER_MOVES_PER_TURN,
                 6,
-                datetime.utcnow() + State.turn_duration(Role.LEADER),
-                datetime.utcnow(),
+                self._clock.utcnow() + State.turn_duration(Role.LEADER),
+                self._clock.utcnow(),
                 0,
                 0,
                 0,
@@ -232,9 +287,37 @@ class State(object):
         # Maps from player_id -> list of feedback questions that have not been answered.
         self._unanswered_feedback_question = {}
 
+    def clock(self):
+        return self._clock
+
+    def fork(self, room_id: str = None) -> "State":
+        """Returns an independent copy of this game, for branching rollouts.
+
+        Actors, cards, turn state, instructions and pending messages are
+        copied. The map and the lobby are shared, since they don't change
+        during a game. Forks are never recorded to the database.
+
+        This is much cheaper than reconstructing the game with
+        InitializeFromExistingState(). The global RNGs aren't copied. Use
+        checkpoint() if branches need to replay the same random events.
+        """
+        memo = {
+            id(self._lobby): self._lobby,
+            id(self._map_update): self._map_update,
+            id(self._game_recorder): GameRecorder(None, disabled=True),
+        }
+        forked = copy.deepcopy(self, memo)
+        if room_id is not None:
+            forked._room_id = room_id
+        return forked
+
+    def checkpoint(self) -> StateCheckpoint:
+        """Returns a fork of this game along with the current RNG state."""
+        return StateCheckpoint(self.fork(), random.getstate(), np.random.get_state())
+
     def game_time(self):
         """Return timedelta between now and when the game started."""
-        return datetime.utcnow() - self._start_time
+        return self._clock.utcnow() - self._start_time
 
     @staticmethod
     def turn_duration(role):
@@ -251,6 +334,9 @@ class State(object):
     def _announce_action(self, action):
         # Marks an action as validated (i.e. it did not conflict with other actions).
         # Queues this action to be sent to each user.
+        if action.id not in self._actors:
+            # A card was selected, recolored or removed.
+            self._snapshot_props = None
         for id in self._actors:
             actor = self._actors[id]
             self._action_history[actor.actor_id()].append(action)
@@ -284,7 +370,7 @@ class State(object):
         return self._actors[id].role()
 
     def start(self):
-        self._start_time = datetime.utcnow()
+        self._start_time = self._clock.utcnow()
 
     def _self_initialize(self):
         """This exists for scenario_state and other "private" clients to skip the player join initializing process."""
@@ -304,6 +390,7 @@ class State(object):
         logger.debug(f"Game initialized.")
 
     def update(self):
+        self._clock.step()
         send_tick = False
 
         if not self._initialized:
@@ -335,7 +422,7 @@ class State(object):
             logger.debug(f"New actors added.")
             send_tick = True
 
-        if datetime.utcnow() >= self._turn_state.turn_end:
+        if self._clock.utcnow() >= self._turn_state.turn_end:
             self._update_turn(end_reason="RanOutOfTime")
             logger.debug(f"Turn timed out.")
             send_tick = True
@@ -581,6 +668,7 @@ class State(object):
             # We've changed cards, so we need to mark the map as stale for all players.
             self._prop_update = self._map_provider.prop_update()
             self._prop_update = map_utils.CensorCards(self._prop_update, None)
+            self._snapshot_props = None
             self._send_state_machine_info = True
             for actor_id in self._actors:
                 self._prop_stale[actor_id] = True
@@ -622,6 +710,38 @@ class State(object):
             for id in self._actors:
                 self._ticks[id] = tick_message
 
+    def seconds_until_deadline(self):
+        """How long update() can be put off before a time-dependent state change.
+
+        Used by StateMachineDriver's tick scheduler. Returns 0 if there's
+        pending work (queued actions, turn completions, etc), or None if the
+        state machine is idle until new input arrives.
+        """
+        if self._done:
+            return 0
+        if not self._initialized:
+            # Waiting for players to join.
+            return None
+        if (
+            self._instruction_added
+            or self._actors_added
+            or len(self._turn_complete_queue) > 0
+            or len(self._instruction_complete_queue) > 0
+            or len(self._live_feedback_queue) > 0
+            or any(self._scenario_download_pending.values())
+        ):
+            return 0
+        for actor in self._actors.values():
+            # Realtime actions must be polled until their animation completes.
+            if actor.has_actions():
+                return 0
+        deadlines = [(self._turn_state.turn_end - self._clock.utcnow()).total_seconds()]
+        if self._follower_turn_end_timer.running():
+            deadlines.append(
+                self._follower_turn_end_timer.time_remaining().total_seconds()
+            )
+        return max(min(deadlines), 0)
+
     def tick_count(self):
         """State machine event tick count.
 
@@ -674,7 +794,7 @@ class State(object):
             Role.LEADER if self._turn_state.turn == Role.FOLLOWER else Role.FOLLOWER
         )
         role_switch = (
-            datetime.utcnow() >= self._turn_state.turn_end
+            self._clock.utcnow() >= self._turn_state.turn_end
         ) or force_role_switch
         next_role = self._turn_state.turn
         if role_switch:
@@ -686,7 +806,7 @@ class State(object):
                 for question in FOLLOWER_FEEDBACK_QUESTIONS:
                     question.uuid = uuid.uuid4()
                     question.transmit_time_s = (
-                        datetime.utcnow() - self._turn_state.game_start
+                        self._clock.utcnow() - self._turn_state.game_start
                     ).total_seconds()
                     self._feedback_questions[self._follower.actor_id()].append(question)
                     self._unanswered_feedback_question[
@@ -716,9 +836,10 @@ class State(object):
             for actor_id in self._actors:
                 self._prop_stale[actor_id] = True
             self._prop_update = map_utils.CensorCards(self._prop_update, None)
+            self._snapshot_props = None
             end_of_turn = next_role == Role.LEADER
             moves_remaining = self._moves_per_turn(next_role)
-            turn_end = datetime.utcnow() + State.turn_duration(next_role)
+            turn_end = self._clock.utcnow() + State.turn_duration(next_role)
             if end_of_turn:
                 turns_left -= 1
                 turn_number += 1
@@ -1081,7 +1202,7 @@ class State(object):
                 return True
             if self._instructions_stale.get(actor_id, False):
                 return True
-            if not self._turn_history.get(actor_id, Queue()).empty():
+            if len(self._turn_history.get(actor_id, ())) > 0:
                 return True
         return False
 
@@ -1233,7 +1354,9 @@ class State(object):
 
         # Send the latest objective list and mark as fresh for this player.
         self._instructions_stale[actor_id] = False
+        return self._visible_instructions(actor_id)
 
+    def _visible_instructions(self, actor_id):
         # For Leaders/Spectators it's simple, send the current objective list.
         if self._actors[actor_id].role() in [Role.LEADER, Role.SPECTATOR]:
             return list(self._instruction_history) + list(self._instructions)
@@ -1321,6 +1444,52 @@ class State(object):
         role = self._actors[actor_id].role() if actor_id >= 0 else Role.NONE
         return state_sync.StateSync(len(self._actors), actor_states, actor_id, role)
 
+    def snapshot(self, actor_id) -> StateSnapshot:
+        """Returns the game as actor_id currently sees it.
+
+        This is a read-only alternative to fill_messages() for clients in the
+        same process (see py_client/direct_game_endpoint.py). Nothing is
+        marked as sent, so it can be called any number of times.
+        """
+        map_update = self._map_update
+        if self._actors[actor_id].role() == Role.FOLLOWER:
+            map_update = map_utils.CensorMapForFollower(
+                map_update, self._actors[actor_id]
+            )
+        if self._snapshot_props is None:
+            self._snapshot_props = map_utils.CensorCards(
+                self._map_provider.prop_update(), None
+            ).props
+        return StateSnapshot(
+            map_update,
+            self._snapshot_props,
+            dataclasses.replace(self._turn_state),
+            self._visible_instructions(actor_id),
+            [actor.state() for actor in self._actors.values()],
+        )
+
+    def take_events(
+        self, actor_id
+    ) -> Tuple[Optional[StateMachineTick], Optional[live_feedback.LiveFeedback]]:
+        """Consumes all pending messages for actor_id without building them.
+
+        For clients which read the game with snapshot() instead of
+        fill_messages(). The snapshot already reflects every pending state
+        change, so only the events which aren't part of the game state are
+        returned: the pending tick and live feedback (either may be None).
+        Sound triggers and scenario downloads are dropped.
+        """
+        self._action_history[actor_id] = []
+        self._map_stale[actor_id] = False
+        self._prop_stale[actor_id] = False
+        self._synced[actor_id] = True
+        self._instructions_stale[actor_id] = False
+        while self._next_turn_state(actor_id) is not None:
+            pass
+        self._sound_trigger_messages.pop(actor_id, None)
+        self._scenario_download.pop(actor_id, None)
+        return self._next_tick(actor_id), self._next_live_feedback(actor_id)
+
     # Returns the current state of the game.
     # Calling this message comes with the assumption that the response will be transmitted to the clients.
     # Once this function returns, the clients are marked as synchronized.
@@ -1433,6 +1602,7 @@ class State(object):
         self._map_update = self._map_provider.map()
         self._prop_update = self._map_provider.prop_update()
         self._prop_update = map_utils.CensorCards(self._prop_update, None)
+        self._snapshot_props = None
         # Load in instructions.
         self._instructions = deque(scenario.objectives)
         # Load in actor states.
@@ -1519,22 +1689,20 @@ class State(object):
         self._turn_state = turn_state
         for actor_id in self._actors:
             if not actor_id in self._turn_history:
-                self._turn_history[actor_id] = Queue()
-            self._turn_history[actor_id].put(dataclasses.replace(turn_state))
+                self._turn_history[actor_id] = deque()
+            self._turn_history[actor_id].append(dataclasses.replace(turn_state))
 
     def _resend_turn_state(self):
         if self._turn_state is None:
             return
         for actor_id in self._actors:
             if not actor_id in self._turn_history:
-                self._turn_history[actor_id] = Queue()
-            self._turn_history[actor_id].put(dataclasses.replace(self._turn_state))
+                self._turn_history[actor_id] = deque()
+            self._turn_history[actor_id].append(dataclasses.replace(self._turn_state))
 
     def _next_turn_state(self, actor_id):
         if not actor_id in self._turn_history:
-            self._turn_history[actor_id] = Queue()
-        try:
-            turn = self._turn_history[actor_id].get_nowait()
-            return turn
-        except queue.Empty:
+            self._turn_history[actor_id] = deque()
+        if len(self._turn_history[actor_id]) == 0:
             return None
+        return self._turn_history[actor_id].popleft()
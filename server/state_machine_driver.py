@@ -8,15 +8,24 @@ from server.util import exc_info_plus
 
 logger = logging.getLogger(__name__)
 
+# When ticking at a fixed rate, an idle room still wakes up at least this often.
+# This is a safety net for state changes that don't come in as messages.
+MAX_IDLE_SLEEP_S = 1.0
+
 
 class StateMachineDriver(object):
     """
     StateMachineDriver is a class that is responsible for managing the game state machine
     """
 
-    def __init__(self, state_machine, room_id, lobby=None):
+    def __init__(self, state_machine, room_id, lobby=None, tick_rate_hz: float = 0):
         """
         Initializes the state machine driver.
+
+        If tick_rate_hz is 0, run() steps the state machine as fast as the
+        event loop allows. Otherwise, run() steps at most tick_rate_hz times
+        per second, sleeping until a message arrives or the state machine's
+        next deadline (see seconds_until_deadline() in state.py).
         """
         self._state_machine = state_machine
 
@@ -28,6 +37,15 @@ class StateMachineDriver(object):
         self._messages_out = {}  # Player ID -> Queue() of messages
         # Linear message input. As network packets come in, they are placed in a queue for processing.
         self._messages_in = Queue()  # Queue() of (player_id, message) tuples
+        # Optional wakeup signals. Set whenever new messages are queued for a
+        # player, so that consumers can sleep instead of polling fill_messages().
+        self._wakeup_events = {}  # Player ID -> asyncio.Event
+
+        # Tick scheduling. See run().
+        self._tick_period_s = 1.0 / tick_rate_hz if tick_rate_hz > 0 else 0
+        self._last_step_time = 0
+        # Set when input arrives, to wake the room before its next deadline.
+        self._input_event = asyncio.Event()
 
         self._exception = None
         self._traceback = None
@@ -35,9 +53,31 @@ class StateMachineDriver(object):
     def state_machine(self):
         return self._state_machine
 
+    def register_wakeup(self, player_id, event: asyncio.Event):
+        """Registers an event which is set whenever messages are queued for player_id."""
+        self._wakeup_events[player_id] = event
+        # Messages may already be pending.
+        if (
+            player_id in self._messages_out
+            and not self._messages_out[player_id].empty()
+        ):
+            event.set()
+
+    def unregister_wakeup(self, player_id):
+        if player_id in self._wakeup_events:
+            del self._wakeup_events[player_id]
+
     def drain_messages(self, id, messages):
         for m in messages:
             self._messages_in.put((id, m))
+        self.wake()
+
+    def wake(self):
+        """Makes the run() loop step the state machine as soon as the tick rate allows.
+
+        Call this after modifying the state machine directly (adding players, etc).
+        """
+        self._input_event.set()
 
     def fill_messages(self, player_id, out_messages):
         """Fills out_messages with MessageFromServer objects to send to the
@@ -67,6 +107,7 @@ class StateMachineDriver(object):
             self._state_machine.start()  # Initialize the state machine.
             while not self._state_machine.done():
                 # Run one iteration of the game loop.
+                self._last_step_time = time.time()
                 self.step()
                 poll_period = time.time() - last_loop
                 if (poll_period) > 0.2:
@@ -76,7 +117,12 @@ class StateMachineDriver(object):
                     if latency_monitor:
                         latency_monitor.accumulate_latency(poll_period)
                 last_loop = time.time()
-                await asyncio.sleep(0)
+                if self._tick_period_s > 0:
+                    # Don't count time deliberately spent asleep as latency.
+                    lateness = await self._wait_for_next_tick()
+                    last_loop = time.time() - lateness
+                else:
+                    await asyncio.sleep(0)
             self._state_machine.on_game_over()
         except Exception as e:
             logger.exception(f"Error in game {self._room_id}: {e}")
@@ -84,6 +130,29 @@ class StateMachineDriver(object):
             self._traceback = exc_info_plus()
             self.end_game()
 
+    async def _wait_for_next_tick(self):
+        """Sleeps until the next scheduled step. Returns how late we woke up, in seconds.
+
+        The room wakes up at the state machine's next deadline, or earlier if
+        input arrives, but never sooner than one tick after the last step.
+        """
+        earliest = self._last_step_time + self._tick_period_s
+        delay = self._state_machine.seconds_until_deadline()
+        if delay is None:
+            # Nothing scheduled. Wait for input.
+            delay = MAX_IDLE_SLEEP_S
+        deadline = max(time.time() + min(delay, MAX_IDLE_SLEEP_S), earliest)
+        if earliest > time.time():
+            await asyncio.sleep(earliest - time.time())
+        remaining = deadline - time.time()
+        if remaining > 0 and not self._input_event.is_set():
+            try:
+                await asyncio.wait_for(self._input_event.wait(), remaining)
+            except asyncio.TimeoutError:
+                pass
+        self._input_event.clear()
+        return max(time.time() - deadline, 0)
+
     def step(self):
         self._process_incoming_messages()
         self._state_machine.update()
@@ -94,6 +163,7 @@ class StateMachineDriver(object):
 
     def end_game(self):
         self._state_machine.end_game()
+        self.wake()
 
     def exception(self):
         return self._exception
@@ -123,3 +193,5 @@ class StateMachineDriver(object):
             if self._state_machine.fill_messages(player_id, out_messages):
                 for message in out_messages:
                     self._messages_out[player_id].put(message)
+                if player_id in self._wakeup_events:
+                    self._wakeup_events[player_id].set()
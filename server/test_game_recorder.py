@@ -0,0 +1,108 @@
+"""Unit tests for the write-behind event writer."""
+import os
+import tempfile
+import unittest
+
+import peewee
+
+from server.game_recorder import EventWriter
+from server.schemas.base import (
+    CloseDatabase,
+    ConnectDatabase,
+    CreateTablesIfNotExists,
+    SetDatabaseByPath,
+)
+from server.schemas.defaults import ListDefaultTables
+from server.schemas.event import Event, EventOrigin, EventType
+from server.schemas.game import Game
+
+
+class EventWriterTest(unittest.TestCase):
+    def setUp(self):
+        # The writer uses its own connection, so an in-memory db won't work.
+        self.tempdir = tempfile.TemporaryDirectory()
+        SetDatabaseByPath(os.path.join(self.tempdir.name, "game_data.db"))
+        ConnectDatabase()
+        CreateTablesIfNotExists(ListDefaultTables())
+        self.game = Game.create(type="game")
+
+    def tearDown(self):
+        CloseDatabase()
+        self.tempdir.cleanup()
+
+    def make_event(self, tick, parent=None):
+        return Event(
+            game=self.game,
+            type=EventType.ACTION,
+            tick=tick,
+            origin=EventOrigin.SERVER,
+            parent_event=parent,
+        )
+
+    def test_flush_writes_pending_events(self):
+        writer = EventWriter(batch_size=1000, flush_interval_s=60)
+        parent = self.make_event(0)
+        writer.write(parent)
+        for tick in range(1, 120):
+            writer.write(self.make_event(tick, parent))
+        writer.flush()
+        self.assertEqual(Event.select().count(), 120)
+        child = Event.select().where(Event.tick == 5).get()
+        self.assertEqual(child.parent_event.id, parent.id)
+        writer.stop()
+
+    def test_stop_writes_pending_events(self):
+        writer = EventWriter(batch_size=1000, flush_interval_s=60)
+        for tick in range(10):
+            writer.write(self.make_event(tick))
+        writer.stop()
+        self.assertEqual(Event.select().count(), 10)
+
+    def test_bad_row_does_not_drop_batch(self):
+        writer = EventWriter(batch_size=1000, flush_interval_s=60)
+        duplicate = self.make_event(0)
+        writer.write(duplicate)
+        writer.flush()
+        for tick in range(1, 10):
+            writer.write(self.make_event(tick))
+        # Reusing a primary key fails the insert.
+        writer.write(duplicate)
+        writer.stop()
+        self.assertEqual(Event.select().count(), 10)
+
+    def test_retries_busy_database(self):
+        writer = FlakyEventWriter(failures=2)
+        for tick in range(10):
+            writer.write(self.make_event(tick))
+        writer.stop()
+        self.assertEqual(writer.failures, 0)
+        self.assertEqual(Event.select().count(), 10)
+
+    def test_flush_timeout(self):
+        writer = FlakyEventWriter(failures=3)
+        writer._RETRY_DELAY_S = 0.2
+        writer.write(self.make_event(0))
+        self.assertFalse(writer.flush(timeout_s=0.05))
+        self.assertTrue(writer.flush())
+        self.assertEqual(Event.select().count(), 1)
+        writer.stop()
+
+
+class FlakyEventWriter(EventWriter):
+    """Fails the first few inserts as if another process held the lock."""
+
+    _RETRY_DELAY_S = 0.01
+
+    def __init__(self, failures):
+        self.failures = failures
+        super().__init__(batch_size=1000, flush_interval_s=60)
+
+    def _insert_rows(self, rows):
+        if self.failures > 0:
+            self.failures -= 1
+            raise peewee.OperationalError("database is locked")
+        super()._insert_rows(rows)
+
+
+if __name__ == "__main__":
+    unittest.main()
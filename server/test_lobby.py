@@ -301,3 +301,17 @@ class FollowerPilotLobbyTest(unittest.TestCase):
             (leader, follower, _) = self.lobby.get_leader_follower_match()
             self.assertEqual(leader, leaders[11])
             self.assertEqual(follower, follower_after)
+
+    def test_join_wakes_socket(self):
+        """Queued lobby messages set the socket's wakeup event."""
+        leader_id = self.unique_worker_id()
+        self.register_mturk_leader(leader_id)
+        wakeup = self.lobby.socket_wakeup(leader_id)
+        self.assertFalse(wakeup.is_set())
+
+        self.lobby.handle_request(self.join_request(), leader_id)
+        self.assertTrue(wakeup.is_set())
+
+        wakeup.clear()
+        self.assertIsNotNone(self.most_recent_lobby_message(leader_id))
+        self.assertFalse(wakeup.is_set())
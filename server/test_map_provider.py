@@ -0,0 +1,101 @@
+import asyncio
+import os
+import sqlite3
+import tempfile
+import time
+import unittest
+
+import server.map_provider as map_provider
+from server.config.config import Config, SetGlobalConfig
+from server.map_store import MapStore
+
+
+class MapGenerationTaskTest(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.config = Config(
+            data_prefix=self.tempdir.name, map_cache_size=4, map_generation_workers=2
+        )
+        SetGlobalConfig(self.config)
+        map_provider.map_pool.clear()
+
+    def tearDown(self):
+        map_provider.map_pool.clear()
+        if map_provider.map_store is not None:
+            map_provider.map_store.close()
+            map_provider.map_store = None
+        self.tempdir.cleanup()
+
+    async def run_until(self, condition):
+        task = asyncio.create_task(map_provider.MapGenerationTask([], self.config))
+        while not condition():
+            await asyncio.sleep(0.05)
+        task.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await task
+
+    def test_workers_fill_pool(self):
+        fill_pool = self.run_until(
+            lambda: map_provider.MapPoolSize() == self.config.map_cache_size
+        )
+        asyncio.run(asyncio.wait_for(fill_pool, timeout=60))
+        self.assertEqual(map_provider.MapPoolSize(), 4)
+        self.assertEqual(map_provider.MapPoolStats()["size"], 4)
+        # Each worker must be seeded differently.
+        maps = [provider.map().tiles for provider in map_provider.map_pool]
+        for i in range(len(maps)):
+            for j in range(i + 1, len(maps)):
+                self.assertNotEqual(maps[i], maps[j])
+
+    def test_pool_loads_from_store(self):
+        self.config.map_store_size = 3
+        fill_store = self.run_until(
+            lambda: map_provider.map_store is not None
+            and map_provider.map_store.size() == 3
+        )
+        asyncio.run(asyncio.wait_for(fill_store, timeout=60))
+
+        # Simulate a restart: the in-memory pool is empty, but the store isn't.
+        map_provider.map_pool.clear()
+        map_provider.map_store.close()
+        map_provider.map_store = MapStore(self.config.map_store_path())
+        misses = map_provider.MapPoolStats()["misses"]
+        stored_map = map_provider.CachedMapRetrieval()
+        self.assertIsInstance(stored_map, map_provider.MapProvider)
+        self.assertEqual(map_provider.map_store.size(), 2)
+        self.assertEqual(map_provider.MapPoolStats()["misses"], misses)
+
+
+class MapStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tempdir.name, "map_store.db")
+        self.store = MapStore(self.path)
+
+    def tearDown(self):
+        self.store.close()
+        self.tempdir.cleanup()
+
+    def test_pop_in_order(self):
+        self.store.put(b"first")
+        self.store.put(b"second")
+        self.assertEqual(self.store.size(), 2)
+        self.assertEqual(self.store.pop(), b"first")
+        self.assertEqual(self.store.pop(), b"second")
+        self.assertIsNone(self.store.pop())
+
+    def test_pop_without_waiting(self):
+        self.store.put(b"first")
+        # Another server process holds the write lock.
+        other_process = sqlite3.connect(self.path, isolation_level=None)
+        other_process.execute("BEGIN IMMEDIATE")
+        start = time.monotonic()
+        self.assertIsNone(self.store.pop(wait=False))
+        self.assertLess(time.monotonic() - start, 1)
+        other_process.execute("COMMIT")
+        other_process.close()
+        self.assertEqual(self.store.pop(wait=False), b"first")
+
+
+if __name__ == "__main__":
+    unittest.main()
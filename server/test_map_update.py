@@ -0,0 +1,69 @@
+"""Unit tests for MapUpdate tile lookups."""
+import pickle
+import unittest
+
+from server.assets import AssetId
+from server.hex import HecsCoord, HexBoundary, HexCell
+from server.messages.map_update import MapUpdate, Tile
+
+
+def _Tile(r, c, edges=0):
+    cell = HexCell(HecsCoord.from_offset(r, c), HexBoundary(edges), 0.5, 1)
+    return Tile(AssetId.GROUND_TILE, cell, 60)
+
+
+class MapUpdateTest(unittest.TestCase):
+    def setUp(self):
+        # A 3x4 map missing the tile at (2, 3).
+        self.map = MapUpdate(
+            3, 4, [_Tile(r, c) for r in range(3) for c in range(4) if (r, c) != (2, 3)]
+        )
+
+    def test_tile_at(self):
+        for tile in self.map.tiles:
+            self.assertIs(self.map.tile_at(tile.cell.coord), tile)
+            self.assertIs(
+                self.map.tile_at_offset(*tile.cell.coord.to_offset_coordinates()), tile
+            )
+        self.assertIsNone(self.map.tile_at_offset(2, 3))
+        self.assertIsNone(self.map.tile_at_offset(-1, 0))
+        self.assertIsNone(self.map.tile_at_offset(0, 4))
+
+    def test_grid(self):
+        grid = self.map.grid()
+        self.assertEqual(grid.shape, (3, 4))
+        self.assertEqual(grid[1, 2].tolist(), (AssetId.GROUND_TILE, 0, 0.5, 1, 60))
+        self.assertEqual(grid[2, 3].tolist(), (AssetId.NONE, -1, 0, 0, 0))
+
+    def test_edge_between(self):
+        a = HecsCoord.from_offset(1, 1)
+        b = a.right()
+        self.assertFalse(self.map.get_edge_between(a, b))
+        # An edge on either side blocks movement in both directions.
+        tile_b = self.map.tile_at(b)
+        boundary = HexBoundary(0)
+        boundary.set_edge_between(b, a)
+        blocked = MapUpdate(
+            3,
+            4,
+            [
+                t if t is not tile_b else _Tile(1, 2, boundary.edges)
+                for t in self.map.tiles
+            ],
+        )
+        self.assertTrue(blocked.get_edge_between(a, b))
+        self.assertTrue(blocked.get_edge_between(b, a))
+        # Off-map neighbors are blocked.
+        self.assertTrue(self.map.get_edge_between(a, HecsCoord.from_offset(2, 3)))
+
+    def test_lookup_tables_not_pickled(self):
+        self.map.grid()
+        self.map.tile_at(HecsCoord.origin())
+        unpickled = pickle.loads(pickle.dumps(self.map))
+        self.assertNotIn("_grid", unpickled.__dict__)
+        self.assertNotIn("_tiles_by_offset", unpickled.__dict__)
+        self.assertEqual(unpickled, self.map)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,132 @@
+import unittest
+from datetime import datetime
+
+import orjson
+
+from server.card_enums import Color, Shape
+from server.hex import HecsCoord
+from server.messages import message_from_server
+from server.messages.logs import LogEntryFromOutgoingMessage
+from server.messages.map_update import MapUpdate, SerializedMapUpdate
+from server.messages.message_from_server import MessageType
+from server.messages.prop import (
+    CardConfig,
+    GenericPropInfo,
+    Prop,
+    PropType,
+    PropUpdate,
+)
+from server.messages.state_sync import StateMachineTick, StateSync
+from server.wire_format import JoinSegments
+
+
+def Tick(iter):
+    return message_from_server.StateMachineTickFromServer(StateMachineTick(iter))
+
+
+class BatchTest(unittest.TestCase):
+    def test_coalesce_keeps_last_tick(self):
+        ping = message_from_server.PingMessageFromServer()
+        messages = [ping, Tick(1), ping, Tick(2), ping, Tick(3)]
+        coalesced = message_from_server.CoalesceMessages(messages)
+        self.assertEqual(
+            [m.type for m in coalesced],
+            [
+                MessageType.PING,
+                MessageType.PING,
+                MessageType.PING,
+                MessageType.STATE_MACHINE_TICK,
+            ],
+        )
+        self.assertEqual(coalesced[-1].state_machine_tick.iter, 3)
+
+    def test_batch_round_trip(self):
+        batch = message_from_server.BatchFromServer(
+            [message_from_server.PingMessageFromServer(), Tick(7)]
+        )
+        decoded = message_from_server.MessageFromServer.from_json(
+            orjson.dumps(batch, option=orjson.OPT_NAIVE_UTC)
+        )
+        self.assertEqual(decoded.type, MessageType.BATCH)
+        self.assertEqual(
+            [m.type for m in decoded.batch],
+            [MessageType.PING, MessageType.STATE_MACHINE_TICK],
+        )
+        self.assertEqual(decoded.batch[1].state_machine_tick.iter, 7)
+
+
+def Card(id, selected=False):
+    return Prop(
+        id,
+        PropType.CARD,
+        GenericPropInfo(HecsCoord.from_offset(0, id), 0, False, 0),
+        CardConfig(Color.RED, Shape.SQUARE, 1, selected),
+        None,
+    )
+
+
+class PropDeltaEncoderTest(unittest.TestCase):
+    def test_delta_after_first_update(self):
+        encoder = message_from_server.PropDeltaEncoder()
+        first = PropUpdate([Card(0), Card(1), Card(2)])
+        message = encoder.encode(message_from_server.PropUpdateFromServer(first))
+        self.assertEqual(message.type, MessageType.PROP_UPDATE)
+
+        second = PropUpdate([Card(0), Card(1, selected=True), Card(3)])
+        message = encoder.encode(message_from_server.PropUpdateFromServer(second))
+        self.assertEqual(message.type, MessageType.PROP_DELTA)
+        self.assertEqual([p.id for p in message.prop_delta.changed], [1, 3])
+        self.assertEqual(message.prop_delta.removed, [2])
+        applied = message.prop_delta.apply(first)
+        self.assertEqual(
+            sorted(applied.props, key=lambda p: p.id),
+            sorted(second.props, key=lambda p: p.id),
+        )
+
+    def test_state_sync_forces_full_update(self):
+        encoder = message_from_server.PropDeltaEncoder()
+        update = message_from_server.PropUpdateFromServer(PropUpdate([Card(0)]))
+        encoder.encode(update)
+        encoder.encode(message_from_server.StateSyncFromServer(StateSync(0, [])))
+        self.assertEqual(encoder.encode(update).type, MessageType.PROP_UPDATE)
+
+
+def Dumps(obj):
+    return orjson.dumps(
+        obj,
+        option=orjson.OPT_NAIVE_UTC | orjson.OPT_PASSTHROUGH_DATETIME,
+        default=datetime.isoformat,
+    )
+
+
+class SerializeMessageTest(unittest.TestCase):
+    def test_matches_orjson(self):
+        map_message = message_from_server.MapUpdateFromServer(MapUpdate(2, 3, []))
+        batch = message_from_server.BatchFromServer(
+            [message_from_server.PingMessageFromServer(), map_message, map_message]
+        )
+        for message in [map_message, batch, Tick(4)]:
+            self.assertEqual(
+                message_from_server.SerializeMessage(message), Dumps(message)
+            )
+
+    def test_segments_share_map(self):
+        map_update = MapUpdate(2, 3, [])
+        map_message = message_from_server.MapUpdateFromServer(map_update)
+        first = message_from_server.SerializeMessageSegments(map_message)
+        second = message_from_server.SerializeMessageSegments(map_message)
+        self.assertEqual(JoinSegments(first), Dumps(map_message))
+        self.assertIs(first[1], second[1])
+        self.assertEqual(first[1].data, SerializedMapUpdate(map_update))
+
+    def test_envelope(self):
+        message = message_from_server.MapUpdateFromServer(MapUpdate(2, 3, []))
+        envelope = lambda m: LogEntryFromOutgoingMessage(1, m)
+        self.assertEqual(
+            message_from_server.SerializeMessage(message, envelope),
+            Dumps(envelope(message)),
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
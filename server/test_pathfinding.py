@@ -0,0 +1,69 @@
+import random
+import unittest
+from collections import deque
+
+from server.hex import HecsCoord
+from server.pathfinding import FindPath, HexDistance
+
+ROWS, COLS = 12, 10
+
+
+def InMap(coord):
+    r, c = coord.to_offset_coordinates()
+    return 0 <= r < ROWS and 0 <= c < COLS
+
+
+def BfsDistances(start, blocked):
+    distances = {start: 0}
+    queue = deque([start])
+    while len(queue) > 0:
+        current = queue.popleft()
+        for neighbor in current.neighbors():
+            if neighbor in distances or neighbor in blocked or not InMap(neighbor):
+                continue
+            distances[neighbor] = distances[current] + 1
+            queue.append(neighbor)
+    return distances
+
+
+class PathfindingTest(unittest.TestCase):
+    def setUp(self):
+        random.seed(0)
+        self.coords = [
+            HecsCoord.from_offset(r, c) for r in range(ROWS) for c in range(COLS)
+        ]
+
+    def test_hex_distance_matches_bfs(self):
+        for start in random.sample(self.coords, 10):
+            distances = BfsDistances(start, set())
+            for coord in self.coords:
+                self.assertEqual(HexDistance(start, coord), distances[coord])
+
+    def test_find_path_is_shortest(self):
+        for _ in range(20):
+            blocked = set(random.sample(self.coords, 30))
+            start, end = random.sample(
+                [coord for coord in self.coords if coord not in blocked], 2
+            )
+            can_move = lambda _, b: InMap(b) and b not in blocked
+            path = FindPath(start, end, can_move)
+            distances = BfsDistances(start, blocked)
+            if end not in distances:
+                self.assertIsNone(path)
+                continue
+            self.assertEqual(path[0], start)
+            self.assertEqual(path[-1], end)
+            self.assertEqual(len(path) - 1, distances[end])
+            for a, b in zip(path, path[1:]):
+                self.assertTrue(a.is_adjacent_to(b))
+                self.assertTrue(can_move(a, b))
+
+    def test_unreachable(self):
+        start = HecsCoord.from_offset(5, 5)
+        end = HecsCoord.from_offset(0, 0)
+        walled_in = set(start.neighbors())
+        self.assertIsNone(FindPath(start, end, lambda _, b: b not in walled_in))
+
+
+if __name__ == "__main__":
+    unittest.main()
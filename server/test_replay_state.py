@@ -0,0 +1,92 @@
+import unittest
+
+import server.schemas.game as game_db
+from py_client.endpoint_pair import EndpointPair
+from py_client.game_endpoint import Action
+from py_client.local_game_coordinator import LocalGameCoordinator
+from server.config.config import Config, SetGlobalConfig
+from server.messages.rooms import Role
+from server.replay_state import ReplayState
+from server.schemas.base import (
+    ConnectDatabase,
+    CreateTablesIfNotExists,
+    SetDatabaseForTesting,
+)
+from server.schemas.defaults import ListDefaultTables
+
+
+class ReplayStateTest(unittest.TestCase):
+    def setUp(self):
+        self.config = Config(comment="Replay State Unit Test Config")
+        SetGlobalConfig(self.config)
+        SetDatabaseForTesting()
+        ConnectDatabase()
+        CreateTablesIfNotExists(ListDefaultTables())
+        # Record a short game to replay.
+        coordinator = LocalGameCoordinator(self.config)
+        game_name = coordinator.CreateGame(log_to_db=True)
+        endpoint_pair = EndpointPair(coordinator, game_name)
+        endpoint_pair.initialize()
+        for _ in range(3):
+            endpoint_pair.step(Action.SendInstruction("TEST"))
+            endpoint_pair.step(Action.EndTurn())
+            _, _, _, instructions, _, _ = endpoint_pair.step(Action.Left())
+            endpoint_pair.step(Action.Forwards())
+            active_instruction = [
+                i for i in instructions if not i.completed and not i.cancelled
+            ][0]
+            endpoint_pair.step(Action.InstructionDone(active_instruction.uuid))
+        state_machine = coordinator._state_machine_driver(game_name).state_machine()
+        state_machine._game_recorder.flush()
+        self.game_record = game_db.Game.select().get()
+
+    def start_replay(self, keyframe_interval):
+        replay = ReplayState("replay", self.game_record)
+        replay._keyframe_interval = keyframe_interval
+        self.player_id = replay.create_actor(Role.LEADER)
+        replay.update()
+        self.take_state(replay)
+        return replay
+
+    def take_state(self, replay):
+        """Returns the actor, instruction and prop messages sent after a seek."""
+        messages = []
+        replay.fill_messages(self.player_id, messages)
+        state = [m.state for m in messages if m.state is not None]
+        objectives = [m.objectives for m in messages if m.objectives is not None]
+        props = [m.prop_update for m in messages if m.prop_update is not None]
+        return state[-1:], objectives[-1:], props[-1:]
+
+    def test_seek_matches_full_replay(self):
+        """Seeking from keyframes gives the same state as integrating every event."""
+        keyframes = self.start_replay(keyframe_interval=4)
+        full_replay = self.start_replay(keyframe_interval=10**6)
+        num_events = len(keyframes._events)
+        self.assertGreater(num_events, 8)
+        # Scrub backwards, then seek around arbitrarily.
+        indices = list(range(num_events, keyframes._starting_index - 1, -1))
+        indices += [num_events // 2, 5, num_events, 9]
+        for index in indices:
+            keyframes.seek_event(index)
+            full_replay.seek_event(index)
+            self.assertEqual(
+                self.take_state(keyframes), self.take_state(full_replay), index
+            )
+        self.assertGreater(len(keyframes._keyframes), 1)
+        self.assertEqual(len(full_replay._keyframes), 0)
+
+    def test_rewind_event(self):
+        replay = self.start_replay(keyframe_interval=4)
+        while replay._event_index < len(replay._events):
+            replay.advance_event()
+        self.take_state(replay)
+        replay.rewind_event()
+        self.assertEqual(replay._event_index, len(replay._events) - 1)
+        state, objectives, props = self.take_state(replay)
+        self.assertEqual(len(state[0].actors), 2)
+        self.assertEqual(len(objectives[0]), 3)
+        self.assertGreater(len(props[0].props), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
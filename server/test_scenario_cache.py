@@ -0,0 +1,116 @@
+import os
+import tempfile
+import unittest
+import uuid
+
+from py_client.endpoint_pair import EndpointPair
+from py_client.game_endpoint import Action
+from py_client.local_game_coordinator import LocalGameCoordinator
+from server.config.config import Config, SetGlobalConfig
+from server.scenario_cache import ScenarioCache
+from server.scenario_util import ReconstructScenarioFromEvent
+from server.schemas.base import (
+    ConnectDatabase,
+    CreateTablesIfNotExists,
+    SetDatabaseForTesting,
+)
+from server.schemas.defaults import ListDefaultTables
+from server.schemas.event import Event, EventType
+
+
+class ScenarioCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tempdir.name, "scenario_cache.db")
+        self.config = Config(comment="Scenario Cache Unit Test Config")
+        SetGlobalConfig(self.config)
+        SetDatabaseForTesting()
+        ConnectDatabase()
+        CreateTablesIfNotExists(ListDefaultTables())
+        # Record a short game to reconstruct scenarios from.
+        coordinator = LocalGameCoordinator(self.config)
+        game_name = coordinator.CreateGame(log_to_db=True)
+        endpoint_pair = EndpointPair(coordinator, game_name)
+        endpoint_pair.initialize()
+        endpoint_pair.step(Action.SendInstruction("TEST"))
+        endpoint_pair.step(Action.EndTurn())
+        endpoint_pair.step(Action.Forwards())
+        state_machine = coordinator._state_machine_driver(game_name).state_machine()
+        state_machine._game_recorder.flush()
+        # Scenarios can be reconstructed from events after the first instruction.
+        instruction = Event.get(Event.type == EventType.INSTRUCTION_SENT)
+        self.event_uuids = [
+            event.id
+            for event in Event.select().where(
+                Event.server_time >= instruction.server_time
+            )
+        ]
+        self.assertGreater(len(self.event_uuids), 1)
+
+    def tearDown(self):
+        self.tempdir.cleanup()
+
+    def test_get(self):
+        cache = ScenarioCache(self.path)
+        expected, _ = ReconstructScenarioFromEvent(self.event_uuids[0].hex)
+        scenario, err = cache.get(self.event_uuids[0])
+        self.assertIsNone(err)
+        self.assertEqual(scenario, expected)
+        # Dashed and undashed UUIDs are the same key.
+        scenario, err = cache.get(str(self.event_uuids[0]))
+        self.assertEqual(scenario, expected)
+        self.assertEqual(cache.stats()["misses"], 1)
+        self.assertEqual(cache.stats()["hits"], 1)
+        cache.close()
+
+        # Scenarios persist across restarts.
+        cache = ScenarioCache(self.path)
+        scenario, err = cache.get(self.event_uuids[0].hex)
+        self.assertEqual(scenario, expected)
+        self.assertEqual(cache.stats()["disk_hits"], 1)
+        self.assertEqual(cache.stats()["misses"], 0)
+        cache.close()
+
+    def test_db_version(self):
+        cache = ScenarioCache(self.path, db_version="a")
+        cache.get(self.event_uuids[0])
+        cache.close()
+        cache = ScenarioCache(self.path, db_version="b")
+        cache.get(self.event_uuids[0])
+        self.assertEqual(cache.stats()["misses"], 1)
+        cache.close()
+
+    def test_precompute(self):
+        cache = ScenarioCache(self.path)
+        self.assertEqual(
+            cache.precompute(self.event_uuids + self.event_uuids), len(self.event_uuids)
+        )
+        self.assertEqual(cache.precompute(self.event_uuids), 0)
+        cache.close()
+        cache = ScenarioCache(self.path, capacity=1)
+        for event_uuid in self.event_uuids:
+            scenario, err = cache.get(event_uuid)
+            self.assertIsNotNone(scenario)
+        self.assertEqual(cache.stats()["misses"], 0)
+        self.assertEqual(cache.stats()["size"], 1)
+        cache.close()
+
+    def test_precompute_in_chunks(self):
+        cache = ScenarioCache(self.path)
+        cache._STORE_CHUNK_SIZE = 2
+        self.assertEqual(cache.precompute(self.event_uuids), len(self.event_uuids))
+        cache.close()
+        cache = ScenarioCache(self.path, capacity=0)
+        self.assertEqual(cache.precompute(self.event_uuids), 0)
+        cache.close()
+
+    def test_missing_event(self):
+        cache = ScenarioCache()
+        scenario, err = cache.get(uuid.uuid4())
+        self.assertIsNone(scenario)
+        self.assertIsNotNone(err)
+        self.assertEqual(cache.stats()["size"], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,7 +1,11 @@
 """Unit tests for state machine code."""
 import logging
 import os
+import random
 import unittest
+from datetime import datetime
+
+import numpy as np
 
 os.environ["PYGAME_HIDE_SUPPORT_PROMPT"] = ""  # Hide pygame welcome message
 
@@ -18,7 +22,11 @@ from server.schemas.base import (
     SetDatabaseForTesting,
 )
 from server.schemas.defaults import ListDefaultTables
-from server.state import FOLLOWER_MOVES_PER_TURN, LEADER_MOVES_PER_TURN
+from server.state import (
+    FOLLOWER_MOVES_PER_TURN,
+    LEADER_MOVES_PER_TURN,
+    LEADER_SECONDS_PER_TURN,
+)
 
 logger = logging.getLogger(__name__)
 
@@ -231,5 +239,143 @@ class RandomRealtimeLocalSelfPlayTest(unittest.TestCase):
             follower_moved = False
 
 
+def play_random_game(coordinator, game_name):
+    """Plays a random game. Returns what the acting player saw each step."""
+    endpoint_pair = EndpointPair(coordinator, game_name)
+    endpoint_pair.initialize()
+    _, _, turn_state, instructions, _, _ = endpoint_pair.initial_state()
+    history = []
+    while not endpoint_pair.over():
+        action_mask = endpoint_pair.action_mask()
+        if turn_state.moves_remaining > 0:
+            action = random.choice([Action.Forwards(), Action.Left(), Action.Right()])
+            if not action_mask[action.action_code().value]:
+                action = Action.Left()
+        elif turn_state.turn == Role.FOLLOWER:
+            action = Action.InstructionDone(get_active_instruction(instructions).uuid)
+        elif has_instruction_available(instructions):
+            action = Action.EndTurn()
+        else:
+            action = Action.SendInstruction("TEST")
+        (
+            map_update,
+            props,
+            turn_state,
+            instructions,
+            actors,
+            _,
+        ) = endpoint_pair.step(action)
+        history.append(
+            (
+                turn_state.turn,
+                turn_state.moves_remaining,
+                turn_state.turns_left,
+                turn_state.score,
+                len(map_update.tiles),
+                [(a.location(), a.heading_degrees()) for a in actors],
+                sorted(
+                    (p.id, p.prop_info.location, p.card_init.selected) for p in props
+                ),
+                [(i.text, i.completed, i.cancelled) for i in instructions],
+                action_mask.tolist(),
+            )
+        )
+    return history
+
+
+class DirectEndpointTest(unittest.TestCase):
+    """Checks that direct endpoints see the same game as message-based ones."""
+
+    def setUp(self):
+        self.config = Config(comment="Direct Endpoint Unit Test Config")
+        SetGlobalConfig(self.config)
+
+    def play(self, direct_endpoints):
+        random.seed(42)
+        np.random.seed(42)
+        coordinator = LocalGameCoordinator(
+            self.config, direct_endpoints=direct_endpoints
+        )
+        game_name = coordinator.CreateGame(log_to_db=False)
+        history = play_random_game(coordinator, game_name)
+        return history, coordinator.TickCount(game_name)
+
+    def test_same_game(self):
+        message_history, message_ticks = self.play(direct_endpoints=False)
+        direct_history, direct_ticks = self.play(direct_endpoints=True)
+        self.assertGreater(len(message_history), 0)
+        self.assertEqual(direct_history, message_history)
+        self.assertEqual(direct_ticks, message_ticks)
+
+
+class VirtualClockTest(unittest.TestCase):
+    def setUp(self):
+        self.config = Config(comment="Virtual Clock Unit Test Config")
+        SetGlobalConfig(self.config)
+
+    def test_turn_timeout(self):
+        """A leader which never acts loses its turn after LEADER_SECONDS_PER_TURN of game time."""
+        coordinator = LocalGameCoordinator(
+            self.config, direct_endpoints=True, virtual_step_s=1.0
+        )
+        game_name = coordinator.CreateGame(log_to_db=False)
+        endpoint_pair = EndpointPair(coordinator, game_name)
+        endpoint_pair.initialize()
+        _, _, turn_state, _, _, _ = endpoint_pair.initial_state()
+        turns_left = turn_state.turns_left
+        start_time = datetime.utcnow()
+        _, _, turn_state, _, _, _ = endpoint_pair.step(Action.NoopAction())
+        # Without instructions, the follower's turn is skipped.
+        self.assertEqual(turn_state.turn, Role.LEADER)
+        self.assertEqual(turn_state.turns_left, turns_left - 1)
+        state_machine = coordinator._state_machine_driver(game_name).state_machine()
+        self.assertGreaterEqual(
+            state_machine.game_time().total_seconds(), LEADER_SECONDS_PER_TURN
+        )
+        self.assertLess((datetime.utcnow() - start_time).total_seconds(), 10)
+
+
+class ForkTest(unittest.TestCase):
+    def setUp(self):
+        self.config = Config(comment="Fork Unit Test Config")
+        SetGlobalConfig(self.config)
+
+    def test_fork_game(self):
+        """Branches from one position replay identically and leave it unchanged."""
+        coordinator = LocalGameCoordinator(self.config, direct_endpoints=True)
+        game_name = coordinator.CreateGame(log_to_db=False)
+        state_machine = coordinator._state_machine_driver(game_name).state_machine()
+        cards = [(card.id, card.location) for card in state_machine.cards()]
+        histories = []
+        for _ in range(2):
+            random.seed(42)
+            np.random.seed(42)
+            fork_name = coordinator.ForkGame(game_name)
+            histories.append(play_random_game(coordinator, fork_name))
+        self.assertGreater(len(histories[0]), 0)
+        self.assertEqual(histories[0], histories[1])
+        self.assertEqual(
+            [(card.id, card.location) for card in state_machine.cards()], cards
+        )
+        self.assertEqual(len(state_machine.player_ids()), 0)
+
+    def test_checkpoint_restores_rng(self):
+        coordinator = LocalGameCoordinator(self.config)
+        game_name = coordinator.CreateGame(log_to_db=False)
+        state_machine = coordinator._state_machine_driver(game_name).state_machine()
+        checkpoint = state_machine.checkpoint()
+        branches = []
+        new_cards = []
+        for _ in range(2):
+            branch = checkpoint.restore()
+            new_cards.append(
+                [card.location for card in branch._map_provider.add_random_cards(3)]
+            )
+            branches.append(branch)
+        self.assertEqual(new_cards[0], new_cards[1])
+        self.assertEqual(len(branches[0].cards()), len(state_machine.cards()) + 3)
+        self.assertEqual(len(branches[1].cards()), len(state_machine.cards()) + 3)
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,89 @@
+"""Unit tests for the StateMachineDriver tick scheduler."""
+import asyncio
+import time
+import unittest
+
+from server.state_machine_driver import StateMachineDriver
+
+
+class FakeStateMachine(object):
+    """Counts updates. Idle (no deadline) unless told otherwise."""
+
+    def __init__(self):
+        self.updates = 0
+        self.drained = []
+        self.deadline = None
+        self._done = False
+
+    def start(self):
+        pass
+
+    def done(self):
+        return self._done
+
+    def end_game(self):
+        self._done = True
+
+    def on_game_over(self):
+        pass
+
+    def update(self):
+        self.updates += 1
+
+    def seconds_until_deadline(self):
+        return self.deadline
+
+    def drain_messages(self, id, messages):
+        self.drained.extend(messages)
+
+    def player_ids(self):
+        return []
+
+
+class TickSchedulerTest(unittest.TestCase):
+    def test_idle_room_sleeps(self):
+        async def run():
+            state_machine = FakeStateMachine()
+            driver = StateMachineDriver(state_machine, 0, tick_rate_hz=100)
+            task = asyncio.create_task(driver.run())
+            await asyncio.sleep(0.2)
+            driver.end_game()
+            await asyncio.wait_for(task, 1)
+            return state_machine.updates
+
+        # Legacy mode would update thousands of times here.
+        self.assertLess(asyncio.run(run()), 5)
+
+    def test_message_wakes_room(self):
+        async def run():
+            state_machine = FakeStateMachine()
+            driver = StateMachineDriver(state_machine, 0, tick_rate_hz=100)
+            task = asyncio.create_task(driver.run())
+            await asyncio.sleep(0.05)
+            start = time.time()
+            driver.drain_messages(0, ["message"])
+            while len(state_machine.drained) == 0:
+                await asyncio.sleep(0.001)
+            latency = time.time() - start
+            driver.end_game()
+            await asyncio.wait_for(task, 1)
+            return latency
+
+        self.assertLess(asyncio.run(run()), 0.1)
+
+    def test_tick_rate_limit(self):
+        async def run():
+            state_machine = FakeStateMachine()
+            state_machine.deadline = 0  # Always busy.
+            driver = StateMachineDriver(state_machine, 0, tick_rate_hz=20)
+            task = asyncio.create_task(driver.run())
+            await asyncio.sleep(0.5)
+            driver.end_game()
+            await asyncio.wait_for(task, 1)
+            return state_machine.updates
+
+        self.assertLessEqual(asyncio.run(run()), 12)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -48,3 +48,30 @@ class TestLagMonitor(unittest.TestCase):
         expected_timestamps_2 = [0, 60, 120]
         for i in range(len(timestamps)):
             self.assertAlmostEqual(timestamps[i], expected_timestamps_2[i], places=3)
+
+
+class TestVirtualClock(unittest.TestCase):
+    def test_step(self):
+        clock = util.VirtualClock(step_s=0.5)
+        start = clock.utcnow()
+        start_time = clock.time()
+        clock.step()
+        clock.step()
+        self.assertEqual((clock.utcnow() - start).total_seconds(), 1.0)
+        self.assertEqual(clock.time() - start_time, 1.0)
+        clock.advance(10)
+        self.assertEqual((clock.utcnow() - start).total_seconds(), 11.0)
+
+    def test_count_down_timer(self):
+        clock = util.VirtualClock()
+        timer = util.CountDownTimer(2, clock=clock)
+        timer.start()
+        clock.advance(1)
+        self.assertFalse(timer.expired())
+        self.assertEqual(timer.time_remaining().total_seconds(), 1)
+        timer.pause()
+        clock.advance(5)
+        timer.start()
+        self.assertFalse(timer.expired())
+        clock.advance(1.5)
+        self.assertTrue(timer.expired())
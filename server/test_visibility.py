@@ -0,0 +1,66 @@
+"""Unit tests for the follower visibility tables."""
+import itertools
+import unittest
+
+from server.hex import HecsCoord
+from server.visibility import FOLLOWER_FOV, UNITY_COORDINATES_SCALE, GetVisibilityTable
+
+
+def _IsVisible(location, heading, coord, fog_end):
+    """Computes visibility directly, without a table."""
+    if coord in [
+        location.neighbor_at_heading(heading - 60),
+        location.neighbor_at_heading(heading + 60),
+    ]:
+        return True
+    distance = location.distance_to(coord)
+    if distance > fog_end / UNITY_COORDINATES_SCALE + 0.5:
+        return False
+    if distance == 0:
+        return True
+    degrees_to = location.degrees_to_precise(coord) % 360
+    left = (heading - 60 - FOLLOWER_FOV / 2) % 360
+    right = (heading - 60 + FOLLOWER_FOV / 2) % 360
+    if left < right:
+        return left <= degrees_to <= right
+    else:
+        return left <= degrees_to or degrees_to <= right
+
+
+class VisibilityTableTest(unittest.TestCase):
+    def test_matches_direct_computation(self):
+        locations = [HecsCoord(0, 0, 0), HecsCoord(1, 3, 4), HecsCoord(0, 7, 2)]
+        coords = [
+            HecsCoord(a, r, c)
+            for a, r, c in itertools.product(range(2), range(-10, 15), range(-10, 15))
+        ]
+        for fog_end in [0, 10, 20]:
+            for heading in range(0, 360, 60):
+                table = GetVisibilityTable(heading, fog_end)
+                for location in locations:
+                    expected = set(
+                        coord
+                        for coord in coords
+                        if _IsVisible(location, heading, coord, fog_end)
+                    )
+                    actual = set(
+                        coord for coord in coords if table.is_visible(location, coord)
+                    )
+                    self.assertEqual(actual, expected)
+                    self.assertEqual(set(table.visible_coordinates(location)), expected)
+
+    def test_neighbors_always_visible(self):
+        table = GetVisibilityTable(0, 0)
+        location = HecsCoord(1, 2, 2)
+        self.assertTrue(table.is_visible(location, location))
+        self.assertTrue(table.is_visible(location, location.neighbor_at_heading(-60)))
+        self.assertTrue(table.is_visible(location, location.neighbor_at_heading(60)))
+        self.assertFalse(table.is_visible(location, location.neighbor_at_heading(0)))
+
+    def test_tables_are_cached(self):
+        self.assertIs(GetVisibilityTable(120, 20), GetVisibilityTable(120.0, 20))
+        self.assertIsNot(GetVisibilityTable(120, 20), GetVisibilityTable(180, 20))
+
+
+if __name__ == "__main__":
+    unittest.main()
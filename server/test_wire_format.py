@@ -0,0 +1,69 @@
+import unittest
+import zlib
+
+import orjson
+
+from server.messages import message_from_server
+from server.wire_format import (
+    COMPRESSION_THRESHOLD_BYTES,
+    DecodeFrame,
+    EncodeFrame,
+    FrameEncoding,
+    JoinSegments,
+    SharedSegment,
+)
+
+
+class WireFormatTest(unittest.TestCase):
+    def test_small_message_is_not_compressed(self):
+        message = orjson.dumps(message_from_server.PingMessageFromServer())
+        frame = EncodeFrame(message)
+        self.assertEqual(frame[0], FrameEncoding.RAW_JSON)
+        self.assertEqual(DecodeFrame(frame), message)
+
+    def test_large_message_is_not_compressed(self):
+        # Compressing costs more than serializing. Only maps are compressed.
+        message = orjson.dumps({"tiles": ["GROUND_TILE"] * 1000})
+        self.assertGreater(len(message), COMPRESSION_THRESHOLD_BYTES)
+        frame = EncodeFrame(message)
+        self.assertEqual(frame[0], FrameEncoding.RAW_JSON)
+        self.assertEqual(DecodeFrame(frame), message)
+
+    def test_deflate_json_is_decoded(self):
+        message = orjson.dumps({"tiles": ["GROUND_TILE"] * 1000})
+        frame = bytes([FrameEncoding.DEFLATE_JSON]) + zlib.compress(message)
+        self.assertEqual(DecodeFrame(frame), message)
+
+    def test_decoded_frame_parses(self):
+        message = message_from_server.PingMessageFromServer()
+        frame = EncodeFrame(orjson.dumps(message, option=orjson.OPT_NAIVE_UTC))
+        decoded = message_from_server.MessageFromServer.from_json(DecodeFrame(frame))
+        self.assertEqual(decoded.type, message_from_server.MessageType.PING)
+
+    def test_segmented_message_round_trip(self):
+        shared = SharedSegment(orjson.dumps({"tiles": ["GROUND_TILE"] * 1000}))
+        # The rest of the message is stored uncompressed.
+        segments = [b'{"type":"map_update","map_update":', shared, b"}" * 2000]
+        frame = EncodeFrame(segments)
+        self.assertEqual(frame[0], FrameEncoding.DEFLATE_SEGMENTS_JSON)
+        self.assertLess(len(frame), len(shared.data))
+        self.assertGreater(len(frame), 2000)
+        self.assertEqual(DecodeFrame(frame), JoinSegments(segments))
+        # The shared segment is only compressed once.
+        deflated = shared.deflated()
+        self.assertEqual(DecodeFrame(EncodeFrame(segments)), JoinSegments(segments))
+        self.assertIs(shared.deflated(), deflated)
+
+    def test_small_segmented_message_is_not_compressed(self):
+        segments = [b'{"map_update":', SharedSegment(b"{}"), b"}"]
+        frame = EncodeFrame(segments)
+        self.assertEqual(frame[0], FrameEncoding.RAW_JSON)
+        self.assertEqual(DecodeFrame(frame), JoinSegments(segments))
+
+    def test_unknown_encoding(self):
+        with self.assertRaises(ValueError):
+            DecodeFrame(bytes([255]) + b"{}")
+
+
+if __name__ == "__main__":
+    unittest.main()
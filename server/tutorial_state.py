@@ -1062,6 +1062,10 @@ class TutorialGameState(object):
                 return False
         return True
 
+    def seconds_until_deadline(self):
+        """Used by StateMachineDriver's tick scheduler. Always 0, as this state machine is polled every tick."""
+        return 0
+
     def on_game_over(self):
         # Make sure to mark the game's end time.
         self._tutorial_record.end_time = datetime.now()
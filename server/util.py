@@ -77,6 +77,55 @@ def GetCommitHash():
         return repo.head.object.hexsha
 
 
+class WallClock(object):
+    """Real time. This is the default clock for State and CountDownTimer.
+
+    step() is called once per state machine update and does nothing here. See
+    VirtualClock.
+    """
+
+    def utcnow(self) -> datetime:
+        return datetime.utcnow()
+
+    def time(self) -> float:
+        return time.time()
+
+    def step(self):
+        pass
+
+
+class VirtualClock(WallClock):
+    """Simulated time, for running games faster (or slower) than real time.
+
+    Starts at the wall clock time when it's created, and only moves forward
+    when step() or advance() is called. The state machine calls step() once
+    per update, so game time is a deterministic function of the number of
+    updates. With step_s=0, time stands still and turns never time out.
+    """
+
+    def __init__(self, step_s: float = 0):
+        self._step_s = step_s
+        self._start = datetime.utcnow()
+        self._start_time = time.time()
+        self._elapsed_s = 0.0
+
+    def utcnow(self) -> datetime:
+        return self._start + timedelta(seconds=self._elapsed_s)
+
+    def time(self) -> float:
+        return self._start_time + self._elapsed_s
+
+    def step(self):
+        self._elapsed_s += self._step_s
+
+    def advance(self, seconds: float):
+        """Moves time forward by the given number of seconds."""
+        self._elapsed_s += seconds
+
+
+WALL_CLOCK = WallClock()
+
+
 class CountDownTimer(object):
     """A timer used to track if a certain duration has elapsed.
 
@@ -85,10 +134,13 @@ class CountDownTimer(object):
     clear() stops the timer, resetting all state. If the timer is not
     started, expired() will return False.
 
+    Time is read from clock, which defaults to the wall clock.
+
     """
 
-    def __init__(self, duration_s: float = 0):
+    def __init__(self, duration_s: float = 0, clock: WallClock = WALL_CLOCK):
         self._duration_s = duration_s
+        self._clock = clock
         self._end_time = None
         self._remaining_duration_s = None
 
@@ -97,14 +149,14 @@ class CountDownTimer(object):
         if self._end_time is not None:
             return
         if self._remaining_duration_s is None:
-            self._end_time = time.time() + self._duration_s
+            self._end_time = self._clock.time() + self._duration_s
             return
-        self._end_time = time.time() + self._remaining_duration_s
+        self._end_time = self._clock.time() + self._remaining_duration_s
 
     def pause(self):
         """Pauses the timer -- stores the currently elapsed time in _base_elapsed and sets _end_time to None."""
         if self._end_time is not None:
-            self._remaining_duration_s = self._end_time - time.time()
+            self._remaining_duration_s = self._end_time - self._clock.time()
         self._end_time = None
 
     def clear(self):
@@ -112,17 +164,21 @@ class CountDownTimer(object):
         self._end_time = None
         self._remaining_duration_s = None
 
+    def running(self):
+        """Returns true if the timer has been started (and not paused or cleared)."""
+        return self._end_time is not None
+
     def time_remaining(self):
         """Returns the remaining time. If the timer is not started, returns 0."""
         if self._end_time is None:
             return timedelta(seconds=0)
-        return timedelta(seconds=(self._end_time - time.time()))
+        return timedelta(seconds=(self._end_time - self._clock.time()))
 
     def expired(self):
         """Returns true if the timer has expired."""
         if self._end_time is None:
             return False
-        return time.time() > self._end_time
+        return self._clock.time() > self._end_time
 
 
 # Btw, everything in class LatencyMonitor (including the class and method
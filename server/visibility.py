@@ -0,0 +1,103 @@
+""" Precomputed follower visibility.
+
+Whether the follower can see a tile depends only on the tile's displacement
+from the follower, the follower's heading and the fog distance. HECS addition
+is a translation on the grid (even across rows of different parity), so the
+set of visible tiles can be computed once per (heading, fog_end, fov) as a
+table of offsets relative to the follower, then moved to the follower's
+location with HecsCoord.add. This turns visibility checks into a subtraction
+and a set lookup instead of a BFS with sqrt and atan2 at every tile.
+
+Used by the py_client follower masking and the follower bot crop mask.
+"""
+
+import functools
+import math
+from collections import deque
+from typing import List
+
+from server.hex import HecsCoord
+
+# The width of the follower vision cone in degrees (horizontal). Don't change this without opening Unity and changing the actual follower's FOV (unless you suspect this value isn't accurate).
+FOLLOWER_FOV = 96.5
+
+# For various reasons, Unity coordinates are scaled from hex cartesian
+# coordinates. This is mostly to line up with a bunch of convenient defaults in
+# Unity (camera clipping planes, model sizes, render detail settings, etc). This
+# value MUST equal the scale value in game/Assets/Scripts/HexGrid.cs. Don't
+# change this without changing that (make sure it's also done in Unity's UI on
+# the object component, not just in source code. The default in the editor might
+# overwrite that value due to the way Unity works).
+UNITY_COORDINATES_SCALE = 3.46
+
+
+def _OffsetInView(offset: HecsCoord, heading: float, fog_end: float, fov: float):
+    """Returns true if a tile at offset from the follower is in its vision cone."""
+    view_depth = fog_end / UNITY_COORDINATES_SCALE
+    x, y = offset.cartesian()
+    # Add 0.5 to round up to the next hex cell.
+    if math.sqrt(x**2 + y**2) > view_depth + 0.5:
+        return False
+    # There's something wrong with orientation... I have to put - 60 everywhere
+    # Actor.heading_degrees() (actor.py) is used.
+    follower_orientation = heading - 60
+    degrees_to = math.degrees(math.atan2(y, x)) % 360
+    left = (follower_orientation - fov / 2) % 360
+    right = (follower_orientation + fov / 2) % 360
+    if left < right:
+        return left <= degrees_to <= right
+    else:
+        return left <= degrees_to or degrees_to <= right
+
+
+class VisibilityTable(object):
+    """The tiles visible to a follower, relative to the follower's location."""
+
+    def __init__(self, offsets: List[HecsCoord]):
+        self._offsets = tuple(offsets)
+        self._offset_set = frozenset(offsets)
+
+    def offsets(self):
+        return self._offsets
+
+    def visible_coordinates(self, location: HecsCoord) -> List[HecsCoord]:
+        """Returns all coordinates visible from location."""
+        return [HecsCoord.add(location, offset) for offset in self._offsets]
+
+    def is_visible(self, location: HecsCoord, coord: HecsCoord) -> bool:
+        """Returns true if coord is visible from location."""
+        return HecsCoord.sub(coord, location) in self._offset_set
+
+
+@functools.lru_cache(maxsize=64)
+def GetVisibilityTable(
+    heading: float, fog_end: float, fov: float = FOLLOWER_FOV
+) -> VisibilityTable:
+    """Returns the visibility table for a follower with the given heading.
+
+    Tables are cached. Followers only ever face one of six headings, so in
+    practice there are six tables per fog distance.
+    """
+    origin = HecsCoord.origin()
+    # The two neighboring cells to the left and right are always visible.
+    offsets = [
+        origin.neighbor_at_heading(heading - 60),
+        origin.neighbor_at_heading(heading + 60),
+    ]
+    # BFS from the follower's location, find all visible coordinates.
+    next_offsets = deque([origin])
+    already_visited = set(offsets)
+    while len(next_offsets) > 0:
+        offset = next_offsets.popleft()
+        if offset in already_visited:
+            continue
+        already_visited.add(offset)
+        if offset != origin and not _OffsetInView(offset, heading, fog_end, fov):
+            continue
+        offsets.append(offset)
+        next_offsets.extend(offset.neighbors())
+    return VisibilityTable(offsets)
+
+
+def VisibilityTableForActor(follower_actor, fog_end: float) -> VisibilityTable:
+    return GetVisibilityTable(follower_actor.heading_degrees(), fog_end)
@@ -0,0 +1,128 @@
+""" Framing for messages sent from the server to clients over the websocket.
+
+Clients select a wire format when connecting to /player_endpoint with the
+`encoding` query parameter:
+
+    json (default): Each message is a utf-8 JSON text frame. This is what the
+        browser client expects.
+    binary: Each message is a binary frame. The first byte of the frame is a
+        FrameEncoding value describing the rest of the frame, which is the
+        same JSON document either as-is or deflate-compressed.
+
+Since the server already serializes messages with orjson (which produces
+bytes), the binary format skips the bytes -> str -> bytes round trip that
+sending text frames requires.
+
+Compressing a message costs more CPU than serializing it, so only maps are
+compressed. Maps are the largest messages, and each one is sent many times.
+Messages which contain a map are sent as a raw deflate stream made of
+separate segments. The map's segment is a SharedSegment, which is compressed
+once and reused every time the map is sent. The rest of the message is
+stored in the stream uncompressed. Other messages are sent as-is.
+"""
+
+import zlib
+from enum import Enum, IntEnum
+from typing import List, Union
+
+# Messages with a map which are smaller than this are sent uncompressed.
+COMPRESSION_THRESHOLD_BYTES = 512
+
+# Level 1 is ~5x faster than the default level and only slightly larger for
+# our messages.
+COMPRESSION_LEVEL = 1
+
+
+class WireFormat(Enum):
+    JSON = "json"
+    BINARY = "binary"
+
+
+class FrameEncoding(IntEnum):
+    RAW_JSON = 0
+    # No longer sent by the server, but still decoded.
+    DEFLATE_JSON = 1
+    # A raw deflate stream (no zlib header), concatenated from separately
+    # compressed segments.
+    DEFLATE_SEGMENTS_JSON = 2
+
+
+class SharedSegment(object):
+    """Part of a message which is sent many times, like a serialized map.
+
+    It's compressed the first time it's sent in a frame, and the compressed
+    bytes are reused for every later frame.
+    """
+
+    def __init__(self, data: bytes):
+        self.data = data
+        self._deflated = None
+
+    def deflated(self) -> bytes:
+        if self._deflated is None:
+            self._deflated = _DeflateSegment(self.data)
+        return self._deflated
+
+
+def _DeflateSegment(data: bytes, level: int = COMPRESSION_LEVEL) -> bytes:
+    # A full flush ends the output on a byte boundary without ending the
+    # stream, and nothing after it refers back to earlier data. So separately
+    # compressed segments can be concatenated into one stream. Level 0 stores
+    # the data uncompressed, which costs about as much as copying it.
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+    return compressor.compress(data) + compressor.flush(zlib.Z_FULL_FLUSH)
+
+
+# An empty final block, which ends a stream of segments.
+_DEFLATE_END = zlib.compressobj(
+    COMPRESSION_LEVEL, zlib.DEFLATED, -zlib.MAX_WBITS
+).flush()
+
+
+def JoinSegments(segments: List[Union[bytes, SharedSegment]]) -> bytes:
+    return b"".join(
+        segment.data if isinstance(segment, SharedSegment) else segment
+        for segment in segments
+    )
+
+
+def EncodeFrame(message: Union[bytes, List[Union[bytes, SharedSegment]]]) -> bytes:
+    """Wraps a serialized JSON message into a binary frame.
+
+    message is either bytes, or a list of bytes and SharedSegments which make
+    up the message when joined (see JoinSegments()). Only SharedSegments are
+    compressed.
+    """
+    if not isinstance(message, bytes):
+        segments = message
+        if not any(isinstance(segment, SharedSegment) for segment in segments):
+            return EncodeFrame(JoinSegments(segments))
+        size = sum(
+            len(segment.data if isinstance(segment, SharedSegment) else segment)
+            for segment in segments
+        )
+        if size < COMPRESSION_THRESHOLD_BYTES:
+            return bytes([FrameEncoding.RAW_JSON]) + JoinSegments(segments)
+        parts = [bytes([FrameEncoding.DEFLATE_SEGMENTS_JSON])]
+        for segment in segments:
+            if isinstance(segment, SharedSegment):
+                parts.append(segment.deflated())
+            elif len(segment) > 0:
+                parts.append(_DeflateSegment(segment, level=0))
+        parts.append(_DEFLATE_END)
+        return b"".join(parts)
+    return bytes([FrameEncoding.RAW_JSON]) + message
+
+
+def DecodeFrame(frame: bytes) -> bytes:
+    """Returns the JSON message contained in a binary frame."""
+    if len(frame) == 0:
+        raise ValueError("Empty frame.")
+    encoding = frame[0]
+    if encoding == FrameEncoding.RAW_JSON:
+        return frame[1:]
+    if encoding == FrameEncoding.DEFLATE_JSON:
+        return zlib.decompress(frame[1:])
+    if encoding == FrameEncoding.DEFLATE_SEGMENTS_JSON:
+        return zlib.decompress(frame[1:], -zlib.MAX_WBITS)
+    raise ValueError(f"Unknown frame encoding: {encoding}")